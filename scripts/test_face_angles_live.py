@@ -1,26 +1,127 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import mediapipe as mp
 from ultralytics import YOLO
-from quality_checker import VideoQualityChecker
+from quality_checker import VideoQualityChecker, POSE_LABELS
+from services.face_processing import YOLO_HALF
 
 # --- CONFIG ---
 YOLO_MODEL_PATH = 'yolo/weights/yolo11n-face.pt'  # Update this path
+YOLO_BATCH_SIZE = 4  # frames sent to YOLO per call
+RECORD_SECONDS = 20  # length of the test recording
 
 # --- Initialize ---
+# Per-face angle lines are logged at DEBUG; set the level to DEBUG to see them
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 checker = VideoQualityChecker(YOLO_MODEL_PATH)
 
+# --- Pose estimation workers ---
+# Faces of a frame are estimated in parallel; each worker thread keeps its own FaceMesh,
+# since one instance cannot be used by several threads at once
+POSE_WORKERS = min(4, os.cpu_count() or 1)
+pose_pool = ThreadPoolExecutor(max_workers=POSE_WORKERS)
+_pose_local = threading.local()
+
+def estimate_pose(frame, bbox):
+    face_mesh = getattr(_pose_local, 'face_mesh', None)
+    if face_mesh is None:
+        face_mesh = checker.create_face_mesh()
+        _pose_local.face_mesh = face_mesh
+    return checker.estimate_face_pose(frame, bbox, face_mesh)
+
 # --- Helper for overlay ---
+# Labels repeat from frame to frame, so each one is rendered once and then copied in
+_text_layers = {}
+
+def draw_text(frame, text, org, scale, color, thickness):
+    """Same result as cv2.putText with FONT_HERSHEY_SIMPLEX, from a cached rendering of text"""
+    key = (text, scale, color, thickness)
+    if key not in _text_layers:
+        (text_w, text_h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        origin = (thickness, text_h + thickness)
+        layer = np.zeros((text_h + baseline + 2 * thickness, text_w + 2 * thickness, 3), np.uint8)
+        cv2.putText(layer, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+        _text_layers[key] = (layer, layer.any(axis=2), origin)
+    layer, mask, origin = _text_layers[key]
+
+    # Clip the layer to the part that lands inside the frame
+    x0, y0 = org[0] - origin[0], org[1] - origin[1]
+    height, width = frame.shape[:2]
+    fx0, fy0 = max(x0, 0), max(y0, 0)
+    fx1, fy1 = min(x0 + layer.shape[1], width), min(y0 + layer.shape[0], height)
+    if fx1 <= fx0 or fy1 <= fy0:
+        return
+    rows = slice(fy0 - y0, fy1 - y0)
+    cols = slice(fx0 - x0, fx1 - x0)
+    np.copyto(frame[fy0:fy1, fx0:fx1], layer[rows, cols], where=mask[rows, cols, None])
+
 def draw_face_angle_overlay(frame, bbox, angle_label, angle_count):
     x1, y1, x2, y2 = bbox
     cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    if angle_label is None:
+        return
     label = f"{angle_label} | {angle_count}"
-    cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+    draw_text(frame, label, (x1, y1 - 10), 0.7, (0, 255, 255), 2)
+
+# --- Threaded capture ---
+class VideoCaptureThreading:
+    """Reads frames from a cv2.VideoCapture on a daemon thread and keeps only the latest one,
+    so decoding the next frame overlaps with running YOLO on the current one"""
+
+    def __init__(self, src=0):
+        self.cap = cv2.VideoCapture(src)
+        self.grabbed, self.frame = self.cap.read()
+        self.frame_id = 0  # bumped for every frame the thread reads
+        self.read_id = -1  # frame_id of the frame last handed out by read()
+        self.started = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def start(self):
+        if self.started:
+            return self
+        self.started = True
+        self.thread = threading.Thread(target=self.update, daemon=True)
+        self.thread.start()
+        return self
+
+    def update(self):
+        while self.started:
+            grabbed, frame = self.cap.read()
+            with self.condition:
+                self.grabbed, self.frame = grabbed, frame
+                self.frame_id += 1
+                self.condition.notify_all()
+            if not grabbed:
+                break
+
+    def read(self):
+        """Latest frame, waiting for one newer than the last returned so none is processed twice"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_id != self.read_id or not self.started, timeout=1.0)
+            self.read_id = self.frame_id
+            return self.grabbed, self.frame
+
+    def stop(self):
+        self.started = False
+        if self.thread is not None:
+            self.thread.join()
+        self.cap.release()
 
 # --- Main loop ---
 
 
-cap = cv2.VideoCapture(0)
+cap = VideoCaptureThreading(0).start()
 
 # Get video properties for output
 frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -29,66 +130,109 @@ fps = cap.get(cv2.CAP_PROP_FPS)
 if fps == 0 or np.isnan(fps):
     fps = 24  # fallback default
 
-# Define the codec and create VideoWriter object
-fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-out = cv2.VideoWriter('test_result.mp4', fourcc, fps, (frame_width, frame_height))
+def open_video_writer(path, fps, size):
+    """
+    Open a VideoWriter for path, preferring a hardware-accelerated H.264 encoder through
+    OpenCV's FFmpeg backend and falling back to the CPU mp4v codec when that is unavailable
+    """
+    if hasattr(cv2, 'VIDEOWRITER_PROP_HW_ACCELERATION'):
+        writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*'avc1'), fps, size,
+                                 [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if writer.isOpened():
+            return writer
+        writer.release()
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+
+# Create VideoWriter object
+out = open_video_writer('test_result.mp4', fps, (frame_width, frame_height))
+
+# Frames are encoded on their own thread; the bounded queue makes the loop wait
+# rather than pile up frames if the encoder falls behind
+write_q = queue.Queue(maxsize=8)
+
+def writer_loop():
+    while True:
+        frame = write_q.get()
+        if frame is None:
+            break
+        out.write(frame)
+
+writer_thread = threading.Thread(target=writer_loop, daemon=True)
+writer_thread.start()
 
 # Accumulate unique face angles across all frames
 global_face_angles_seen = set()
 
+start_time = time.monotonic()
 while True:
-    if 'start_time' not in locals():
-        import time
-        start_time = time.time()
-
-    ret, frame = cap.read()
-    if not ret:
+    # Collect a few frames and run YOLO on them in one call
+    frames_batch = []
+    capture_ended = False
+    while len(frames_batch) < YOLO_BATCH_SIZE:
+        ret, frame = cap.read()
+        if not ret:
+            capture_ended = True
+            break
+        frames_batch.append(frame)
+    if not frames_batch:
         break
 
     # Detect faces with YOLO
-    results = checker.yolo_model(frame, conf=0.45)
-    face_bboxes = []
-    face_angle_labels = []
-    frame_angles_seen = set()
-
-    if len(results) > 0 and hasattr(results[0], 'boxes') and len(results[0].boxes) > 0:
-        for box in results[0].boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            bbox = (x1, y1, x2, y2)
-            face_img = frame[y1:y2, x1:x2]
-            if face_img.size == 0:
-                continue
-            # Estimate face angle
-            angle_label, yaw, pitch, roll = checker.estimate_face_pose(frame, bbox)
-            print(f"[DEBUG] Angle: {angle_label}, Yaw: {yaw:.2f}, Pitch: {pitch:.2f}, Roll: {roll:.2f}")
-            global_face_angles_seen.add(angle_label)
-            frame_angles_seen.add(angle_label)
-            face_bboxes.append(bbox)
-            face_angle_labels.append(angle_label)
-
-    # Draw overlays
-    for bbox, angle_label in zip(face_bboxes, face_angle_labels):
-        draw_face_angle_overlay(frame, bbox, angle_label, len(global_face_angles_seen))
-
-    # Show info
-    cv2.putText(frame, f"Unique face angles detected: {len(global_face_angles_seen)}", (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
-
-    out.write(frame)
-
-    # Stop after 60 seconds or on keypress
-    if time.time() - start_time > 20:
-        print("[INFO] 60 seconds elapsed. Stopping recording.")
+    results_list = checker.yolo_model(frames_batch, conf=0.45, half=YOLO_HALF, verbose=False)
+
+    for frame, results in zip(frames_batch, results_list):
+        # Surviving face boxes, clamped to the frame, and the angle label of each
+        face_bboxes = []
+        face_angle_labels = []
+
+        if hasattr(results, 'boxes') and len(results.boxes) > 0:
+            # Clamp all boxes to the frame at once and drop the empty ones
+            height, width = frame.shape[:2]
+            xyxy = results.boxes.xyxy.cpu().numpy().astype(np.int32)
+            np.clip(xyxy, 0, [width, height, width, height], out=xyxy)
+            xyxy = xyxy[(xyxy[:, 2] > xyxy[:, 0]) & (xyxy[:, 3] > xyxy[:, 1])]
+            face_bboxes = [tuple(box) for box in xyxy.tolist()]
+            # Once every possible angle has been seen, new estimates cannot change the
+            # result, so faces are only boxed
+            if len(global_face_angles_seen) >= len(POSE_LABELS):
+                face_angle_labels = [None] * len(face_bboxes)
+            else:
+                # Estimate face angles, all faces of the frame at once
+                poses = pose_pool.map(lambda bbox: estimate_pose(frame, bbox), face_bboxes)
+                for angle_label, yaw, pitch, roll in poses:
+                    logger.debug("Angle: %s, Yaw: %.2f, Pitch: %.2f, Roll: %.2f", angle_label, yaw, pitch, roll)
+                    face_angle_labels.append(angle_label)
+                global_face_angles_seen.update(face_angle_labels)
+
+        # Draw overlays
+        for bbox, angle_label in zip(face_bboxes, face_angle_labels):
+            draw_face_angle_overlay(frame, bbox, angle_label, len(global_face_angles_seen))
+
+        # Show info
+        draw_text(frame, f"Unique face angles detected: {len(global_face_angles_seen)}", (10, 30),
+                  1, (255, 0, 0), 2)
+
+        write_q.put(frame)
+
+    if capture_ended:
+        break
+
+    # Stop after RECORD_SECONDS or on keypress
+    if time.monotonic() - start_time > RECORD_SECONDS:
+        print(f"[INFO] {RECORD_SECONDS} seconds elapsed. Stopping recording.")
         break
     if cv2.waitKey(1) & 0xFF == ord('q'):
         print("[INFO] 'q' pressed. Stopping recording.")
         break
 
-cap.release()
+cap.stop()
+pose_pool.shutdown()
+write_q.put(None)
+writer_thread.join()
 out.release()
 
 # Print result in terminal
-print("\n[RESULT] Unique face angles detected in 60 seconds:")
+print(f"\n[RESULT] Unique face angles detected in {RECORD_SECONDS} seconds:")
 if global_face_angles_seen:
     print(", ".join(sorted(global_face_angles_seen)))
 else:
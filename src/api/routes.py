@@ -3,7 +3,6 @@ import cv2
 import numpy as np
 import base64
 import json
-import shutil
 from typing import List, Optional, Dict, Any, Union
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
 from fastapi.responses import JSONResponse, FileResponse
@@ -21,24 +20,22 @@ from services.collection_app_service import (
     start_collection_app, stop_collection_app, get_collection_app_status,
     get_collection_app_config
 )
-from services.face_processing import extract_frames, detect_and_crop_faces
+from services.face_processing import extract_faces_from_video
 from utils.path_utils import get_gallery_path, get_data_path
 from config.settings import BASE_DIR, BASE_GALLERY_DIR, BASE_DATA_DIR, STUDENT_DATA_DIR, DEFAULT_MODEL_PATH, DEFAULT_YOLO_PATH
 import database.models as database
-from ml.gallery_operations import create_gallery, update_gallery, create_gallery_from_embeddings, update_gallery_from_embeddings
+from ml.gallery_operations import (
+    create_gallery, update_gallery, create_gallery_from_embeddings, update_gallery_from_embeddings,
+    gallery_exists, delete_gallery_files, GALLERY_EMBEDDINGS_SUFFIX
+)
 from ml.embeddings import load_model, extract_embedding
-from quality_checker import VideoQualityChecker
+from quality_checker import get_quality_checker as get_shared_quality_checker
 from services.auth_service import authenticate_user, add_admin_user, delete_admin_user, list_admin_users
 from database.models import get_students_by_dept_and_batch
-# Global quality checker instance
-DEFAULT_QUALITY_CHECKER = None
 
 def get_quality_checker():
-    """Get or create quality checker instance"""
-    global DEFAULT_QUALITY_CHECKER
-    if DEFAULT_QUALITY_CHECKER is None:
-        DEFAULT_QUALITY_CHECKER = VideoQualityChecker(DEFAULT_YOLO_PATH)
-    return DEFAULT_QUALITY_CHECKER
+    """Get the shared quality checker instance"""
+    return get_shared_quality_checker(DEFAULT_YOLO_PATH)
 
 def create_app() -> FastAPI:
     app = FastAPI(title="Face Recognition Gallery Manager", 
@@ -135,8 +132,9 @@ def create_app() -> FastAPI:
     @app.get("/batches", summary="Get available batch years and departments")
     async def get_batches():
         """Get available batch years and departments."""
-        years = database.get_batch_years()
-        departments = database.get_departments()
+        with database.db_session() as conn:
+            years = database.get_batch_years(conn)
+            departments = database.get_departments(conn)
         print(f"DEBUG: Years: {years}")
         print(f"DEBUG: Departments: {departments}")
         return {
@@ -158,7 +156,10 @@ def create_app() -> FastAPI:
         print(f"DEBUG: All files in {BASE_GALLERY_DIR}: {all_files}")
         
         for file in all_files:
-            if file.endswith(".pth"):
+            # Galleries are listed by their .pth name, whichever format they are stored in
+            if file.endswith(".pth" + GALLERY_EMBEDDINGS_SUFFIX):
+                file = file[:-len(GALLERY_EMBEDDINGS_SUFFIX)]
+            if file.endswith(".pth") and file not in galleries:
                 galleries.append(file)
                 print(f"DEBUG: Found gallery file: {file}")
         
@@ -193,10 +194,11 @@ def create_app() -> FastAPI:
         - videos_dir: Path to directory containing student videos
         """
         # Validation code remains the same
-        if year not in database.get_batch_years():
-            raise HTTPException(status_code=400, detail=f"Invalid batch year: {year}")
-        if department not in database.get_department_ids():  # use department IDs instead of names
-            raise HTTPException(status_code=400, detail=f"Invalid department: {department}")
+        with database.db_session() as conn:
+            if year not in database.get_batch_years(conn):
+                raise HTTPException(status_code=400, detail=f"Invalid batch year: {year}")
+            if department not in database.get_department_ids(conn):  # use department IDs instead of names
+                raise HTTPException(status_code=400, detail=f"Invalid department: {department}")
         
         if not os.path.exists(videos_dir):
             raise HTTPException(status_code=400, detail=f"Directory not found: {videos_dir}")
@@ -230,20 +232,13 @@ def create_app() -> FastAPI:
                 student_dir = os.path.join(data_path, student_name)
                 os.makedirs(student_dir, exist_ok=True)
                 
-                # Extract frames temporarily for face detection
-                temp_frames_dir = os.path.join(student_dir, "temp_frames")
-                frame_paths = extract_frames(video_path, temp_frames_dir, max_frames=20, interval=5)
-                print(f"Extracted {len(frame_paths)} frames")
-                processed_frames += len(frame_paths)
-                
-                # Extract faces from frames
-                video_faces = 0
-                for frame_path in frame_paths:
-                    face_paths = detect_and_crop_faces(frame_path, student_dir)
-                    video_faces += len(face_paths)
-                    
-                # Clean up temp frames
-                shutil.rmtree(temp_frames_dir, ignore_errors=True)
+                # Extract faces straight from the decoded frames, sampling 6 per second of
+                # video (every 5th frame at 30 FPS) whatever the frame rate
+                frame_count, face_paths = extract_faces_from_video(video_path, student_dir, max_frames=20,
+                                                                   interval=5, sample_fps=6)
+                print(f"Used {frame_count} frames")
+                processed_frames += frame_count
+                video_faces = len(face_paths)
                 
                 extracted_faces += video_faces
                 processed_videos += 1
@@ -259,7 +254,7 @@ def create_app() -> FastAPI:
         
         try:
             # Create or update gallery using the extracted faces
-            if os.path.exists(gallery_path):
+            if gallery_exists(gallery_path):
                 update_gallery(DEFAULT_MODEL_PATH, gallery_path, data_path, gallery_path)
             else:
                 create_gallery(DEFAULT_MODEL_PATH, data_path, gallery_path)
@@ -347,22 +342,23 @@ def create_app() -> FastAPI:
 
     @app.delete("/batches/year/{year}", status_code=200, summary="Delete a batch year")
     async def delete_batch_year(year: str):
-        # Check if any galleries are using this year in the database
-        galleries = database.list_all_galleries()
-        year_galleries = [g for g in galleries if g['year'] == year]
-        
-        if year_galleries:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Cannot delete year '{year}' as it is used by {len(year_galleries)} galleries"
-            )
-        
-        if year not in database.get_batch_years():
-            raise HTTPException(status_code=404, detail=f"Batch year '{year}' not found")
-        
-        success = database.delete_batch_year(year)
-        if not success:
-            raise HTTPException(status_code=404, detail=f"Batch year '{year}' not found")
+        with database.db_session() as conn:
+            # Check if any galleries are using this year in the database
+            galleries = database.list_all_galleries(conn)
+            year_galleries = [g for g in galleries if g['year'] == year]
+            
+            if year_galleries:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Cannot delete year '{year}' as it is used by {len(year_galleries)} galleries"
+                )
+            
+            if year not in database.get_batch_years(conn):
+                raise HTTPException(status_code=404, detail=f"Batch year '{year}' not found")
+            
+            success = database.delete_batch_year(year, conn)
+            if not success:
+                raise HTTPException(status_code=404, detail=f"Batch year '{year}' not found")
         
         return {"message": f"Deleted batch year: {year}", "success": True}
 
@@ -387,24 +383,25 @@ def create_app() -> FastAPI:
 
     @app.delete("/batches/department/{department_id}", status_code=200, summary="Delete a department")
     async def delete_department(department_id: str):
-        # Check if any galleries are using this department in the database
-        galleries = database.list_all_galleries()
-        dept_galleries = [g for g in galleries if g['department_id'] == department_id]
-        
-        if dept_galleries:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Cannot delete department '{department_id}' as it is used by {len(dept_galleries)} galleries"
-            )
-        
-        # Check if department exists
-        dept_info = database.get_department_by_id(department_id)
-        if not dept_info:
-            raise HTTPException(status_code=404, detail=f"Department with ID '{department_id}' not found")
-        
-        success = database.delete_department(department_id)
-        if not success:
-            raise HTTPException(status_code=404, detail=f"Department with ID '{department_id}' not found")
+        with database.db_session() as conn:
+            # Check if any galleries are using this department in the database
+            galleries = database.list_all_galleries(conn)
+            dept_galleries = [g for g in galleries if g['department_id'] == department_id]
+            
+            if dept_galleries:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Cannot delete department '{department_id}' as it is used by {len(dept_galleries)} galleries"
+                )
+            
+            # Check if department exists
+            dept_info = database.get_department_by_id(department_id, conn)
+            if not dept_info:
+                raise HTTPException(status_code=404, detail=f"Department with ID '{department_id}' not found")
+            
+            success = database.delete_department(department_id, conn)
+            if not success:
+                raise HTTPException(status_code=404, detail=f"Department with ID '{department_id}' not found")
         
         return {"message": f"Deleted department: {dept_info['name']} (ID: {department_id})", "success": True}
 
@@ -456,21 +453,22 @@ def create_app() -> FastAPI:
     async def delete_gallery(year: str, department: str):
         """Delete a gallery file and remove it from the database"""
         # Validate batch year and department
-        if year not in database.get_batch_years():
-            raise HTTPException(status_code=400, detail=f"Invalid batch year: {year}")
-        if department not in database.get_department_ids():  # use department IDs instead of names
-            raise HTTPException(status_code=400, detail=f"Invalid department: {department}")
+        with database.db_session() as conn:
+            if year not in database.get_batch_years(conn):
+                raise HTTPException(status_code=400, detail=f"Invalid batch year: {year}")
+            if department not in database.get_department_ids(conn):  # use department IDs instead of names
+                raise HTTPException(status_code=400, detail=f"Invalid department: {department}")
         
         # Get gallery path
         gallery_path = get_gallery_path(year, department)
         
         # Check if gallery exists
-        if not os.path.exists(gallery_path):
+        if not gallery_exists(gallery_path):
             raise HTTPException(status_code=404, detail=f"No gallery found for {department} {year}")
         
         try:
-            # Remove gallery file
-            os.remove(gallery_path)
+            # Remove gallery files
+            delete_gallery_files(gallery_path)
             
             # Remove from database
             database.remove_gallery(year, department)
@@ -486,16 +484,17 @@ def create_app() -> FastAPI:
     async def sync_gallery_with_database(year: str, department: str):
         """Sync an existing gallery file with the database"""
         # Validate batch year and department
-        if year not in database.get_batch_years():
-            raise HTTPException(status_code=400, detail=f"Invalid batch year: {year}")
-        if department not in database.get_department_ids():  # use department IDs instead of names
-            raise HTTPException(status_code=400, detail=f"Invalid department: {department}")
+        with database.db_session() as conn:
+            if year not in database.get_batch_years(conn):
+                raise HTTPException(status_code=400, detail=f"Invalid batch year: {year}")
+            if department not in database.get_department_ids(conn):  # use department IDs instead of names
+                raise HTTPException(status_code=400, detail=f"Invalid department: {department}")
         
         # Get gallery path
         gallery_path = get_gallery_path(year, department)
         
         # Check if gallery exists
-        if not os.path.exists(gallery_path):
+        if not gallery_exists(gallery_path):
             raise HTTPException(status_code=404, detail=f"No gallery found for {department} {year}")
         
         try:
@@ -539,16 +538,16 @@ def create_app() -> FastAPI:
             gallery_paths = []
             for gallery_name in galleries:
                 gallery_path = os.path.join(BASE_GALLERY_DIR, gallery_name)
-                if os.path.exists(gallery_path):
+                if gallery_exists(gallery_path):
                     gallery_paths.append(gallery_path)
             
             if not gallery_paths:
                 raise HTTPException(status_code=400, detail="No valid galleries found")
             
-            # Recognize faces
+            # Recognize faces; the decoded upload is not needed afterwards, so annotate it directly
             try:
                 result_img, detected_faces = recognize_faces(
-                    img, gallery_paths, DEFAULT_MODEL_PATH, DEFAULT_YOLO_PATH, threshold
+                    img, gallery_paths, DEFAULT_MODEL_PATH, DEFAULT_YOLO_PATH, threshold, inplace=True
                 )
                 
                 # Ensure detected_faces is a list
@@ -757,11 +756,14 @@ def create_app() -> FastAPI:
 
     @app.post("/student-data/{dept}/{year}/quality-check", 
               summary="Check quality of student videos")
-    async def check_student_data_quality(dept: str, year: str):
-        """Check quality of all student videos in a department-year before processing"""
+    async def check_student_data_quality(dept: str, year: str, force: bool = False):
+        """
+        Check quality of all student videos in a department-year before processing.
+        Videos unchanged since their last check keep their result unless force is set.
+        """
         try:
             quality_checker = get_quality_checker()
-            result = quality_checker.check_student_data_quality(dept, year, STUDENT_DATA_DIR)
+            result = quality_checker.check_student_data_quality(dept, year, STUDENT_DATA_DIR, force=force)
             
             if 'error' in result:
                 raise HTTPException(status_code=404, detail=result['error'])
@@ -1,2 +1,2 @@
-from .connection import get_db_connection, DB_PATH
+from .connection import get_db_connection, db_session, use_connection, DB_PATH
 from .models import *
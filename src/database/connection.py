@@ -15,3 +15,31 @@ def get_db_connection():
         yield conn
     finally:
         conn.close()
+
+@contextmanager
+def use_connection(conn=None):
+    """
+    Reuse the caller's connection if one is given, otherwise open a new one.
+    A new connection is committed when the block succeeds; a caller's connection is
+    left for the caller (e.g. db_session) to commit or roll back.
+    """
+    if conn is not None:
+        yield conn
+    else:
+        with get_db_connection() as new_conn:
+            yield new_conn
+            new_conn.commit()
+
+@contextmanager
+def db_session():
+    """
+    Share one connection across several model calls that form a logical unit.
+    Commits when the block succeeds and rolls back if it raises.
+    """
+    with get_db_connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
@@ -1,34 +1,29 @@
 from typing import List, Optional, Dict, Any
 import sqlite3
 import json
-from .connection import get_db_connection
+from .connection import get_db_connection, use_connection
 
-def init_db():
-    """Initialize the database with required tables."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Create batch_years table
-        cursor.execute('''
+# Every statement the models execute, keyed by name, so the SQL lives in one place.
+# sqlite3 caches prepared statements per connection by SQL text, so only calls
+# sharing a connection (see db_session) reuse each other's parsed statements.
+_SQL = {
+    # Schema
+    "create_batch_years": '''
         CREATE TABLE IF NOT EXISTS batch_years (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             year TEXT UNIQUE NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        ''')
-        
-        # Create departments table with custom department_id
-        cursor.execute('''
+        ''',
+    "create_departments": '''
         CREATE TABLE IF NOT EXISTS departments (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             department_id TEXT UNIQUE NOT NULL,
             name TEXT UNIQUE NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        ''')
-        
-        # Create galleries table to track gallery files
-        cursor.execute('''
+        ''',
+    "create_galleries": '''
         CREATE TABLE IF NOT EXISTS galleries (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             year_id INTEGER,
@@ -40,10 +35,8 @@ def init_db():
             FOREIGN KEY (year_id) REFERENCES batch_years (id),
             FOREIGN KEY (department_id) REFERENCES departments (id)
         )
-        ''')
-
-        # Create quality_check_reports table
-        cursor.execute('''
+        ''',
+    "create_quality_check_reports": '''
         CREATE TABLE IF NOT EXISTS quality_check_reports (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             department TEXT NOT NULL,
@@ -55,10 +48,8 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(department, year, created_at)
         )
-        ''')
-
-        # Create quality_check_results table
-        cursor.execute('''
+        ''',
+    "create_quality_check_results": '''
         CREATE TABLE IF NOT EXISTS quality_check_results (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             report_id INTEGER,
@@ -67,9 +58,8 @@ def init_db():
             issues TEXT,
             FOREIGN KEY (report_id) REFERENCES quality_check_reports (id)
         )
-        ''')
-
-        cursor.execute('''
+        ''',
+    "create_students": '''
         CREATE TABLE IF NOT EXISTS students (
             id INTEGER PRIMARY KEY AUTOINCREMENT,    
             register_no BIGINT,
@@ -82,23 +72,191 @@ def init_db():
             semester TEXT,
             section TEXT DEFAULT NULL
         )
-        ''')
+        ''',
+    "add_students_section": "ALTER TABLE students ADD COLUMN section TEXT DEFAULT NULL",
+    "create_students_register_no_index": "CREATE UNIQUE INDEX IF NOT EXISTS idx_students_register_no ON students (register_no)",
+    "count_batch_years": "SELECT COUNT(*) FROM batch_years",
+    "count_departments": "SELECT COUNT(*) FROM departments",
+    "seed_batch_year": "INSERT OR IGNORE INTO batch_years (year) VALUES (?)",
+    "seed_department": "INSERT OR IGNORE INTO departments (department_id, name) VALUES (?, ?)",
+
+    # Batch years
+    "batch_years": "SELECT year FROM batch_years ORDER BY year",
+    "batch_year_id": "SELECT id FROM batch_years WHERE year = ?",
+    "insert_batch_year": "INSERT OR IGNORE INTO batch_years (year) VALUES (?)",
+    "delete_batch_year": "DELETE FROM batch_years WHERE year = ?",
+
+    # Departments
+    "departments": "SELECT department_id, name FROM departments ORDER BY name, department_id",
+    "department_names": "SELECT name FROM departments ORDER BY name",
+    "department_ids": "SELECT department_id FROM departments ORDER BY name",
+    "department_by_id": "SELECT department_id, name FROM departments WHERE department_id = ?",
+    "department_by_name": "SELECT department_id, name FROM departments WHERE name = ?",
+    "department_row_id": "SELECT id FROM departments WHERE name = ?",
+    "department_by_name_or_id": '''
+        SELECT department_id, name FROM departments
+        WHERE name = ? OR department_id = ?
+        ORDER BY name = ? DESC LIMIT 1
+        ''',
+    "department_by_partial_id": "SELECT department_id, name FROM departments WHERE department_id LIKE ?",
+    "insert_department": "INSERT INTO departments (department_id, name) VALUES (?, ?)",
+    "delete_department": "DELETE FROM departments WHERE department_id = ?",
+
+    # Galleries
+    "gallery_info": '''
+        SELECT g.*, by.year, d.name as department_name, d.department_id
+        FROM galleries g
+        JOIN batch_years by ON g.year_id = by.id
+        JOIN departments d ON g.department_id = d.id
+        WHERE by.year = ? AND d.name = ?
+        ''',
+    "register_gallery": '''
+        INSERT OR REPLACE INTO galleries (year_id, department_id, file_path, identity_count, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''',
+    "update_gallery_count": '''
+        UPDATE galleries 
+        SET identity_count = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE file_path = ?
+        ''',
+    "list_galleries": '''
+        SELECT g.*, by.year, d.name as department_name, d.department_id
+        FROM galleries g
+        JOIN batch_years by ON g.year_id = by.id
+        JOIN departments d ON g.department_id = d.id
+        ORDER BY by.year, d.name
+        ''',
+    "remove_gallery": '''
+        DELETE FROM galleries 
+        WHERE year_id = (SELECT id FROM batch_years WHERE year = ?)
+        AND department_id = (SELECT id FROM departments WHERE name = ?)
+        ''',
+
+    # Statistics
+    "database_stats": '''
+        SELECT
+            (SELECT COUNT(*) FROM batch_years) AS batch_count,
+            (SELECT COUNT(*) FROM departments) AS dept_count,
+            (SELECT COUNT(*) FROM galleries) AS gallery_count,
+            (SELECT COALESCE(SUM(identity_count), 0) FROM galleries) AS total_identities
+        ''',
+
+    # Quality check reports
+    "latest_report_id": '''
+        SELECT id FROM quality_check_reports 
+        WHERE department = ? AND year = ?
+        ORDER BY created_at DESC LIMIT 1
+        ''',
+    "latest_report": '''
+        SELECT * FROM quality_check_reports 
+        WHERE department = ? AND year = ?
+        ORDER BY created_at DESC LIMIT 1
+        ''',
+    "delete_report_results": "DELETE FROM quality_check_results WHERE report_id = ?",
+    "delete_report": "DELETE FROM quality_check_reports WHERE id = ?",
+    "insert_report": '''
+        INSERT INTO quality_check_reports (department, year, total_checked, passed_count, failed_count, borderline_count)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''',
+    "insert_result": '''
+        INSERT INTO quality_check_results (report_id, student_id, status)
+        VALUES (?, ?, ?)
+        ''',
+    "insert_borderline_result": '''
+        INSERT INTO quality_check_results (report_id, student_id, status, issues)
+        VALUES (?, ?, 'borderline', ?)
+        ''',
+    "reports": "SELECT * FROM quality_check_reports ORDER BY created_at DESC",
+    "reports_by_department": "SELECT * FROM quality_check_reports WHERE department = ? ORDER BY created_at DESC",
+    "reports_by_year": "SELECT * FROM quality_check_reports WHERE year = ? ORDER BY created_at DESC",
+    "reports_by_department_year": "SELECT * FROM quality_check_reports WHERE department = ? AND year = ? ORDER BY created_at DESC",
+    "report_by_id": "SELECT * FROM quality_check_reports WHERE id = ?",
+    "report_results": "SELECT * FROM quality_check_results WHERE report_id = ?",
+    "report_result_statuses": '''
+        SELECT student_id, status, issues FROM quality_check_results 
+        WHERE report_id = ?
+        ''',
+
+    # Students
+    "students_by_dept_and_batch": "SELECT * FROM students WHERE department_id = ? AND batch = ?",
+    "upsert_student": '''
+        INSERT INTO students (register_no, name, department, batch, section)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (register_no) DO UPDATE SET
+            name = excluded.name,
+            department = excluded.department,
+            batch = excluded.batch,
+            section = excluded.section
+        ''',
+    # Used instead of the upsert on databases whose duplicate register numbers kept
+    # init_db from creating the unique index it needs
+    "update_student": '''
+        UPDATE students
+        SET name = ?, department = ?, batch = ?, section = ?
+        WHERE register_no = ?
+        ''',
+    "insert_student": '''
+        INSERT INTO students (register_no, name, department, batch, section)
+        VALUES (?, ?, ?, ?, ?)
+        ''',
+}
+
+def _fetch_dicts(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    """Fetch all remaining rows as dicts, reading the column names only once."""
+    columns = [column[0] for column in cursor.description]
+    rows = cursor.fetchall()
+    if len(set(columns)) == len(columns):
+        return [dict(zip(columns, row)) for row in rows]
+    
+    # Joined queries can repeat a column name; keep the first one like dict(sqlite3.Row)
+    keep = [columns.index(name) for name in dict.fromkeys(columns)]
+    names = [columns[i] for i in keep]
+    return [dict(zip(names, [row[i] for i in keep])) for row in rows]
+
+def init_db():
+    """Initialize the database with required tables."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Create batch_years table
+        cursor.execute(_SQL["create_batch_years"])
+        
+        # Create departments table with custom department_id
+        cursor.execute(_SQL["create_departments"])
+        
+        # Create galleries table to track gallery files
+        cursor.execute(_SQL["create_galleries"])
+
+        # Create quality_check_reports table
+        cursor.execute(_SQL["create_quality_check_reports"])
+
+        # Create quality_check_results table
+        cursor.execute(_SQL["create_quality_check_results"])
+
+        cursor.execute(_SQL["create_students"])
         
         # Add section column to existing students table if it doesn't exist
         try:
-            cursor.execute("ALTER TABLE students ADD COLUMN section TEXT DEFAULT NULL")
+            cursor.execute(_SQL["add_students_section"])
         except sqlite3.OperationalError:
             # Column already exists
             pass
+        
+        # One row per register number; save_student_to_database upserts on it
+        try:
+            cursor.execute(_SQL["create_students_register_no_index"])
+        except sqlite3.IntegrityError:
+            # save_student_to_database falls back to update-or-insert without it
+            print("Warning: duplicate register numbers in students table, unique index not created")
 
         # Insert default data if tables are empty
-        cursor.execute("SELECT COUNT(*) FROM batch_years")
+        cursor.execute(_SQL["count_batch_years"])
         if cursor.fetchone()[0] == 0:
             default_years = ["2029", "2028", "2027", "2026"]
-            cursor.executemany("INSERT OR IGNORE INTO batch_years (year) VALUES (?)", 
+            cursor.executemany(_SQL["seed_batch_year"], 
                               [(year,) for year in default_years])
         
-        cursor.execute("SELECT COUNT(*) FROM departments")
+        cursor.execute(_SQL["count_departments"])
         if cursor.fetchone()[0] == 0:
             default_departments = [
                 ("DPT001", "CS"),
@@ -107,159 +265,132 @@ def init_db():
                 ("DPT004", "EEE"),
                 ("DPT005", "CIVIL")
             ]
-            cursor.executemany("INSERT OR IGNORE INTO departments (department_id, name) VALUES (?, ?)", 
+            cursor.executemany(_SQL["seed_department"], 
                              default_departments)
         
         conn.commit()
 
-def get_batch_years():
+def get_batch_years(conn: Optional[sqlite3.Connection] = None):
     """Get all batch years from the database."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT year FROM batch_years ORDER BY year")
+        cursor.execute(_SQL["batch_years"])
         return [row['year'] for row in cursor.fetchall()]
 
-def get_departments():
+def get_departments(conn: Optional[sqlite3.Connection] = None):
     """Get all departments from the database."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT department_id, name FROM departments ORDER BY name, department_id")
+        cursor.execute(_SQL["departments"])
         return [{"id": row['department_id'], "name": row['name']} for row in cursor.fetchall()]
 
-def get_department_names():
+def get_department_names(conn: Optional[sqlite3.Connection] = None):
     """Get just the department names (for backward compatibility)."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT name FROM departments ORDER BY name")
+        cursor.execute(_SQL["department_names"])
         return [row['name'] for row in cursor.fetchall()]
 
-def get_department_ids():
+def get_department_ids(conn: Optional[sqlite3.Connection] = None):
     """Get just the department IDs (for backward compatibility)."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT department_id FROM departments ORDER BY name")
+        cursor.execute(_SQL["department_ids"])
         return [row['department_id'] for row in cursor.fetchall()]
 
-def get_department_by_id(department_id: str) -> Optional[Dict[str, str]]:
+def get_department_by_id(department_id: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, str]]:
     """Get department by its custom ID."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT department_id, name FROM departments WHERE department_id = ?", (department_id,))
+        cursor.execute(_SQL["department_by_id"], (department_id,))
         row = cursor.fetchone()
         if row:
             return {"name": row['name']}
         return None
 
-def get_department_by_name(name: str) -> Optional[Dict[str, str]]:
+def get_department_by_name(name: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, str]]:
     """Get department by its name."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT department_id, name FROM departments WHERE name = ?", (name,))
+        cursor.execute(_SQL["department_by_name"], (name,))
         row = cursor.fetchone()
         if row:
             return {"id": row['department_id'], "name": row['name']}
         return None
 
-def get_department_by_name_or_id(name_or_id: str) -> Optional[Dict[str, str]]:
+def get_department_by_name_or_id(name_or_id: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, str]]:
     """Get department by either its name or ID."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        print(f"Looking for department with name or ID: {name_or_id}")
-        
-        # Try to find by name first
-        cursor.execute("SELECT department_id, name FROM departments WHERE name = ?", (name_or_id,))
+        # One lookup by name or ID, preferring a name match
+        cursor.execute(_SQL["department_by_name_or_id"], (name_or_id, name_or_id, name_or_id))
         row = cursor.fetchone()
-        if row:
-            print(f"Found by name: ID={row['department_id']}, Name={row['name']}")
-            return {"department_id": row['department_id'], "name": row['name']}
-        
-        # Then try by ID
-        cursor.execute("SELECT department_id, name FROM departments WHERE department_id = ?", (name_or_id,))
-        row = cursor.fetchone()
-        if row:
-            print(f"Found by ID: ID={row['department_id']}, Name={row['name']}")
-            return {"department_id": row['department_id'], "name": row['name']}
         
         # Special case: check if the name_or_id is a numeric string that might be stored incorrectly
-        if name_or_id.isdigit():
-            cursor.execute("SELECT department_id, name FROM departments WHERE department_id LIKE ?", (f"%{name_or_id}%",))
+        if row is None and name_or_id.isdigit():
+            cursor.execute(_SQL["department_by_partial_id"], (f"%{name_or_id}%",))
             row = cursor.fetchone()
-            if row:
-                print(f"Found by partial ID match: ID={row['department_id']}, Name={row['name']}")
-                return {"department_id": row['department_id'], "name": row['name']}
         
-        print(f"Department not found: {name_or_id}")
+        if row:
+            return {"department_id": row['department_id'], "name": row['name']}
         return None
 
-def add_batch_year(year):
+def add_batch_year(year, conn: Optional[sqlite3.Connection] = None):
     """Add a new batch year to the database."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO batch_years (year) VALUES (?)", (year,))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            # Year already exists
-            return False
+        cursor.execute(_SQL["insert_batch_year"], (year,))
+        # Nothing is inserted if the year already exists
+        return cursor.rowcount > 0
 
-def delete_batch_year(year):
+def delete_batch_year(year, conn: Optional[sqlite3.Connection] = None):
     """Delete a batch year from the database."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM batch_years WHERE year = ?", (year,))
-        conn.commit()
+        cursor.execute(_SQL["delete_batch_year"], (year,))
         return cursor.rowcount > 0
 
-def add_department(department_id: str, name: str):
+def add_department(department_id: str, name: str, conn: Optional[sqlite3.Connection] = None):
     """Add a new department to the database with custom ID."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
         try:
-            cursor.execute("INSERT INTO departments (department_id, name) VALUES (?, ?)", (department_id, name))
-            conn.commit()
+            cursor.execute(_SQL["insert_department"], (department_id, name))
             return True
         except sqlite3.IntegrityError:
             # Department ID or name already exists
             return False
 
-def delete_department(department_id: str):
+def delete_department(department_id: str, conn: Optional[sqlite3.Connection] = None):
     """Delete a department from the database by its custom ID."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM departments WHERE department_id = ?", (department_id,))
-        conn.commit()
+        cursor.execute(_SQL["delete_department"], (department_id,))
         return cursor.rowcount > 0
 
-def get_gallery_info(year: str, department: str) -> Optional[Dict[str, Any]]:
+def get_gallery_info(year: str, department: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
     """Get gallery information for a specific year and department."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-        SELECT g.*, by.year, d.name as department_name, d.department_id
-        FROM galleries g
-        JOIN batch_years by ON g.year_id = by.id
-        JOIN departments d ON g.department_id = d.id
-        WHERE by.year = ? AND d.name = ?
-        ''', (year, department))
+        cursor.execute(_SQL["gallery_info"], (year, department))
         
         row = cursor.fetchone()
         if row:
             return dict(row)
         return None
 
-def register_gallery(year: str, department: str, file_path: str, identity_count: int = 0) -> bool:
+def register_gallery(year: str, department: str, file_path: str, identity_count: int = 0, conn: Optional[sqlite3.Connection] = None) -> bool:
     """Register a gallery file in the database."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
         
         # Get year and department IDs
-        cursor.execute("SELECT id FROM batch_years WHERE year = ?", (year,))
+        cursor.execute(_SQL["batch_year_id"], (year,))
         year_row = cursor.fetchone()
         if not year_row:
             return False
         
-        cursor.execute("SELECT id FROM departments WHERE name = ?", (department,))
+        cursor.execute(_SQL["department_row_id"], (department,))
         dept_row = cursor.fetchone()
         if not dept_row:
             return False
@@ -268,69 +399,40 @@ def register_gallery(year: str, department: str, file_path: str, identity_count:
         dept_id = dept_row[0]
         
         try:
-            cursor.execute('''
-            INSERT OR REPLACE INTO galleries (year_id, department_id, file_path, identity_count, updated_at)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (year_id, dept_id, file_path, identity_count))
-            conn.commit()
+            cursor.execute(_SQL["register_gallery"], (year_id, dept_id, file_path, identity_count))
             return True
         except sqlite3.Error:
             return False
 
-def update_gallery_count(file_path: str, identity_count: int) -> bool:
+def update_gallery_count(file_path: str, identity_count: int, conn: Optional[sqlite3.Connection] = None) -> bool:
     """Update the identity count for a gallery."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-        UPDATE galleries 
-        SET identity_count = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE file_path = ?
-        ''', (identity_count, file_path))
-        conn.commit()
+        cursor.execute(_SQL["update_gallery_count"], (identity_count, file_path))
         return cursor.rowcount > 0
 
-def list_all_galleries() -> List[Dict[str, Any]]:
+def list_all_galleries(conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     """List all registered galleries with their details."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-        SELECT g.*, by.year, d.name as department_name, d.department_id
-        FROM galleries g
-        JOIN batch_years by ON g.year_id = by.id
-        JOIN departments d ON g.department_id = d.id
-        ORDER BY by.year, d.name
-        ''')
+        cursor.execute(_SQL["list_galleries"])
         
-        return [dict(row) for row in cursor.fetchall()]
+        return _fetch_dicts(cursor)
 
-def remove_gallery(year: str, department: str) -> bool:
+def remove_gallery(year: str, department: str, conn: Optional[sqlite3.Connection] = None) -> bool:
     """Remove a gallery registration from the database."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-        DELETE FROM galleries 
-        WHERE year_id = (SELECT id FROM batch_years WHERE year = ?)
-        AND department_id = (SELECT id FROM departments WHERE name = ?)
-        ''', (year, department))
-        conn.commit()
+        cursor.execute(_SQL["remove_gallery"], (year, department))
         return cursor.rowcount > 0
 
-def get_database_stats() -> Dict[str, Any]:
+def get_database_stats(conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
     """Get database statistics."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
         
-        cursor.execute("SELECT COUNT(*) FROM batch_years")
-        batch_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM departments")
-        dept_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM galleries")
-        gallery_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT SUM(identity_count) FROM galleries")
-        total_identities = cursor.fetchone()[0] or 0
+        cursor.execute(_SQL["database_stats"])
+        batch_count, dept_count, gallery_count, total_identities = cursor.fetchone()
         
         from .connection import DB_PATH
         return {
@@ -341,32 +443,25 @@ def get_database_stats() -> Dict[str, Any]:
             "database_path": DB_PATH
         }
 
-def save_quality_check_report(report_data: Dict[str, Any]) -> int:
+def save_quality_check_report(report_data: Dict[str, Any], conn: Optional[sqlite3.Connection] = None) -> int:
     """Save a quality check report and its results to the database. Overwrites existing report for same dept-year."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
         
         # Check if a report already exists for this department-year combination
-        cursor.execute('''
-        SELECT id FROM quality_check_reports 
-        WHERE department = ? AND year = ?
-        ORDER BY created_at DESC LIMIT 1
-        ''', (report_data['department'], report_data['year']))
+        cursor.execute(_SQL["latest_report_id"], (report_data['department'], report_data['year']))
         
         existing_report = cursor.fetchone()
         
         if existing_report:
             # Delete existing report and its results
             report_id = existing_report['id']
-            cursor.execute('DELETE FROM quality_check_results WHERE report_id = ?', (report_id,))
-            cursor.execute('DELETE FROM quality_check_reports WHERE id = ?', (report_id,))
+            cursor.execute(_SQL["delete_report_results"], (report_id,))
+            cursor.execute(_SQL["delete_report"], (report_id,))
             print(f"Overwriting existing quality check report for {report_data['department']} {report_data['year']}")
         
         # Insert the new report
-        cursor.execute('''
-        INSERT INTO quality_check_reports (department, year, total_checked, passed_count, failed_count, borderline_count)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
+        cursor.execute(_SQL["insert_report"], (
             report_data['department'],
             report_data['year'],
             report_data['total_checked'],
@@ -377,68 +472,50 @@ def save_quality_check_report(report_data: Dict[str, Any]) -> int:
         report_id = cursor.lastrowid
         
         # Insert passed students
-        for student_id in report_data['passed_students']:
-            cursor.execute('''
-            INSERT INTO quality_check_results (report_id, student_id, status)
-            VALUES (?, ?, 'pass')
-            ''', (report_id, student_id))
+        cursor.executemany(_SQL["insert_result"],
+                           [(report_id, student_id, 'pass') for student_id in report_data['passed_students']])
             
         # Insert failed students
-        for student_id in report_data['failed_students']:
-            cursor.execute('''
-            INSERT INTO quality_check_results (report_id, student_id, status)
-            VALUES (?, ?, 'fail')
-            ''', (report_id, student_id))
+        cursor.executemany(_SQL["insert_result"],
+                           [(report_id, student_id, 'fail') for student_id in report_data['failed_students']])
             
         # Insert borderline students
-        for student in report_data['borderline_students']:
-            cursor.execute('''
-            INSERT INTO quality_check_results (report_id, student_id, status, issues)
-            VALUES (?, ?, 'borderline', ?)
-            ''', (report_id, student['regNo'], json.dumps(student['issues'])))
+        cursor.executemany(_SQL["insert_borderline_result"],
+                           [(report_id, student['regNo'], json.dumps(student['issues']))
+                            for student in report_data['borderline_students']])
             
-        conn.commit()
         return report_id
 
-def get_quality_check_reports(department: Optional[str] = None, year: Optional[str] = None) -> List[Dict[str, Any]]:
+def get_quality_check_reports(department: Optional[str] = None, year: Optional[str] = None, conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     """Get quality check reports, optionally filtered by department and year."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
         
-        query = "SELECT * FROM quality_check_reports"
-        params = []
-        
-        if department or year:
-            query += " WHERE "
-            if department:
-                query += "department = ?"
-                params.append(department)
-            if year:
-                if department:
-                    query += " AND "
-                query += "year = ?"
-                params.append(year)
-        
-        query += " ORDER BY created_at DESC"
-        
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+        if department and year:
+            cursor.execute(_SQL["reports_by_department_year"], (department, year))
+        elif department:
+            cursor.execute(_SQL["reports_by_department"], (department,))
+        elif year:
+            cursor.execute(_SQL["reports_by_year"], (year,))
+        else:
+            cursor.execute(_SQL["reports"])
+        return _fetch_dicts(cursor)
 
-def get_quality_check_report_details(report_id: int) -> Optional[Dict[str, Any]]:
+def get_quality_check_report_details(report_id: int, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
     """Get a single quality check report and its detailed results."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
         
         # Get the main report
-        cursor.execute("SELECT * FROM quality_check_reports WHERE id = ?", (report_id,))
+        cursor.execute(_SQL["report_by_id"], (report_id,))
         report = cursor.fetchone()
         
         if not report:
             return None
         
         # Get the detailed results
-        cursor.execute("SELECT * FROM quality_check_results WHERE report_id = ?", (report_id,))
-        results = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(_SQL["report_results"], (report_id,))
+        results = _fetch_dicts(cursor)
         
         report_details = dict(report)
         report_details['results'] = results
@@ -448,67 +525,57 @@ def get_quality_check_report_details(report_id: int) -> Optional[Dict[str, Any]]
 # Initialize the database when the module is imported
 init_db()
 
-def get_students_by_dept_and_batch(dept: str, batch: str):
+def get_students_by_dept_and_batch(dept: str, batch: str, conn: Optional[sqlite3.Connection] = None):
     """Get all students from the database."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM students WHERE department_id = ? AND batch = ?", (dept, batch))
+        cursor.execute(_SQL["students_by_dept_and_batch"], (dept, batch))
         print('[DEBUG] Executing query to get students by department and batch:', dept, batch)
-        return [dict(row) for row in cursor.fetchall()]
+        return _fetch_dicts(cursor)
 
-def save_student_to_database(student_data: dict) -> bool:
-    """Save student data to the database."""
-    with get_db_connection() as conn:
+def save_student_to_database(student_data: dict, conn: Optional[sqlite3.Connection] = None) -> bool:
+    """
+    Save student data to the database.
+    
+    Errors are reported by returning False, except on a caller's connection, where they
+    are raised so the caller's session (e.g. db_session) rolls back instead of committing.
+    """
+    in_session = conn is not None
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
         try:
-            # Check if student already exists
-            cursor.execute("SELECT id FROM students WHERE register_no = ?", (student_data.get('regNo'),))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing student with section data
-                cursor.execute("""
-                    UPDATE students 
-                    SET name = ?, department = ?, batch = ?, section = ?
-                    WHERE register_no = ?
-                """, (
-                    student_data.get('name'),
-                    student_data.get('dept'),
-                    student_data.get('batch'),
-                    student_data.get('section'),
-                    student_data.get('regNo')
-                ))
-            else:
-                # Insert new student
-                cursor.execute("""
-                    INSERT INTO students (register_no, name, department, batch, section)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    student_data.get('regNo'),
-                    student_data.get('name'),
-                    student_data.get('dept'),
-                    student_data.get('batch'),
-                    student_data.get('section')
-                ))
+            reg_no = student_data.get('regNo')
+            fields = (
+                student_data.get('name'),
+                student_data.get('dept'),
+                student_data.get('batch'),
+                student_data.get('section')
+            )
+            # Insert new student, or update the existing one with section data
+            try:
+                cursor.execute(_SQL["upsert_student"], (reg_no,) + fields)
+            except sqlite3.OperationalError:
+                # No unique index on register_no to upsert against: update every row
+                # with this register number, or insert one if there is none
+                cursor.execute(_SQL["update_student"], fields + (reg_no,))
+                if cursor.rowcount == 0:
+                    cursor.execute(_SQL["insert_student"], (reg_no,) + fields)
             
-            conn.commit()
             return True
         except Exception as e:
+            if in_session:
+                raise
             print(f"Error saving student to database: {e}")
             conn.rollback()
             return False
 
-def get_existing_quality_results(department: str, year: str) -> Optional[Dict[str, Any]]:
+def get_existing_quality_results(department: str, year: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
     """Get existing quality check results for a specific department-year combination."""
-    with get_db_connection() as conn:
+    with use_connection(conn) as conn:
         cursor = conn.cursor()
         
         # Get the most recent report for this department-year
-        cursor.execute('''
-        SELECT * FROM quality_check_reports 
-        WHERE department = ? AND year = ?
-        ORDER BY created_at DESC LIMIT 1
-        ''', (department, year))
+        cursor.execute(_SQL["latest_report"], (department, year))
         
         report = cursor.fetchone()
         if not report:
@@ -517,10 +584,7 @@ def get_existing_quality_results(department: str, year: str) -> Optional[Dict[st
         report_dict = dict(report)
         
         # Get the detailed results
-        cursor.execute('''
-        SELECT student_id, status, issues FROM quality_check_results 
-        WHERE report_id = ?
-        ''', (report['id'],))
+        cursor.execute(_SQL["report_result_statuses"], (report['id'],))
         
         results = cursor.fetchall()
         
@@ -1,6 +1,7 @@
 import os
 import shutil
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Configure logging
@@ -15,15 +16,54 @@ BACKUP_DIR = PROJECT_ROOT / 'backups'
 BACKUP_DB_PATH = BACKUP_DIR / 'database' / 'app.db'
 BACKUP_DATA_PATH = BACKUP_DIR / 'student_data'
 
-def should_overwrite(src, dst):
+# Student data folders copied concurrently by backup_student_data
+BACKUP_WORKERS = 4
+
+def should_overwrite(src, dst, src_stat=None):
     """
     Determines if a file should be overwritten based on modification time.
-    Returns True if the source is newer than the destination or if the destination
-    does not exist.
+    Returns True if the source is newer than the destination, if their sizes
+    differ, or if the destination does not exist.
+    Timestamps are compared as integer nanoseconds to avoid float rounding.
     """
-    if not os.path.exists(dst):
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
         return True
-    return os.path.getmtime(src) > os.path.getmtime(dst)
+    if src_stat is None:
+        src_stat = os.stat(src)
+    return src_stat.st_mtime_ns > dst_stat.st_mtime_ns or src_stat.st_size != dst_stat.st_size
+
+def copy_file(src, dst, src_stat):
+    """
+    Copies file contents (sendfile on Linux) and mode, then sets the exact
+    nanosecond timestamps of the source on the copy.
+    """
+    shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+def copy_if_newer(src, dst):
+    """
+    Copy function for copytree that skips files whose backup is up to date.
+    """
+    src_stat = os.stat(src)
+    if should_overwrite(src, dst, src_stat):
+        copy_file(src, dst, src_stat)
+
+def sync_student_subtree(src_dir):
+    """
+    Syncs one top-level folder of the student data directory into the backup.
+    Runs on a backup worker thread.
+    """
+    src_dir = Path(src_dir)
+    shutil.copytree(
+        src_dir,
+        BACKUP_DATA_PATH / src_dir.name,
+        dirs_exist_ok=True,
+        copy_function=copy_if_newer
+    )
+    return src_dir.name
 
 def backup_database():
     """
@@ -34,8 +74,9 @@ def backup_database():
         logger.info(f"Backing up database from {SOURCE_DB} to {BACKUP_DB_PATH}...")
         BACKUP_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-        if should_overwrite(SOURCE_DB, BACKUP_DB_PATH):
-            shutil.copy2(SOURCE_DB, BACKUP_DB_PATH)
+        src_stat = os.stat(SOURCE_DB)
+        if should_overwrite(SOURCE_DB, BACKUP_DB_PATH, src_stat):
+            copy_file(SOURCE_DB, BACKUP_DB_PATH, src_stat)
             logger.info("Database backup completed successfully (overwritten).")
         else:
             logger.info("Database backup skipped (no changes detected).")
@@ -54,13 +95,24 @@ def backup_student_data():
         logger.info(f"Backing up student data from {SOURCE_DATA_DIR} to {BACKUP_DATA_PATH}...")
         BACKUP_DATA_PATH.mkdir(parents=True, exist_ok=True)
 
-        # Use copytree with a custom copy function to be more efficient
-        shutil.copytree(
-            SOURCE_DATA_DIR,
-            BACKUP_DATA_PATH,
-            dirs_exist_ok=True,
-            copy_function=lambda src, dst: shutil.copy2(src, dst) if should_overwrite(src, dst) else None
-        )
+        # Top-level files are synced here, each dept_year folder on its own worker thread
+        subtrees = []
+        for entry in os.scandir(SOURCE_DATA_DIR):
+            if entry.is_dir():
+                if entry.name.startswith('.'):
+                    # Hidden folders, such as a trash folder left by older versions, are not data
+                    continue
+                subtrees.append(entry.path)
+            else:
+                copy_if_newer(entry.path, BACKUP_DATA_PATH / entry.name)
+
+        if subtrees:
+            # Copying is I/O-bound and shutil releases the GIL while it waits on disk, so
+            # threads overlap it as well as processes would. Forking is avoided on purpose:
+            # the server process holds a CUDA context and many live threads
+            with ThreadPoolExecutor(max_workers=min(BACKUP_WORKERS, len(subtrees))) as executor:
+                for name in executor.map(sync_student_subtree, subtrees):
+                    logger.info(f"Synced student data folder {name}.")
         logger.info("Student data backup sync completed successfully.")
         
     except FileNotFoundError:
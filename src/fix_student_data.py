@@ -13,6 +13,7 @@
 """
 
 import os
+import re
 import json
 import sys
 
@@ -21,6 +22,23 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.settings import STUDENT_DATA_DIR
 
+# Bump when the set of fields filled in below changes
+SCHEMA_VERSION = 1
+
+# schemaVersion is written as the first key, so it always sits in the file header
+SCHEMA_HEADER_BYTES = 256
+SCHEMA_VERSION_PATTERN = re.compile(rb'"schemaVersion":\s*(\d+)')
+
+def has_current_schema(json_file):
+    """Check the file header for the current schemaVersion without parsing the JSON"""
+    fd = os.open(json_file, os.O_RDONLY)
+    try:
+        header = os.read(fd, SCHEMA_HEADER_BYTES)
+    finally:
+        os.close(fd)
+    match = SCHEMA_VERSION_PATTERN.search(header)
+    return match is not None and int(match.group(1)) == SCHEMA_VERSION
+
 def fix_student_json_files():
     """Fix student JSON files missing required fields"""
     print(f"Scanning {STUDENT_DATA_DIR} for JSON files...")
@@ -60,6 +78,10 @@ def fix_student_json_files():
                 continue
                 
             try:
+                # Files already stamped with the current schema have nothing to fix
+                if has_current_schema(json_file):
+                    continue
+                
                 with open(json_file, 'r') as f:
                     data = json.load(f)
                 
@@ -114,11 +136,14 @@ def fix_student_json_files():
                     data['facesCount'] = 0
                     fields_fixed.append('facesCount')
                 
-                # If any fields were fixed, save the updated JSON
+                # Stamp the schema version as the first key so later runs can skip this file
+                data.pop('schemaVersion', None)
+                data = {'schemaVersion': SCHEMA_VERSION, **data}
+                with open(json_file, 'w') as f:
+                    json.dump(data, f, indent=2)
+                
                 if fields_fixed:
                     print(f"  Fixed {len(fields_fixed)} fields for student {student_id}: {', '.join(fields_fixed)}")
-                    with open(json_file, 'w') as f:
-                        json.dump(data, f, indent=2)
                     total_fixed += 1
                     
             except Exception as e:
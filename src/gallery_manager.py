@@ -13,7 +13,3 @@ from ml.embeddings import (
     extract_embedding
 )
 
-from utils.image_utils import (
-    create_face_augmentations,
-    augment_face_image
-)
@@ -1,13 +1,13 @@
 import os
-import sys
-from fastapi import FastAPI
 
-# Add src directory to system path for imports
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Imports resolve against src/, which is sys.path[0] when launched as `python src/main.py`
+import numpy as np
 
-from config.settings import HOST, PORT, WORKERS
+from config.settings import HOST, PORT, WORKERS, DEFAULT_MODEL_PATH, DEFAULT_YOLO_PATH
 from api.routes import create_app
-from periodic_tasks import scheduler
+from ml.embeddings import load_model
+from services.face_processing import get_yolo_model, yolo_lock, YOLO_HALF
+from periodic_tasks import scheduler, start_quality_worker, stop_quality_worker
 
 # Create the FastAPI app
 app = create_app()
@@ -15,17 +15,36 @@ app = create_app()
 @app.on_event("startup")
 def startup_event():
     """
-    Start the scheduler when the application starts.
+    Start the scheduler and the quality check worker when the application starts.
     """
+    start_quality_worker()
     scheduler.start()
     print("Scheduler started.")
+    
+    # Load the LightCNN model now so the first gallery request doesn't pay for it
+    if os.path.exists(DEFAULT_MODEL_PATH):
+        try:
+            load_model(DEFAULT_MODEL_PATH)
+        except Exception as e:
+            print(f"Failed to pre-load model: {e}")
+    
+    # Same for the YOLO face detector; one dummy prediction sets up its predictor
+    # (and deserializes a TensorRT engine) ahead of the first real batch
+    if os.path.exists(DEFAULT_YOLO_PATH):
+        try:
+            yolo_model = get_yolo_model(DEFAULT_YOLO_PATH)
+            with yolo_lock:
+                yolo_model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False, half=YOLO_HALF)
+        except Exception as e:
+            print(f"Failed to pre-load YOLO model: {e}")
 
 @app.on_event("shutdown")
 def shutdown_event():
     """
-    Stop the scheduler when the application shuts down.
+    Stop the scheduler and the quality check worker when the application shuts down.
     """
     scheduler.shutdown()
+    stop_quality_worker()
     print("Scheduler shut down.")
 
 if __name__ == "__main__":
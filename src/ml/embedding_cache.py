@@ -0,0 +1,104 @@
+import os
+import hashlib
+import sqlite3
+import numpy as np
+
+from config.settings import GALLERY_DIR
+
+# Embeddings of already-seen images, keyed by model and image content
+EMBEDDING_CACHE_PATH = os.path.join(GALLERY_DIR, "embedding_cache.db")
+
+# Keep IN (...) lists well under SQLite's bound parameter limit
+_LOOKUP_CHUNK = 500
+
+class EmbeddingCache:
+    """Content-addressed cache of LightCNN embeddings stored in SQLite"""
+    
+    def __init__(self, model_path, db_path=EMBEDDING_CACHE_PATH):
+        # The same image gives different embeddings under different weights, and weights
+        # are replaced in place when the model is retrained, so the file's size and
+        # mtime are part of the key as well as its path
+        self.model = self.model_key(model_path)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                emb BLOB NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+        """)
+        self.conn.commit()
+        self.prune_stale_models()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def close(self):
+        self.conn.close()
+    
+    @staticmethod
+    def model_key(model_path):
+        """Identify a weights file by path, size and modification time"""
+        path = os.path.abspath(model_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path
+        return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+    
+    @classmethod
+    def is_current(cls, model):
+        """Whether a stored model key still matches the weights file it names"""
+        path, *stat = model.rsplit(":", 2)
+        if len(stat) != 2 or not all(part.isdigit() for part in stat):
+            # Stored while the file could not be stat'ed; the key is the path itself
+            path = model
+        return cls.model_key(path) == model
+    
+    def prune_stale_models(self):
+        """
+        Delete the embeddings of weights that have since been retrained or removed,
+        which can never be looked up again
+        """
+        models = [model for (model,) in self.conn.execute("SELECT DISTINCT model FROM embeddings")]
+        stale = [(model,) for model in models if model != self.model and not self.is_current(model)]
+        if stale:
+            self.conn.executemany("DELETE FROM embeddings WHERE model = ?", stale)
+            self.conn.commit()
+    
+    @staticmethod
+    def hash_file(path):
+        """Hash an image file's bytes; None if it can't be read"""
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.blake2b(f.read(), digest_size=16).digest()
+        except OSError:
+            return None
+    
+    def get_many(self, hashes):
+        """Look up cached embeddings, returning a dict of hash -> embedding for the hits"""
+        hashes = list({h for h in hashes if h is not None})
+        found = {}
+        for start in range(0, len(hashes), _LOOKUP_CHUNK):
+            chunk = hashes[start:start + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT hash, emb FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [self.model] + chunk
+            )
+            for h, emb in rows:
+                found[h] = np.frombuffer(emb, dtype=np.float32)
+        return found
+    
+    def put_many(self, items):
+        """Store (hash, embedding) pairs"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, hash, emb) VALUES (?, ?, ?)",
+            [(self.model, h, np.asarray(emb, dtype=np.float32).tobytes()) for h, emb in items]
+        )
+        self.conn.commit()
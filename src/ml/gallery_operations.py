@@ -1,85 +1,597 @@
 import os
-import cv2
+import json
+import time
+import functools
 import numpy as np
 import torch
 from tqdm import tqdm
 import random
 from PIL import Image
-import pandas as pd
-from scipy.spatial.distance import cosine
-from ultralytics import YOLO
+from torch.utils.data import Dataset, DataLoader
 
-from ml.embeddings import load_model, extract_embedding, transform
-from utils.image_utils import augment_face_image
+from ml.embeddings import load_model, forward_embeddings, transform, EMBEDDING_DIM
+from ml.embedding_cache import EmbeddingCache
+from utils.image_utils import augment_face_tensor
 
+# A gallery at <path> is stored as a contiguous (N, D) float16 embedding matrix
+# next to a JSON list of the N identity names, row i belonging to identity i;
+# matrices saved as float32 by older versions load the same way
+GALLERY_DTYPE = np.float16
+GALLERY_EMBEDDINGS_SUFFIX = '.emb.npy'
+GALLERY_IDENTITIES_SUFFIX = '.ids.json'
 
-def create_gallery(model_path, data_dir, output_path, augment_ratio, augs_per_image=4):
-    """Create a face recognition gallery from preprocessed face images"""
-    # Load model
-    model, device = load_model(model_path)
+# The matrix and identity list are replaced one after the other, so a reader can
+# briefly see one new and one old file; loads retry this many times before failing
+GALLERY_LOAD_RETRIES = 3
+GALLERY_LOAD_RETRY_DELAY = 0.05
+
+# Incremental updates are appended to a log (raw float32 rows plus one JSON-encoded
+# identity per line) and folded into the matrix once the log grows past this many rows
+GALLERY_APPEND_EMBEDDINGS_SUFFIX = '.append.emb'
+GALLERY_APPEND_IDENTITIES_SUFFIX = '.append.ids'
+GALLERY_COMPACTION_THRESHOLD = 256
+
+# Processes decoding face images for extract_dataset_embeddings. They are spawned, not
+# forked: the server process holds a CUDA context and locks held by its other threads
+EMBEDDING_LOADER_WORKERS = 4
+
+# Matchers over at least this many identities keep the normalized gallery as uint8,
+# scalar-quantized per dimension; smaller galleries are scored in float32
+GALLERY_QUANTIZE_MIN_SIZE = 64
+
+# Gallery rows widened back to float32 per step when scoring a quantized gallery
+QUANTIZED_SCORE_BLOCK_ROWS = 2048
+
+
+def gallery_exists(gallery_path):
+    """Check whether a gallery exists at gallery_path, in either storage format"""
+    return (os.path.exists(gallery_path + GALLERY_EMBEDDINGS_SUFFIX)
+            or os.path.exists(gallery_path))
+
+def save_gallery_soa(gallery_path, identities, embeddings):
+    """Save a gallery as an embedding matrix plus an identity list"""
+    identities = list(identities)
+    if len(identities):
+        matrix = np.ascontiguousarray(np.stack(embeddings).astype(GALLERY_DTYPE))
+    else:
+        matrix = np.empty((0, EMBEDDING_DIM), dtype=GALLERY_DTYPE)
+    
+    # Write to temporary files first so readers never see a half-written gallery
+    emb_path = gallery_path + GALLERY_EMBEDDINGS_SUFFIX
+    ids_path = gallery_path + GALLERY_IDENTITIES_SUFFIX
+    with open(emb_path + '.tmp', 'wb') as f:
+        np.save(f, matrix)
+    with open(ids_path + '.tmp', 'w') as f:
+        json.dump(identities, f)
+    os.replace(emb_path + '.tmp', emb_path)
+    os.replace(ids_path + '.tmp', ids_path)
+    
+    # The full matrix supersedes anything still in the append log
+    for path in (gallery_path + GALLERY_APPEND_EMBEDDINGS_SUFFIX,
+                 gallery_path + GALLERY_APPEND_IDENTITIES_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
+
+def read_append_log(gallery_path):
+    """
+    Read the gallery's append log as (identities, embeddings)
+    
+    Rows without a matching identity line, left by an interrupted append, are ignored.
+    """
+    ids_path = gallery_path + GALLERY_APPEND_IDENTITIES_SUFFIX
+    emb_path = gallery_path + GALLERY_APPEND_EMBEDDINGS_SUFFIX
+    if not os.path.exists(ids_path) or not os.path.exists(emb_path):
+        return [], np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    
+    # A trailing line without a newline is an unfinished write
+    with open(ids_path) as f:
+        identities = [json.loads(line) for line in f.read().split("\n")[:-1]]
+    embeddings = np.fromfile(emb_path, dtype=np.float32)
+    count = min(len(identities), len(embeddings) // EMBEDDING_DIM)
+    return identities[:count], embeddings[:count * EMBEDDING_DIM].reshape(count, EMBEDDING_DIM)
+
+def append_embeddings(gallery_path, new_embeddings_dict):
+    """
+    Add or replace identities in an existing gallery by appending to its log
+    
+    Only the new rows are written; the log is compacted into the embedding matrix
+    once it holds more than GALLERY_COMPACTION_THRESHOLD rows.
+    """
+    # The append log extends the matrix format only
+    migrate_legacy_gallery(gallery_path)
+    
+    ids_path = gallery_path + GALLERY_APPEND_IDENTITIES_SUFFIX
+    emb_path = gallery_path + GALLERY_APPEND_EMBEDDINGS_SUFFIX
+    log_identities, _ = read_append_log(gallery_path)
+    
+    # Drop anything left by an interrupted append so both files stay aligned
+    if os.path.exists(emb_path):
+        os.truncate(emb_path, len(log_identities) * EMBEDDING_DIM * 4)
+    if os.path.exists(ids_path):
+        log_lines = [json.dumps(identity) + "\n" for identity in log_identities]
+        if os.path.getsize(ids_path) != sum(len(line) for line in log_lines):
+            with open(ids_path, 'w') as f:
+                f.writelines(log_lines)
+    
+    identities = list(new_embeddings_dict.keys())
+    rows = np.stack([np.asarray(new_embeddings_dict[i], dtype=np.float32).reshape(EMBEDDING_DIM)
+                     for i in identities])
+    with open(emb_path, 'ab') as f:
+        rows.tofile(f)
+    with open(ids_path, 'a') as f:
+        f.writelines(json.dumps(identity) + "\n" for identity in identities)
+    
+    if len(log_identities) + len(identities) > GALLERY_COMPACTION_THRESHOLD:
+        identities, embeddings = load_gallery_soa(gallery_path)
+        save_gallery_soa(gallery_path, identities, embeddings)
+        print(f"Compacted gallery {gallery_path}")
+
+def load_legacy_gallery(gallery_path):
+    """Load a gallery saved with torch.save as an identity -> embedding dict"""
+    try:
+        # Tensor-only galleries load without running the pickle machinery
+        gallery_data = torch.load(gallery_path, map_location="cpu", weights_only=True)
+    except Exception:
+        # Galleries of numpy arrays need full unpickling; galleries are converted to the
+        # .npy format the first time they are updated
+        gallery_data = torch.load(gallery_path, map_location="cpu", weights_only=False)
+    
+    # Handle both the old format (dict of embeddings) and new format (separate lists)
+    if isinstance(gallery_data, dict) and "identities" in gallery_data:
+        return dict(zip(gallery_data["identities"], gallery_data["embeddings"]))
+    return gallery_data
+
+def migrate_legacy_gallery(gallery_path):
+    """
+    Convert a legacy torch.save gallery to the matrix format before it is written to
+    
+    The original file is kept next to it as <gallery_path>.bak, since the matrix
+    format stores embeddings at lower precision.
+    """
+    if os.path.exists(gallery_path + GALLERY_EMBEDDINGS_SUFFIX) or not os.path.exists(gallery_path):
+        return
+    legacy_gallery = load_legacy_gallery(gallery_path)
+    save_gallery_soa(gallery_path, legacy_gallery.keys(), list(legacy_gallery.values()))
+    os.replace(gallery_path, gallery_path + '.bak')
+    print(f"Migrated legacy gallery {gallery_path} (original kept as {gallery_path}.bak)")
+
+def read_gallery_matrix(gallery_path):
+    """
+    Read a matrix-format gallery's identity list and memory-mapped embedding matrix,
+    checking that they have the same number of rows
+    
+    A mismatch is retried, as it is usually a save in progress; one that persists, left
+    by a save interrupted between its two file replacements, raises ValueError.
+    """
+    for _ in range(GALLERY_LOAD_RETRIES):
+        with open(gallery_path + GALLERY_IDENTITIES_SUFFIX) as f:
+            identities = json.load(f)
+        embeddings = np.load(gallery_path + GALLERY_EMBEDDINGS_SUFFIX, mmap_mode='r', allow_pickle=False)
+        if len(identities) == embeddings.shape[0]:
+            return identities, embeddings
+        time.sleep(GALLERY_LOAD_RETRY_DELAY)
+    raise ValueError(f"Gallery {gallery_path} has {len(identities)} identities but "
+                     f"{embeddings.shape[0]} embeddings; rebuild it")
+
+def load_gallery_soa(gallery_path):
+    """
+    Load a gallery as (identities, embeddings) with the embedding matrix memory-mapped
+    in its stored dtype
     
-    # Create gallery dictionary
-    gallery = {}
+    Pending append log entries are merged in memory into a float32 copy, replacing rows
+    of identities they update. A legacy torch.save gallery is read as it is; only
+    migrate_legacy_gallery, called on the write paths, converts it.
+    """
+    emb_path = gallery_path + GALLERY_EMBEDDINGS_SUFFIX
+    if not os.path.exists(emb_path):
+        if not os.path.exists(gallery_path):
+            raise FileNotFoundError(f"No gallery found at {gallery_path}")
+        legacy_gallery = load_legacy_gallery(gallery_path)
+        identities = list(legacy_gallery.keys())
+        if not identities:
+            return identities, np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        embeddings = np.stack([np.asarray(embedding, dtype=np.float32).reshape(EMBEDDING_DIM)
+                               for embedding in legacy_gallery.values()])
+        return identities, embeddings
     
-    # Process each identity folder
-    identities = [d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d))]
-    print(f"Found {len(identities)} identities")
+    identities, embeddings = read_gallery_matrix(gallery_path)
     
-    for identity in tqdm(identities, desc="Processing identities"):
-        identity_dir = os.path.join(data_dir, identity)
+    log_identities, log_embeddings = read_append_log(gallery_path)
+    if not log_identities:
+        return identities, embeddings
+    
+    # Later log entries win over earlier ones and over the matrix
+    row_of = {identity: i for i, identity in enumerate(identities)}
+    base_count = len(identities)
+    updates = {}
+    for identity, embedding in zip(log_identities, log_embeddings):
+        if identity not in row_of:
+            row_of[identity] = len(identities)
+            identities.append(identity)
+        updates[row_of[identity]] = embedding
+    
+    merged = np.empty((len(identities), EMBEDDING_DIM), dtype=np.float32)
+    merged[:base_count] = embeddings
+    for row, embedding in updates.items():
+        merged[row] = embedding
+    return identities, merged
+
+def load_gallery_identities(gallery_path):
+    """
+    List a gallery's identities from its identity list and append log alone, without
+    touching the embeddings
+    """
+    if not os.path.exists(gallery_path + GALLERY_EMBEDDINGS_SUFFIX):
+        # Legacy gallery: identities and embeddings are one pickle
+        return list(load_legacy_gallery(gallery_path).keys())
+    
+    with open(gallery_path + GALLERY_IDENTITIES_SUFFIX) as f:
+        identities = json.load(f)
+    
+    ids_path = gallery_path + GALLERY_APPEND_IDENTITIES_SUFFIX
+    emb_path = gallery_path + GALLERY_APPEND_EMBEDDINGS_SUFFIX
+    if os.path.exists(ids_path) and os.path.exists(emb_path):
+        # As in read_append_log, only identities whose embedding row was fully written count
+        with open(ids_path) as f:
+            log_identities = [json.loads(line) for line in f.read().split("\n")[:-1]]
+        log_identities = log_identities[:os.path.getsize(emb_path) // (EMBEDDING_DIM * 4)]
+        known = set(identities)
+        for identity in log_identities:
+            if identity not in known:
+                known.add(identity)
+                identities.append(identity)
+    return identities
+
+def load_gallery(gallery_path):
+    """Load a gallery as an identity -> embedding dict"""
+    identities, embeddings = load_gallery_soa(gallery_path)
+    return dict(zip(identities, embeddings))
+
+def gallery_signature(gallery_path):
+    """(size, mtime) of each of a gallery's files that exist; changes whenever the gallery does"""
+    signature = []
+    for suffix in ('', GALLERY_EMBEDDINGS_SUFFIX, GALLERY_IDENTITIES_SUFFIX,
+                   GALLERY_APPEND_EMBEDDINGS_SUFFIX, GALLERY_APPEND_IDENTITIES_SUFFIX):
+        try:
+            stat = os.stat(gallery_path + suffix)
+        except FileNotFoundError:
+            signature.append(None)
+        else:
+            signature.append((stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+def build_matcher(gallery_paths, device=None):
+    """
+    Build a cosine-similarity matcher over one or more galleries
+    
+    The gallery embeddings are L2-normalized once, so each query is scored against every
+    identity with a single matrix-vector product. Later galleries override identities
+    of earlier ones. Matchers are cached until one of the galleries changes on disk.
+    
+    Returns match(query, threshold=0.0, k=None) giving (identity, similarity) pairs at or
+    above threshold, best first and at most k of them; None if no gallery could be loaded.
+    match.identities lists the gallery identities and match.similarities(queries) scores
+    an (M, D) batch of queries against all of them at once, as an (M, N) matrix.
+    match.top_k(queries, k) gives the (M, k) scores and identity indices of each query's
+    k best identities, best first; with a CUDA device the gallery is also kept on it, so
+    tensor queries already there are scored on the GPU and only the top k are copied back.
+    """
+    if isinstance(gallery_paths, str):
+        gallery_paths = [gallery_paths]
+    gallery_paths = tuple(gallery_paths)
+    if device is not None and torch.device(device).type != 'cuda':
+        device = None
+    return _build_matcher_cached(gallery_paths, tuple(gallery_signature(path) for path in gallery_paths),
+                                 device)
+
+def quantized_scorer(gallery):
+    """
+    Quantize an (N, D) gallery to uint8 per dimension and return score(queries) -> queries @ gallery.T
+    
+    Each dimension is mapped linearly from its [min, max] range onto 0..255, a quarter
+    of the float32 memory. Since gallery ~= gmin + Gq * scale, the scale is folded into
+    the query and the gmin term is a single dot product, so scores need no dequantized copy.
+    """
+    gmin = gallery.min(axis=0)
+    scale = (gallery.max(axis=0) - gmin) / 255
+    # Constant dimensions quantize to 0 and are fully described by gmin
+    scale[scale == 0] = 1
+    quantized = np.round((gallery - gmin) / scale).astype(np.uint8)
+    
+    def score(queries):
+        # Widen the codes a block of rows at a time, so the float32 copy fed to the
+        # matrix product stays small and cache-resident instead of spanning the gallery
+        scaled = (queries * scale).astype(np.float32)
+        scores = np.empty(scaled.shape[:-1] + (len(quantized),), dtype=np.float32)
+        for start in range(0, len(quantized), QUANTIZED_SCORE_BLOCK_ROWS):
+            block = quantized[start:start + QUANTIZED_SCORE_BLOCK_ROWS]
+            scores[..., start:start + len(block)] = scaled @ block.T.astype(np.float32)
+        scores += (queries @ gmin)[..., None]
+        return scores
+    
+    return score
+
+@functools.lru_cache(maxsize=8)
+def _build_matcher_cached(gallery_paths, signatures, device=None):
+    """build_matcher for galleries whose files are in the state given by signatures"""
+    all_identities = []
+    matrices = []
+    for gallery_path in gallery_paths:
+        if gallery_exists(gallery_path):
+            try:
+                identities, embeddings = load_gallery_soa(gallery_path)
+                all_identities.extend(identities)
+                matrices.append(embeddings)
+            except Exception as e:
+                print(f"Error loading gallery {gallery_path}: {e}")
+    
+    if not all_identities:
+        return None
+    
+    # Keep the last row of each identity, so later galleries override earlier ones
+    last_row = {identity: i for i, identity in enumerate(all_identities)}
+    identities = list(last_row.keys())
+    gallery = np.concatenate(matrices, dtype=np.float32)[list(last_row.values())]
+    gallery_norm = gallery / np.maximum(np.linalg.norm(gallery, axis=1, keepdims=True), 1e-12)
+    if len(identities) >= GALLERY_QUANTIZE_MIN_SIZE:
+        score = quantized_scorer(gallery_norm)
+    else:
+        score = lambda queries: queries @ gallery_norm.T
+    
+    def similarities(queries):
+        queries = np.asarray(queries, dtype=np.float32)
+        return score(queries / np.maximum(np.linalg.norm(queries, axis=-1, keepdims=True), 1e-12))
+    
+    def match(query, threshold=0.0, k=None):
+        scores = similarities(query)
+        
+        if k is not None and k < len(scores):
+            candidates = np.argpartition(-scores, k)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[scores[candidates] >= threshold]
+        order = candidates[np.argsort(-scores[candidates])]
+        return [(identities[i], float(scores[i])) for i in order]
+    
+    gallery_on_device = None
+    if device is not None:
+        gallery_on_device = torch.from_numpy(gallery_norm).to(device)
+    
+    def top_k(queries, k):
+        k = min(k, len(identities))
+        if gallery_on_device is not None and torch.is_tensor(queries):
+            queries = torch.nn.functional.normalize(queries.to(gallery_on_device), dim=1)
+            scores, indices = (queries @ gallery_on_device.T).topk(k, dim=1)
+            return scores.cpu().numpy(), indices.cpu().numpy()
+        
+        if torch.is_tensor(queries):
+            queries = queries.cpu().numpy()
+        scores = similarities(queries)
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, indices, axis=1)
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+    
+    match.identities = identities
+    match.similarities = similarities
+    match.top_k = top_k
+    return match
+
+def delete_gallery_files(gallery_path):
+    """Remove every file belonging to the gallery at gallery_path"""
+    for path in (gallery_path, gallery_path + GALLERY_EMBEDDINGS_SUFFIX,
+                 gallery_path + GALLERY_IDENTITIES_SUFFIX,
+                 gallery_path + GALLERY_APPEND_EMBEDDINGS_SUFFIX,
+                 gallery_path + GALLERY_APPEND_IDENTITIES_SUFFIX,
+                 gallery_path + '.bak'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class FaceImageDataset(Dataset):
+    """Face images decoded and preprocessed for LightCNN inside DataLoader workers"""
+    
+    def __init__(self, img_paths):
+        self.img_paths = img_paths
+    
+    def __len__(self):
+        return len(self.img_paths)
+    
+    def __getitem__(self, idx):
+        img_path = self.img_paths[idx]
+        try:
+            return transform(Image.open(img_path).convert('L')), True
+        except Exception as e:
+            print(f"Error processing {img_path}: {e}")
+            return torch.zeros(1, 128, 128), False
+
+def prefetch_to_device(loader, device):
+    """
+    Yield (batch, valid) items from loader with the batch moved to device
+    
+    On GPU the next batch is copied on a side stream while the caller is still running
+    the model on the current one, so transfers overlap with compute.
+    """
+    if device.type != 'cuda':
+        for batch, valid in loader:
+            yield batch.to(device), valid
+        return
+    
+    copy_stream = torch.cuda.Stream(device)
+    
+    def ready(item):
+        batch, valid, copied = item
+        current_stream = torch.cuda.current_stream(device)
+        current_stream.wait_event(copied)
+        # Keep the caching allocator from reusing the memory while the main stream uses it
+        batch.record_stream(current_stream)
+        return batch, valid
+    
+    pending = None
+    for batch, valid in loader:
+        with torch.cuda.stream(copy_stream):
+            batch = batch.to(device, non_blocking=True)
+            copied = torch.cuda.Event()
+            copied.record(copy_stream)
+        if pending is not None:
+            yield ready(pending)
+        pending = (batch, valid, copied)
+    if pending is not None:
+        yield ready(pending)
+
+def extract_dataset_embeddings(model, device, img_paths, batch_size=32, augment_flags=None, augs_per_image=4):
+    """
+    Extract embeddings for many images while worker processes decode the next batches
+    
+    Images whose entry in augment_flags is true are also augmented on the device, so the
+    augmented variants go through the model alongside the batch they came from.
+    
+    Returns a list aligned with img_paths holding the embeddings of each image (original
+    first, then its augmented variants); images that could not be loaded give None
+    """
+    num_workers = min(EMBEDDING_LOADER_WORKERS, os.cpu_count() or 1)
+    loader = DataLoader(
+        FaceImageDataset(img_paths),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        pin_memory=device.type == 'cuda',
+        # Keep a few decoded batches queued per worker so the GPU never waits on decode
+        prefetch_factor=4 if num_workers > 0 else None,
+        multiprocessing_context='spawn' if num_workers > 0 else None
+    )
+    
+    if augment_flags is None:
+        augment_flags = [False] * len(img_paths)
+    
+    embeddings = []
+    with torch.inference_mode():
+        for batch, valid in tqdm(prefetch_to_device(loader, device), total=len(loader),
+                                 desc="Extracting embeddings"):
+            valid = valid.tolist()
+            offset = len(embeddings)
+            
+            # Apply augmentation if specified
+            augmented_owner = []
+            to_augment = [i for i, ok in enumerate(valid) if ok and augment_flags[offset + i]]
+            if to_augment:
+                # All flagged faces of the batch are augmented together
+                augmented = augment_face_tensor(batch[to_augment], augs_per_image)
+                per_image = len(augmented) // len(to_augment)
+                augmented_owner = [i for i in to_augment for _ in range(per_image)]
+                batch = torch.cat([batch, augmented])
+            
+            batch_embeddings = forward_embeddings(model, batch).cpu().numpy()
+            
+            results = [[embedding] if ok else None
+                       for embedding, ok in zip(batch_embeddings, valid)]
+            for owner, embedding in zip(augmented_owner, batch_embeddings[len(valid):]):
+                results[owner].append(embedding)
+            embeddings.extend(results)
+    return embeddings
+
+def list_identity_images(data_dir):
+    """Map each identity folder in data_dir to the paths of its face images"""
+    with os.scandir(data_dir) as it:
+        identity_dirs = [entry for entry in it if entry.is_dir()]
+    print(f"Found {len(identity_dirs)} identities")
+    
+    identity_images = {}
+    for identity_dir in identity_dirs:
+        identity = identity_dir.name
         
         # Get all images for this identity
-        image_files = [f for f in os.listdir(identity_dir) 
-                      if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
+        with os.scandir(identity_dir.path) as it:
+            image_paths = [entry.path for entry in it
+                           if entry.name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')) and entry.is_file()]
         
-        if not image_files:
+        if not image_paths:
             print(f"Warning: No images found for {identity}")
             continue
         
-        # Extract embeddings for all images
-        embeddings = []
-        for img_file in image_files:
-            img_path = os.path.join(identity_dir, img_file)
-            embedding = extract_embedding(model, img_path, device)
-            if embedding is not None:
-                embeddings.append(embedding)
-                
-                # Apply augmentation if specified
-                if augment_ratio > 0 and random.random() < augment_ratio:
-                    try:
-                        # Load original image as numpy array for augmentation
-                        img = cv2.imread(img_path)
-                        if img is not None:
-                            # Generate augmented versions
-                            augmented_images = augment_face_image(img, augs_per_image)
-                            
-                            # Extract embeddings from augmented images
-                            for aug_img in augmented_images:
-                                # Convert numpy array to PIL Image
-                                aug_pil = Image.fromarray(cv2.cvtColor(aug_img, cv2.COLOR_BGR2GRAY))
-                                
-                                # Transform and extract embedding
-                                aug_tensor = transform(aug_pil).unsqueeze(0).to(device)
-                                with torch.no_grad():
-                                    _, aug_embedding = model(aug_tensor)
-                                    aug_embedding = aug_embedding.cpu().squeeze().numpy()
-                                    embeddings.append(aug_embedding)
-                    except Exception as e:
-                        print(f"Warning: Failed to augment {img_path}: {e}")
-                        continue
-        
-        if not embeddings:
+        identity_images[identity] = image_paths
+    return identity_images
+
+def compute_identity_means(model, device, data_dir, augment_ratio, augs_per_image, cache=None):
+    """
+    Extract embeddings for every identity in data_dir, plus augmented variants if requested,
+    and average them to get a single representation per identity
+    
+    With an EmbeddingCache, images seen before are not run through the model again
+    unless they were picked for augmentation.
+    
+    Returns a dict of identity -> L2-normalized mean embedding
+    """
+    identity_images = list_identity_images(data_dir)
+    img_paths = [img_path for paths in identity_images.values() for img_path in paths]
+    augment_flags = [augment_ratio > 0 and random.random() < augment_ratio for _ in img_paths]
+    
+    hashes = [None] * len(img_paths)
+    cached = {}
+    if cache is not None:
+        hashes = [cache.hash_file(img_path) for img_path in img_paths]
+        cached = cache.get_many(hashes)
+        print(f"Found {sum(h in cached for h in hashes)} of {len(img_paths)} images in the embedding cache")
+    
+    # Embed the remaining images of all identities in shared batches
+    pending = [i for i in range(len(img_paths)) if augment_flags[i] or hashes[i] not in cached]
+    extracted = extract_dataset_embeddings(model, device, [img_paths[i] for i in pending],
+                                           augment_flags=[augment_flags[i] for i in pending],
+                                           augs_per_image=augs_per_image)
+    
+    results = [[cached[h]] if h in cached else None for h in hashes]
+    for i, image_embeddings in zip(pending, extracted):
+        results[i] = image_embeddings
+    
+    if cache is not None:
+        cache.put_many((hashes[i], image_embeddings[0]) for i, image_embeddings in zip(pending, extracted)
+                       if image_embeddings is not None and hashes[i] is not None and hashes[i] not in cached)
+    
+    # Count the embeddings of each identity so they can be laid out in one matrix
+    identity_list = []
+    counts = []
+    start = 0
+    for identity, paths in identity_images.items():
+        count = sum(len(r) for r in results[start:start + len(paths)] if r is not None)
+        start += len(paths)
+        if count == 0:
             print(f"Warning: No valid embeddings extracted for {identity}")
             continue
-        
-        # Average embeddings to get a single representation
-        avg_embedding = np.mean(embeddings, axis=0)
-        gallery[identity] = avg_embedding
+        identity_list.append(identity)
+        counts.append(count)
+    
+    if not identity_list:
+        return {}
+    
+    # Identities own consecutive rows, in the same order as identity_list
+    all_emb = np.empty((sum(counts), EMBEDDING_DIM), dtype=np.float32)
+    row = 0
+    for image_embeddings in results:
+        if image_embeddings is None:
+            continue
+        for embedding in image_embeddings:
+            all_emb[row] = embedding
+            row += 1
+    
+    # Sum every identity's rows in one pass, then L2-normalize in place; the mean has
+    # the same direction as the sum, so dividing by the counts is unnecessary
+    boundaries = np.cumsum([0] + counts[:-1])
+    means = np.add.reduceat(all_emb, boundaries, axis=0)
+    means /= np.maximum(np.linalg.norm(means, axis=1, keepdims=True), 1e-12)
+    return {identity_list[i]: means[i] for i in range(len(identity_list))}
+
+def create_gallery(model_path, data_dir, output_path, augment_ratio, augs_per_image=4):
+    """Create a face recognition gallery from preprocessed face images"""
+    # Load model
+    model, device = load_model(model_path)
+    
+    # Process each identity folder into an identity -> mean embedding dictionary
+    with EmbeddingCache(model_path) as cache:
+        gallery = compute_identity_means(model, device, data_dir, augment_ratio, augs_per_image, cache)
     
     print(f"Gallery created with {len(gallery)} identities")
     
     # Save gallery
-    torch.save(gallery, output_path)
+    save_gallery_soa(output_path, gallery.keys(), list(gallery.values()))
     print(f"Gallery saved to {output_path}")
     return gallery
 
@@ -90,19 +602,9 @@ def update_gallery(model_path, gallery_path, new_data_dir, output_path=None, aug
         
     # Load existing gallery
     existing_gallery = {}
-    if os.path.exists(gallery_path):
+    if gallery_exists(gallery_path):
         try:
-            gallery_data = torch.load(gallery_path)
-            
-            # Handle both the old format (dict of embeddings) and new format (separate lists)
-            if isinstance(gallery_data, dict) and "identities" in gallery_data:
-                identities = gallery_data["identities"]
-                embeddings = gallery_data["embeddings"]
-                for i, identity in enumerate(identities):
-                    existing_gallery[identity] = embeddings[i]
-            else:
-                existing_gallery = gallery_data
-                
+            existing_gallery = load_gallery(gallery_path)
             print(f"Loaded existing gallery with {len(existing_gallery)} identities")
         except Exception as e:
             print(f"Error loading existing gallery: {e}")
@@ -114,74 +616,18 @@ def update_gallery(model_path, gallery_path, new_data_dir, output_path=None, aug
     model, device = load_model(model_path)
     
     # Process new identities
-    identities = [d for d in os.listdir(new_data_dir) if os.path.isdir(os.path.join(new_data_dir, d))]
-    print(f"Found {len(identities)} new identities to process")
+    with EmbeddingCache(model_path) as cache:
+        new_gallery = compute_identity_means(model, device, new_data_dir, augment_ratio, augs_per_image, cache)
     
     # Create updated gallery
     updated_gallery = existing_gallery.copy()
-    
-    for identity in tqdm(identities, desc="Processing new identities"):
-        identity_dir = os.path.join(new_data_dir, identity)
-        
-        # Get all images for this identity
-        image_files = [f for f in os.listdir(identity_dir) 
-                      if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
-        
-        if not image_files:
-            print(f"Warning: No images found for {identity}")
-            continue
-        
-        # Extract embeddings for all images
-        embeddings = []
-        for img_file in image_files:
-            img_path = os.path.join(identity_dir, img_file)
-            embedding = extract_embedding(model, img_path, device)
-            if embedding is not None:
-                embeddings.append(embedding)
-                
-                # Apply augmentation if specified
-                if augment_ratio > 0 and random.random() < augment_ratio:
-                    try:
-                        # Load original image as numpy array for augmentation
-                        img = cv2.imread(img_path)
-                        if img is not None:
-                            # Generate augmented versions
-                            augmented_images = augment_face_image(img, augs_per_image)
-                            
-                            # Extract embeddings from augmented images
-                            for aug_img in augmented_images:
-                                # Convert numpy array to PIL Image
-                                aug_pil = Image.fromarray(cv2.cvtColor(aug_img, cv2.COLOR_BGR2GRAY))
-                                
-                                # Transform and extract embedding
-                                aug_tensor = transform(aug_pil).unsqueeze(0).to(device)
-                                with torch.no_grad():
-                                    _, aug_embedding = model(aug_tensor)
-                                    aug_embedding = aug_embedding.cpu().squeeze().numpy()
-                                    embeddings.append(aug_embedding)
-                    except Exception as e:
-                        print(f"Warning: Failed to augment {img_path}: {e}")
-                        continue
-        
-        if not embeddings:
-            print(f"Warning: No valid embeddings extracted for {identity}")
-            continue
-        
-        # Average embeddings to get a single representation
-        avg_embedding = np.mean(embeddings, axis=0)
-        updated_gallery[identity] = avg_embedding
+    updated_gallery.update(new_gallery)
     
     # Create directory if it doesn't exist
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     # Save updated gallery with identities and embeddings separately
-    serializable_gallery = {
-        "identities": list(updated_gallery.keys()),
-        "embeddings": [updated_gallery[identity] for identity in updated_gallery.keys()]
-    }
-    
-    # Save updated gallery
-    torch.save(serializable_gallery, output_path)
+    save_gallery_soa(output_path, updated_gallery.keys(), list(updated_gallery.values()))
     print(f"Updated gallery saved to {output_path}")
     print(f"Gallery now contains {len(updated_gallery)} identities")
     return updated_gallery
@@ -192,8 +638,8 @@ def create_gallery_from_embeddings(gallery_path, embeddings_dict):
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(gallery_path), exist_ok=True)
         
-        # Save embeddings dictionary directly
-        torch.save(embeddings_dict, gallery_path)
+        # Save embeddings as a matrix plus identity list
+        save_gallery_soa(gallery_path, embeddings_dict.keys(), list(embeddings_dict.values()))
         print(f"Gallery created at {gallery_path} with {len(embeddings_dict)} identities")
         return embeddings_dict
     except Exception as e:
@@ -203,37 +649,33 @@ def create_gallery_from_embeddings(gallery_path, embeddings_dict):
 def update_gallery_from_embeddings(gallery_path, new_embeddings_dict):
     """Update an existing gallery with new embeddings"""
     try:
-        # Load existing gallery if it exists
-        existing_gallery = {}
-        if os.path.exists(gallery_path):
+        # Append to the existing gallery if it exists
+        if gallery_exists(gallery_path):
             try:
-                gallery_data = torch.load(gallery_path)
-                
-                # Handle both the old format (dict of embeddings) and new format (separate lists)
-                if isinstance(gallery_data, dict) and "identities" in gallery_data:
-                    identities = gallery_data["identities"]
-                    embeddings = gallery_data["embeddings"]
-                    for i, identity in enumerate(identities):
-                        existing_gallery[identity] = embeddings[i]
-                else:
-                    existing_gallery = gallery_data
-                    
-                print(f"Loaded existing gallery with {len(existing_gallery)} identities")
+                # Convert a legacy gallery before appending to it
+                migrate_legacy_gallery(gallery_path)
+                if new_embeddings_dict:
+                    append_embeddings(gallery_path, new_embeddings_dict)
+                updated_gallery = load_gallery(gallery_path)
+                print(f"Updated gallery saved to {gallery_path}")
+                print(f"Gallery now contains {len(updated_gallery)} identities")
+                return updated_gallery
             except Exception as e:
-                print(f"Error loading existing gallery: {e}")
-                existing_gallery = {}
-        else:
-            print("No existing gallery found, creating new one")
+                # Never fall through to a fresh save here: that would replace the
+                # gallery with only the new identities
+                print(f"Error updating existing gallery: {e}")
+                return None
+        
+        print("No existing gallery found, creating new one")
         
         # Merge with new embeddings
-        updated_gallery = existing_gallery.copy()
-        updated_gallery.update(new_embeddings_dict)
+        updated_gallery = dict(new_embeddings_dict)
         
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(gallery_path), exist_ok=True)
         
         # Save updated gallery
-        torch.save(updated_gallery, gallery_path)
+        save_gallery_soa(gallery_path, updated_gallery.keys(), list(updated_gallery.values()))
         print(f"Updated gallery saved to {gallery_path}")
         print(f"Gallery now contains {len(updated_gallery)} identities")
         return updated_gallery
@@ -1,6 +1,6 @@
 import logging
-from apscheduler.schedulers.background import BackgroundScheduler
-from quality_checker import VideoQualityChecker
+import multiprocessing
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from config.settings import STUDENT_DATA_DIR, DEFAULT_YOLO_PATH
 from services.student_data_service import get_student_data_folders
 from database_backup import run_backup
@@ -9,15 +9,22 @@ from database_backup import run_backup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def run_periodic_quality_checks():
+# Share of GPU memory the quality check worker may take, leaving the rest for inference
+QUALITY_WORKER_GPU_MEMORY_FRACTION = 0.25
+
+# Quality checks run in a separate process with its own CUDA context; the scheduler
+# only posts jobs to this queue
+_mp_context = multiprocessing.get_context('spawn')
+quality_check_queue = _mp_context.Queue()
+_quality_worker = None
+
+def run_periodic_quality_checks(quality_checker):
     """
     Runs quality checks for all videos that haven't been processed yet.
     """
     logger.info("Starting periodic quality check...")
     
     try:
-        quality_checker = VideoQualityChecker(DEFAULT_YOLO_PATH)
-        
         # Get all department-year folders from the student data directory
         folders = get_student_data_folders()
         
@@ -38,7 +45,61 @@ def run_periodic_quality_checks():
     except Exception as e:
         logger.error(f"An error occurred during the periodic quality check: {e}", exc_info=True)
 
+def quality_check_worker(queue):
+    """
+    Long-running process that owns the YOLO model and runs queued quality checks.
+    """
+    import torch
+    from quality_checker import get_quality_checker
+    
+    if torch.cuda.is_available():
+        torch.cuda.set_per_process_memory_fraction(QUALITY_WORKER_GPU_MEMORY_FRACTION)
+    
+    try:
+        quality_checker = get_quality_checker(DEFAULT_YOLO_PATH)
+    except Exception as e:
+        logger.error(f"Quality check worker failed to load the YOLO model: {e}", exc_info=True)
+        return
+    
+    # A None job is the signal to stop
+    while queue.get() is not None:
+        run_periodic_quality_checks(quality_checker)
+
+def dispatch_quality_checks():
+    """
+    Scheduler job: hand a quality check run to the worker process.
+    """
+    if _quality_worker is None or not _quality_worker.is_alive():
+        logger.warning("Quality check worker is not running; starting it.")
+        start_quality_worker()
+    quality_check_queue.put("check")
+
+def start_quality_worker():
+    """
+    Start the quality check worker process if it isn't already running.
+    """
+    global _quality_worker
+    if _quality_worker is not None and _quality_worker.is_alive():
+        return
+    _quality_worker = _mp_context.Process(
+        target=quality_check_worker, args=(quality_check_queue,), daemon=True
+    )
+    _quality_worker.start()
+
+def stop_quality_worker(timeout=10):
+    """
+    Ask the quality check worker to exit once its current run is done.
+    """
+    global _quality_worker
+    if _quality_worker is None:
+        return
+    quality_check_queue.put(None)
+    _quality_worker.join(timeout)
+    if _quality_worker.is_alive():
+        _quality_worker.terminate()
+    _quality_worker = None
+
 # Initialize the scheduler
-scheduler = BackgroundScheduler(daemon=True)
-scheduler.add_job(run_periodic_quality_checks, 'interval', hours=2)
+scheduler = AsyncIOScheduler()
+scheduler.add_job(dispatch_quality_checks, 'interval', hours=2)
 scheduler.add_job(run_backup, 'cron', hour=16, minute=35)
@@ -1,17 +1,88 @@
 import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
+import torch
+import torch.nn.functional as F
 from ultralytics import YOLO
 from typing import Dict, List, Tuple, Any
 import json
 from pathlib import Path
 from database.models import save_quality_check_report
+from utils.video_utils import open_video_capture
+from services.face_processing import get_yolo_model, yolo_lock
 import mediapipe as mp
 
+# Frames per YOLO forward pass when checking a video, and the rough GPU memory
+# one frame of a batch needs; smaller batches are used when less memory is free
+YOLO_BATCH_SIZE = 16
+YOLO_FRAME_MEMORY = 128 * 1024 ** 2
+
+# Longest side YOLO sees; larger frames are downscaled once before detection
+YOLO_INPUT_SIZE = 640
+
+# Frames whose dHash differs from the last detected frame's in at most this many
+# bits reuse its detections instead of running YOLO again
+DHASH_MAX_DISTANCE = 4
+
+# Frames analyzed when a quick look shows the video is uniform, and the spread
+# (coefficient of variation) of sharpness/brightness above which it is not
+QUICK_SAMPLE_COUNT = 50
+SAMPLE_ESCALATION_CV = 0.25
+
+def frame_dhash(frame: np.ndarray) -> int:
+    """64-bit difference hash of a frame: brightness gradients of a 9x8 thumbnail"""
+    thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(thumb[:, 1:] > thumb[:, :-1]).tobytes(), 'big')
+
+# Without a GPU, frame metrics are computed on these threads; OpenCV releases the GIL
+# in its kernels, so frames are scored in parallel across all cores. Shared by every
+# video being checked, so concurrent checks don't oversubscribe the CPU
+_frame_metrics_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='frame-metrics')
+
+# Failed frames are JPEG-encoded and written on these background threads so detection
+# doesn't wait on disk
+_failed_frame_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='failed-frame-writer')
+
+# Fraction of the face box added on each side of the crop FaceMesh sees
+FACE_MESH_CROP_MARGIN = 0.25
+
+# Every label estimate_face_pose can return
+POSE_LABELS = ("front", "side", "unknown")
+
+# Most videos checked concurrently; decoding and CPU metrics of one video overlap
+# with YOLO inference on another. Also capped at half the CPU cores so the GPU
+# feed keeps some for itself
+QUALITY_CHECK_WORKERS = 4
+
+# Frames sampled from each video by check_video_quality
+QUALITY_CHECK_SAMPLES = 200
+
+# Memory the sampled frames of all concurrently checked videos may take together;
+# check_all_videos runs fewer videos at once when the videos are large (200 frames
+# of a 1080p video are about 1.2 GB)
+QUALITY_CHECK_FRAME_BUDGET = 1536 * 1024 * 1024
+
+def sampled_frames_bytes(video_path: str, num_samples: int = QUALITY_CHECK_SAMPLES) -> int:
+    """Memory num_samples decoded BGR frames of video_path take, from its header; 0 if unknown"""
+    cap = open_video_capture(video_path)
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    return max(0, width * height * 3 * num_samples)
+
 class VideoQualityChecker:
     def __init__(self, yolo_model_path: str):
         """Initialize the quality checker with YOLO model for face detection"""
-        self.yolo_model = YOLO(yolo_model_path)
+        # The YOLO predictor keeps per-call state, so threads take turns running it;
+        # the model and its lock are shared with face extraction and recognition
+        self.yolo_model, self.yolo_lock = self.get_cached_model(yolo_model_path)
+        self.yolo_device = 0 if torch.cuda.is_available() else 'cpu'
+        self.yolo_batch_size = self.pick_yolo_batch_size()
         self.quality_thresholds = {
             'min_faces_detected': 5,  # Minimum faces across all sampled frames
             'max_faces_per_frame': 1,  # Maximum faces per frame (to avoid multiple people)
@@ -20,50 +91,142 @@ class VideoQualityChecker:
             'min_face_angles': 1,  # Minimum different face angles/poses
             'min_face_size': 60,  # Minimum face size (pixels)
             'max_motion_blur': 80,  # Maximum motion blur threshold (generous)
+            'min_usable_blur_score': 10,  # Below this a frame is too blurry to be worth detecting faces in
+            'min_usable_contrast': 5,  # Below this a frame is too dark/flat to be worth detecting faces in
         }
     
+    @staticmethod
+    def get_cached_model(yolo_model_path: str) -> Tuple[YOLO, threading.Lock]:
+        """The process-wide YOLO model for yolo_model_path and the lock that serializes its use"""
+        if torch.cuda.is_available():
+            # Detection batches all have the same shape, so let cuDNN pick its fastest
+            # kernels should the PyTorch weights end up being used
+            torch.backends.cudnn.benchmark = True
+        return get_yolo_model(yolo_model_path), yolo_lock
+    
+    @staticmethod
+    def pick_yolo_batch_size() -> int:
+        """Largest batch up to YOLO_BATCH_SIZE that fits in the GPU memory currently free"""
+        if not torch.cuda.is_available():
+            return YOLO_BATCH_SIZE
+        free_memory, _ = torch.cuda.mem_get_info()
+        return max(1, min(YOLO_BATCH_SIZE, free_memory // YOLO_FRAME_MEMORY))
+    
     def sample_frames(self, video_path: str, num_samples: int = 50) -> List[np.ndarray]:
-        """Sample 15 frames from different points in the video"""
-        cap = cv2.VideoCapture(video_path)
+        """
+        Sample num_samples frames evenly spaced over the video, decoding it in a single
+        sequential pass
+        """
+        cap = open_video_capture(video_path)
         if not cap.isOpened():
             return []
         
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            # Some containers don't record a frame count; count by grabbing (no conversion)
+            # and reopen, rather than guessing the spacing
+            while cap.grab():
+                total_frames += 1
+            cap.release()
+            cap = open_video_capture(video_path)
         if total_frames < num_samples:
             num_samples = total_frames
         
         # Sample frames at regular intervals across the timeline
-        frame_indices = np.linspace(0, total_frames - 1, num_samples, dtype=int)
+        frame_indices = set(np.linspace(0, total_frames - 1, num_samples, dtype=int).tolist())
         frames = []
         
-        for idx in frame_indices:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-            ret, frame = cap.read()
-            if ret:
-                frames.append(frame)
+        # Decode sequentially instead of seeking, which makes the decoder restart from the
+        # previous keyframe for every sample; unwanted frames are grabbed but not converted
+        last_index = max(frame_indices, default=-1)
+        for idx in range(last_index + 1):
+            if not cap.grab():
+                break
+            if idx in frame_indices:
+                ret, frame = cap.retrieve()
+                if ret:
+                    frames.append(frame)
         
         cap.release()
         return frames
     
+    @staticmethod
+    def edge_density(gray: np.ndarray) -> float:
+        """Motion blur score of a grayscale frame; see detect_motion_blur"""
+        # Canny output is 0 or 255, so its mean is the edge pixel share scaled to 255
+        return 255.0 * cv2.countNonZero(cv2.Canny(gray, 50, 150)) / gray.size
+    
+    def frame_metrics(self, image: np.ndarray, motion_blur: bool = True) -> Tuple[float, float, float]:
+        """
+        Compute (blur, contrast, motion blur) scores from a single grayscale conversion.
+        See detect_blur, check_contrast and detect_motion_blur for what each score means.
+        image may be a BGR frame or an already converted grayscale one.
+        With motion_blur=False the (comparatively expensive) Canny pass is skipped and NaN
+        is returned in its place.
+        """
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        
+        # Single-pass OpenCV reductions instead of NumPy's multi-pass var/std/mean. The
+        # 3x3 Laplacian of 8-bit pixels lies within +-1020, so 16-bit output is exact and
+        # a quarter of the memory traffic of CV_64F
+        _, laplacian_std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+        blur = float(laplacian_std[0, 0]) ** 2
+        _, gray_std = cv2.meanStdDev(gray)
+        contrast = float(gray_std[0, 0])
+        return blur, contrast, self.edge_density(gray) if motion_blur else np.nan
+    
+    def frame_metrics_batch(self, frames: List[np.ndarray], motion_blur: bool = True) -> np.ndarray:
+        """
+        frame_metrics for a list of same-sized BGR frames, as an (N, 3) array of
+        (blur, contrast, motion blur) rows. Without a GPU the frames may also be grayscale.
+        On a GPU the grayscale conversion,
+        Laplacian variance and contrast are computed for a whole batch at once and copied
+        back together; Canny has no torch equivalent, so motion blur stays on the CPU.
+        """
+        scores = np.empty((len(frames), 3), dtype=np.float64)
+        if not torch.cuda.is_available():
+            # frame_metrics already fuses all three scores over one grayscale conversion;
+            # OpenCV's kernels are SIMD-vectorized, so frames are just spread over threads
+            rows = _frame_metrics_pool.map(lambda frame: self.frame_metrics(frame, motion_blur), frames)
+            for idx, row in enumerate(rows):
+                scores[idx] = row
+            return scores
+        
+        laplacian_kernel = torch.tensor([[0., 1., 0.], [1., -4., 1.], [0., 1., 0.]], device='cuda').view(1, 1, 3, 3)
+        # Same weights and rounding as cv2.COLOR_BGR2GRAY
+        bgr_weights = torch.tensor([0.114, 0.587, 0.299], device='cuda').view(1, 3, 1, 1)
+        
+        gpu_scores = []
+        with torch.inference_mode():
+            for start in range(0, len(frames), YOLO_BATCH_SIZE):
+                batch = torch.from_numpy(np.stack(frames[start:start + YOLO_BATCH_SIZE])).cuda(non_blocking=True)
+                gray = (batch.permute(0, 3, 1, 2).float() * bgr_weights).sum(dim=1, keepdim=True).round()
+                # Reflect padding matches OpenCV's default BORDER_REFLECT_101
+                laplacian = F.conv2d(F.pad(gray, (1, 1, 1, 1), mode='reflect'), laplacian_kernel)
+                gpu_scores.append(torch.stack([
+                    laplacian.var(dim=(-3, -2, -1), unbiased=False),
+                    gray.std(dim=(-3, -2, -1), unbiased=False),
+                ], dim=1))
+            scores[:, :2] = torch.cat(gpu_scores).double().cpu().numpy()
+        
+        for idx, frame in enumerate(frames):
+            scores[idx, 2] = self.edge_density(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)) if motion_blur else np.nan
+        return scores
+    
     def detect_blur(self, image: np.ndarray) -> float:
         """Detect blur using Laplacian variance (generous threshold)"""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-        return laplacian_var
+        return self.frame_metrics(image, motion_blur=False)[0]
     
     def detect_motion_blur(self, image: np.ndarray) -> float:
         """
         Detect motion blur using edge detection.
         Motion blur causes edges to be less distinct. The Canny edge detector finds edges in the image; if the image is sharp, there will be more strong edges and the mean value will be higher. If the image is motion blurred, edges are weaker and the mean value is lower. A higher threshold means more frames will pass the motion blur check.
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
-        return float(np.mean(edges))
+        return self.edge_density(image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
     
     def check_contrast(self, image: np.ndarray) -> float:
         """Check image contrast using standard deviation (generous threshold)"""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        return float(np.std(gray))
+        return self.frame_metrics(image, motion_blur=False)[1]
     
     # def detect_face_angles(self, faces_data: List[Dict]) -> int:
     #     """Estimate number of different face angles based on bounding box variations"""
@@ -94,41 +257,76 @@ class VideoQualityChecker:
         
     #     return len(unique_angles)
     
-    def estimate_face_pose(self, image: np.ndarray, bbox: Tuple[int, int, int, int]) -> Tuple[str, float, float, float]:
+    @staticmethod
+    def create_face_mesh(static_image_mode: bool = True):
+        """
+        Create a MediaPipe FaceMesh for pose estimation. Use it as a context manager so its
+        graph is closed; with static_image_mode=False it tracks the face between calls, so
+        only feed it consecutive frames of one video, from one thread.
+        """
+        return mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=static_image_mode,
+            max_num_faces=1,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5,
+        )
+
+    def estimate_face_pose(self, image: np.ndarray, bbox: Tuple[int, int, int, int],
+                           face_mesh=None) -> Tuple[str, float, float, float]:
         """
         Estimate face pose: 'front' , 'side' , or 'unknown'.
         Returns a tuple: (label, yaw, pitch, roll)
+        Pass a face_mesh from create_face_mesh to reuse it across frames.
         """
-        mp_face_mesh = mp.solutions.face_mesh
-        with mp_face_mesh.FaceMesh(static_image_mode=True) as face_mesh:
-            results = face_mesh.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-            if not results.multi_face_landmarks:
-                return "unknown", 0.0, 0.0, 0.0
-            landmarks = results.multi_face_landmarks[0].landmark
+        if face_mesh is None:
+            with self.create_face_mesh() as face_mesh:
+                return self.estimate_face_pose(image, bbox, face_mesh)
+        
+        # FaceMesh only needs to see the detected face plus some margin for context
+        height, width = image.shape[:2]
+        x1, y1, x2, y2 = bbox
+        margin_x = (x2 - x1) * FACE_MESH_CROP_MARGIN
+        margin_y = (y2 - y1) * FACE_MESH_CROP_MARGIN
+        left, top = max(0, int(x1 - margin_x)), max(0, int(y1 - margin_y))
+        right, bottom = min(width, int(x2 + margin_x)), min(height, int(y2 + margin_y))
+        if right <= left or bottom <= top:
+            return "unknown", 0.0, 0.0, 0.0
+        
+        roi = image[top:bottom, left:right]
+        results = face_mesh.process(cv2.cvtColor(roi, cv2.COLOR_BGR2RGB))
+        if not results.multi_face_landmarks:
+            return "unknown", 0.0, 0.0, 0.0
+        landmarks = results.multi_face_landmarks[0].landmark
 
-            nose_tip = landmarks[1]
-            left_eye = landmarks[33]
-            right_eye = landmarks[263]
+        # Landmarks are normalized to the crop; map them back to whole-frame normalized
+        # coordinates, which the yaw/pitch thresholds below are calibrated for
+        def to_frame(landmark):
+            return ((left + landmark.x * (right - left)) / width,
+                    (top + landmark.y * (bottom - top)) / height)
 
-            eye_dx = right_eye.x - left_eye.x
-            nose_to_eye_y = nose_tip.y - ((left_eye.y + right_eye.y) / 2)
+        nose_tip = to_frame(landmarks[1])
+        left_eye = to_frame(landmarks[33])
+        right_eye = to_frame(landmarks[263])
 
-            yaw = eye_dx
-            pitch = nose_to_eye_y
-            roll = 0.0
+        eye_dx = right_eye[0] - left_eye[0]
+        nose_to_eye_y = nose_tip[1] - ((left_eye[1] + right_eye[1]) / 2)
 
-            
-            # Only two types: 'side' (left or right), 'front' (was 'down'), else 'unknown'
-            SIDE_YAW_THRESHOLD = 0.15
-            if abs(yaw) > SIDE_YAW_THRESHOLD:
-                angle_label = "front"
-            elif abs(yaw) <= SIDE_YAW_THRESHOLD and abs(pitch) <= 0.12:
-                angle_label = "side"
-            else:
-                angle_label = "unknown"
-
-            print(f"[DEBUG] Yaw: {yaw:.2f}, Pitch: {pitch:.2f}, Roll: {roll:.2f}, Label: {angle_label}")
-            return angle_label, yaw, pitch, roll
+        yaw = eye_dx
+        pitch = nose_to_eye_y
+        roll = 0.0
+
+        
+        # Only two types: 'side' (left or right), 'front' (was 'down'), else 'unknown'
+        SIDE_YAW_THRESHOLD = 0.15
+        if abs(yaw) > SIDE_YAW_THRESHOLD:
+            angle_label = "front"
+        elif abs(yaw) <= SIDE_YAW_THRESHOLD and abs(pitch) <= 0.12:
+            angle_label = "side"
+        else:
+            angle_label = "unknown"
+
+        print(f"[DEBUG] Yaw: {yaw:.2f}, Pitch: {pitch:.2f}, Roll: {roll:.2f}, Label: {angle_label}")
+        return angle_label, yaw, pitch, roll
 
     def check_pose_diversity(self, frames: List[np.ndarray], faces_data: List[Dict]) -> List[str]:
         """
@@ -136,12 +334,73 @@ class VideoQualityChecker:
         Returns a list of detected pose categories.
         """
         pose_categories = set()
-        for frame, face in zip(frames, faces_data):
-            pose = self.estimate_face_pose(frame, face['bbox'])
-            if pose != "unknown":
-                pose_categories.add(pose)
+        # One FaceMesh per video, so each concurrently checked video gets its own instance.
+        # It runs in static image mode because consecutive face crops don't form a stream
+        # the tracker could follow
+        with self.create_face_mesh() as face_mesh:
+            for face in faces_data:
+                pose, *_ = self.estimate_face_pose(frames[face['frame']], face['bbox'], face_mesh)
+                if pose != "unknown":
+                    pose_categories.add(pose)
         return list(pose_categories)
 
+    def detect_faces_batched(self, frames: List[np.ndarray], conf: float = 0.65):
+        """Run YOLO face detection over frames in batches, yielding one result per frame"""
+        for start in range(0, len(frames), self.yolo_batch_size):
+            with self.yolo_lock, torch.inference_mode():
+                # half=True runs the PyTorch fallback in FP16 on the GPU; an engine is FP16 already
+                results = self.yolo_model(frames[start:start + self.yolo_batch_size], conf=conf, verbose=False,
+                                          save=False, device=self.yolo_device, half=self.yolo_device != 'cpu')
+            yield from results
+
+    def detect_faces_deduplicated(self, frames: List[np.ndarray], conf: float = 0.65):
+        """
+        Like detect_faces_batched, but a frame that is a near-duplicate of the last frame
+        YOLO ran on reuses that frame's result
+        """
+        hashes = [frame_dhash(frame) for frame in frames]
+        
+        # Index into detected_indices of the result each frame uses
+        detected_indices = []
+        result_for_frame = []
+        for idx, frame_hash in enumerate(hashes):
+            if not detected_indices or bin(frame_hash ^ hashes[detected_indices[-1]]).count('1') > DHASH_MAX_DISTANCE:
+                detected_indices.append(idx)
+            result_for_frame.append(len(detected_indices) - 1)
+        
+        detections = self.detect_faces_batched([frames[idx] for idx in detected_indices], conf)
+        results = []
+        for result_idx in result_for_frame:
+            if result_idx == len(results):
+                results.append(next(detections))
+            yield results[result_idx]
+
+    def select_frames(self, frames: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Pick the frames to analyze: an evenly spaced QUICK_SAMPLE_COUNT subset when
+        sharpness and brightness barely vary across it, otherwise every sampled frame
+        """
+        if len(frames) <= QUICK_SAMPLE_COUNT:
+            return frames
+        
+        subset = [frames[i] for i in np.linspace(0, len(frames) - 1, QUICK_SAMPLE_COUNT, dtype=int)]
+        
+        # Judge uniformity on small thumbnails; only the relative spread matters here
+        stats = []
+        for frame in subset:
+            height, width = frame.shape[:2]
+            thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (160, max(1, height * 160 // width)),
+                               interpolation=cv2.INTER_AREA)
+            _, sharpness_std = cv2.meanStdDev(cv2.Laplacian(thumb, cv2.CV_16S))
+            stats.append((float(sharpness_std[0, 0]) ** 2, float(cv2.mean(thumb)[0])))
+        
+        stats = np.array(stats)
+        variation = stats.std(axis=0) / np.maximum(stats.mean(axis=0), 1e-6)
+        if np.any(variation > SAMPLE_ESCALATION_CV):
+            print(f"Video varies across frames, analyzing all {len(frames)} sampled frames")
+            return frames
+        return subset
+
     def check_single_video_quality(self, video_path: str, save_failed_frames: bool = False) -> Dict[str, Any]:
         """Check quality of a single video file"""
         if not os.path.exists(video_path):
@@ -153,7 +412,7 @@ class VideoQualityChecker:
             }
 
         # Sample more frames from the video (or use 200 for more coverage)
-        frames = self.sample_frames(video_path, 200)
+        frames = self.sample_frames(video_path, QUALITY_CHECK_SAMPLES)
         if not frames:
             return {
                 'overall_quality': 'fail',
@@ -162,128 +421,192 @@ class VideoQualityChecker:
                 'details': {}
             }
 
+        # Uniform videos give the same verdict from a smaller subset of frames
+        frames = self.select_frames(frames)
+
         # Create failed frames directory if saving is enabled
         failed_frames_dir = None
         if save_failed_frames:
             video_dir = os.path.dirname(video_path)
             failed_frames_dir = os.path.join(video_dir, "failed_frames")
             
-            # Clean up old failed frames if directory exists
-            if os.path.exists(failed_frames_dir):
-                for old_frame in os.listdir(failed_frames_dir):
-                    if old_frame.endswith(('.jpg', '.png', '.jpeg')):
-                        os.remove(os.path.join(failed_frames_dir, old_frame))
-            
+            # Clean up old failed frames; the directory only ever holds this check's output
+            shutil.rmtree(failed_frames_dir, ignore_errors=True)
             os.makedirs(failed_frames_dir, exist_ok=True)
 
+        # Cheap quality metrics first: frames too blurry or dark to judge are not worth a YOLO pass.
+        # Motion blur is only needed for frames with a single face, so it is filled in below
+        # Without a GPU the grayscale frames are kept, so motion blur doesn't convert again
+        grays = None if torch.cuda.is_available() else [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames]
+        frame_scores = self.frame_metrics_batch(grays or frames, motion_blur=False)
+        unusable = ((frame_scores[:, 0] < self.quality_thresholds['min_usable_blur_score'])
+                    | (frame_scores[:, 1] < self.quality_thresholds['min_usable_contrast']))
+        
+        # If most frames are unusable the video fails no matter what YOLO finds
+        if unusable.sum() > len(frames) // 2:
+            critical_issues = ["Video too blurry or dark to analyze"]
+            return {
+                'overall_quality': 'fail',
+                'category': 'fail',
+                'quality_issues': critical_issues,
+                'critical_issues': critical_issues,
+                'major_issues': [],
+                'minor_issues': [],
+                'details': {
+                    'total_faces': 0,
+                    'multiple_faces_frames': 0,
+                    'avg_blur_score': float(frame_scores[:, 0].mean()),
+                    'avg_contrast': float(frame_scores[:, 1].mean()),
+                    'avg_motion_blur': 0,
+                    'avg_face_size': 0,
+                    'frames_analyzed': len(frames),
+                    'unusable_frames': int(unusable.sum()),
+                    'problem_flags': [],
+                    'failed_frames_saved': 0,
+                    'failed_frames_directory': failed_frames_dir if save_failed_frames else None
+                }
+            }
+
         # Initialize quality metrics
         total_faces = 0
         multiple_faces_count = 0
-        blur_scores = []
-        contrast_scores = []
-        motion_blur_scores = []
+        # Frames whose blur/contrast/motion blur count towards the averages: the single-face
+        # frames, plus the unusable frames that were kept from YOLO, which would otherwise
+        # leave the averages looking better than the video is
+        scored_frames = np.zeros(len(frames), dtype=bool)
+        # Single-face frames, each with one entry in face_sizes
+        sized_frames = np.zeros(len(frames), dtype=bool)
+        face_sizes = np.zeros(len(frames), dtype=np.float64)
         faces_data = []
         problem_flags = []  # For UI display: all detected problems per frame
         multiple_faces_critical = False  # If any frame has multiple faces
-
-        # Process each sampled frame
-        for frame_idx, frame in enumerate(frames):
-            # Normalize frame for YOLO: convert to RGB and scale pixel values to [0,1]
-            # frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            # frame_norm = frame_rgb.astype(np.float32) / 255.0
-            # # Detect faces
-            results = self.yolo_model(frame, conf = 0.65)
-            frame_faces = 0
-            frame_flags = []
-            frame_has_issues = False
-
-            if len(results) > 0 and hasattr(results[0], 'boxes') and len(results[0].boxes) > 0:
-                frame_faces = len(results[0].boxes)
-                total_faces += frame_faces
-
-                if frame_faces > 1:
-                    multiple_faces_count += 1
-                    multiple_faces_critical = True
-                    frame_flags.append("Multiple faces detected (critical fail)")
+        frame_writes = []  # Pending failed frame saves
+
+        # YOLO resizes to its input size anyway, so hand it downscaled copies of the usable
+        # frames and map the boxes back. Quality metrics keep using the full-resolution
+        # frames: their thresholds are calibrated at capture resolution
+        usable_frames = [frame for frame, skip in zip(frames, unusable) if not skip]
+        height, width = frames[0].shape[:2]
+        detection_scale = min(1.0, YOLO_INPUT_SIZE / max(height, width))
+        if detection_scale < 1.0:
+            detection_size = (round(width * detection_scale), round(height * detection_scale))
+            usable_frames = [cv2.resize(f, detection_size, interpolation=cv2.INTER_AREA) for f in usable_frames]
+
+        # Process each sampled frame; faces are detected a batch of usable frames at a time,
+        # near-duplicate frames share detections, and batches after an early stop are never run
+        detections = self.detect_faces_deduplicated(usable_frames)
+        # Face poses are estimated as faces are found, with one FaceMesh for the whole video
+        pose_categories = set()
+        with self.create_face_mesh() as face_mesh:
+            for frame_idx, frame in enumerate(frames):
+                result = None if unusable[frame_idx] else next(detections)
+                frame_faces = 0
+                frame_flags = []
+                frame_has_issues = False
+
+                if result is None:
+                    frame_scores[frame_idx, 2] = self.edge_density(
+                        grays[frame_idx] if grays else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    )
+                    scored_frames[frame_idx] = True
+                    frame_flags.append("Too blurry or dark to detect faces")
                     frame_has_issues = True
-                    # Save all flags for this frame (for UI display)
-                    if frame_flags:
-                        problem_flags.append({
-                            'frame': frame_idx,
-                            'flags': frame_flags
-                        })
+                elif hasattr(result, 'boxes') and len(result.boxes) > 0:
+                    frame_faces = len(result.boxes)
+                    total_faces += frame_faces
+
+                    if frame_faces > 1:
+                        multiple_faces_count += 1
+                        multiple_faces_critical = True
+                        frame_flags.append("Multiple faces detected (critical fail)")
+                        frame_has_issues = True
+                        # Save all flags for this frame (for UI display)
+                        if frame_flags:
+                            problem_flags.append({
+                                'frame': frame_idx,
+                                'flags': frame_flags
+                            })
                     
-                    # Save frame if it has critical issues
-                    if save_failed_frames and failed_frames_dir:
-                        frame_filename = f"frame_{frame_idx:03d}_multiple_faces.jpg"
-                        frame_path = os.path.join(failed_frames_dir, frame_filename)
-                        cv2.imwrite(frame_path, frame)
+                        # Save frame if it has critical issues
+                        if save_failed_frames and failed_frames_dir:
+                            frame_filename = f"frame_{frame_idx:03d}_multiple_faces.jpg"
+                            frame_path = os.path.join(failed_frames_dir, frame_filename)
+                            frame_writes.append(_failed_frame_writer.submit(cv2.imwrite, frame_path, frame))
                     
-                    break  # Stop further processing if critical fail
+                        break  # Stop further processing if critical fail
                 
-                # Check blur
-                blur_score = self.detect_blur(frame)
-                blur_scores.append(blur_score)
-                if blur_score < self.quality_thresholds['min_blur_score']:
-                    frame_flags.append("Blurry frame")
-                    frame_has_issues = True
+                    blur_score, contrast_score, _ = frame_scores[frame_idx]
+                    motion_blur_score = self.edge_density(
+                        grays[frame_idx] if grays else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    )
+                    frame_scores[frame_idx, 2] = motion_blur_score
+                    scored_frames[frame_idx] = True
+                
+                    # Check blur
+                    if blur_score < self.quality_thresholds['min_blur_score']:
+                        frame_flags.append("Blurry frame")
+                        frame_has_issues = True
 
-                # Check contrast
-                contrast_score = self.check_contrast(frame)
-                contrast_scores.append(contrast_score)
-                if contrast_score < self.quality_thresholds['min_contrast']:
-                    frame_flags.append("Low contrast")
-                    frame_has_issues = True
+                    # Check contrast
+                    if contrast_score < self.quality_thresholds['min_contrast']:
+                        frame_flags.append("Low contrast")
+                        frame_has_issues = True
                 
-                # Check motion blur
-                motion_blur_score = self.detect_motion_blur(frame)
-                motion_blur_scores.append(motion_blur_score)
-                if motion_blur_score > self.quality_thresholds['max_motion_blur']:
-                    frame_flags.append("Motion blur detected")
-                    frame_has_issues = True
+                    # Check motion blur
+                    if motion_blur_score > self.quality_thresholds['max_motion_blur']:
+                        frame_flags.append("Motion blur detected")
+                        frame_has_issues = True
                 
-                # Check face size
-                for box in results[0].boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    face_width = x2 - x1
-                    face_height = y2 - y1
-                    face_size = max(face_width, face_height)
+                    # Check face size
+                    for box in result.boxes:
+                        x1, y1, x2, y2 = map(int, box.xyxy[0] / detection_scale)
+                        face_width = x2 - x1
+                        face_height = y2 - y1
+                        face_size = max(face_width, face_height)
+                        face_sizes[frame_idx] = face_size
+                        sized_frames[frame_idx] = True
                     
-                    if face_size < self.quality_thresholds['min_face_size']:
-                        frame_flags.append("Face too small")
-                        frame_has_issues = True
+                        if face_size < self.quality_thresholds['min_face_size']:
+                            frame_flags.append("Face too small")
+                            frame_has_issues = True
                     
-                    faces_data.append({
-                        'bbox': (x1, y1, x2, y2),
-                        'size': face_size
+                        faces_data.append({
+                            'frame': frame_idx,
+                            'bbox': (x1, y1, x2, y2),
+                            'size': face_size
+                        })
+                        
+                        pose, *_ = self.estimate_face_pose(frame, (x1, y1, x2, y2), face_mesh)
+                        if pose != "unknown":
+                            pose_categories.add(pose)
+                else:
+                    frame_flags.append("No face detected")
+                    frame_has_issues = True
+
+                # Save frame if it has any quality issues
+                if save_failed_frames and failed_frames_dir and frame_has_issues:
+                    # Create filename with issues description
+                    issues_text = "_".join([flag.lower().replace(" ", "_").replace("(", "").replace(")", "") for flag in frame_flags])
+                    issues_text = issues_text[:50]  # Limit filename length
+                    frame_filename = f"frame_{frame_idx:03d}_{issues_text}.jpg"
+                    frame_path = os.path.join(failed_frames_dir, frame_filename)
+                    frame_writes.append(_failed_frame_writer.submit(cv2.imwrite, frame_path, frame))
+
+                # Save all flags for this frame (for UI display)
+                if frame_flags:
+                    problem_flags.append({
+                        'frame': frame_idx,
+                        'flags': frame_flags
                     })
-            else:
-                frame_flags.append("No face detected")
-                frame_has_issues = True
-
-            # Save frame if it has any quality issues
-            if save_failed_frames and failed_frames_dir and frame_has_issues:
-                # Create filename with issues description
-                issues_text = "_".join([flag.lower().replace(" ", "_").replace("(", "").replace(")", "") for flag in frame_flags])
-                issues_text = issues_text[:50]  # Limit filename length
-                frame_filename = f"frame_{frame_idx:03d}_{issues_text}.jpg"
-                frame_path = os.path.join(failed_frames_dir, frame_filename)
-                cv2.imwrite(frame_path, frame)
-
-            # Save all flags for this frame (for UI display)
-            if frame_flags:
-                problem_flags.append({
-                    'frame': frame_idx,
-                    'flags': frame_flags
-                })
-            # Continue to next frame unless break was triggered above
+                # Continue to next frame unless break was triggered above
 
         # Calculate metrics
-        avg_blur = np.mean(blur_scores) if blur_scores else 0
-        avg_contrast = np.mean(contrast_scores) if contrast_scores else 0
-        avg_motion_blur = np.mean(motion_blur_scores) if motion_blur_scores else 0
+        if scored_frames.any():
+            avg_blur, avg_contrast, avg_motion_blur = frame_scores[scored_frames].mean(axis=0).tolist()
+        else:
+            avg_blur = avg_contrast = avg_motion_blur = 0
+        avg_face_size = float(face_sizes[sized_frames].mean()) if sized_frames.any() else 0
         # face_angles = self.detect_face_angles(faces_data)
-        avg_face_size = np.mean([f['size'] for f in faces_data]) if faces_data else 0
 
         # Quality checks - categorize issues
         critical_issues = []
@@ -330,17 +653,14 @@ class VideoQualityChecker:
 
         all_issues = critical_issues + major_issues + minor_issues
 
-        # After collecting faces_data and frames:
-        pose_categories = self.check_pose_diversity(frames, faces_data)
+        # Poses were collected in the frame loop above
         required_poses = {"front", "side"}
         missing_poses = required_poses - set(pose_categories)
         if missing_poses:
             minor_issues.append(f"Missing face angles: {', '.join(missing_poses)}")
 
-        # Count saved failed frames
-        saved_frames_count = 0
-        if save_failed_frames and failed_frames_dir and os.path.exists(failed_frames_dir):
-            saved_frames_count = len([f for f in os.listdir(failed_frames_dir) if f.endswith(('.jpg', '.png', '.jpeg'))])
+        # Count saved failed frames once they are all on disk (imwrite returns whether it wrote)
+        saved_frames_count = sum(bool(frame_write.result()) for frame_write in frame_writes)
 
         return {
             'overall_quality': 'pass' if category == 'pass' else 'fail',
@@ -357,6 +677,7 @@ class VideoQualityChecker:
                 'avg_motion_blur': avg_motion_blur,
                 'avg_face_size': avg_face_size,
                 'frames_analyzed': len(frames),
+                'unusable_frames': int(unusable.sum()),
                 'problem_flags': problem_flags,  # For UI: all frame-level problem flags
                 'failed_frames_saved': saved_frames_count,
                 'failed_frames_directory': failed_frames_dir if save_failed_frames else None
@@ -364,8 +685,31 @@ class VideoQualityChecker:
         }
     
     
-    def check_student_data_quality(self, dept: str, year: str, student_data_dir: str) -> Dict[str, Any]:
-        """Check quality for all students in a department-year folder"""
+    @staticmethod
+    def video_check_key(video_path: str) -> List[int]:
+        """Identifies a video's contents for skipping re-checks: [size, mtime in ns]"""
+        stat = os.stat(video_path)
+        return [stat.st_size, stat.st_mtime_ns]
+    
+    @staticmethod
+    def stored_quality_result(student_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Rebuild check_single_video_quality's result from the fields saved in a student's JSON"""
+        return {
+            'overall_quality': student_data.get('qualityCheck'),
+            'category': student_data['qualityCategory'],
+            'details': student_data.get('qualityDetails', {}),
+            'quality_issues': student_data.get('qualityIssues', []),
+            'critical_issues': student_data.get('criticalIssues', []),
+            'major_issues': student_data.get('majorIssues', []),
+            'minor_issues': student_data.get('minorIssues', [])
+        }
+    
+    def check_student_data_quality(self, dept: str, year: str, student_data_dir: str,
+                                   force: bool = False) -> Dict[str, Any]:
+        """
+        Check quality for all students in a department-year folder.
+        A student whose video is unchanged since its last check keeps that result unless force is set.
+        """
         dept_year_dir = os.path.join(student_data_dir, f"{dept}_{year}")
         
         print(f"Checking quality for directory: {dept_year_dir}")
@@ -400,7 +744,8 @@ class VideoQualityChecker:
                 'total_checked': 0
             }
         
-        # Process each student directory
+        # Find the students that have both a video and a JSON file
+        students = []
         for student_id in student_dirs:
             student_path = os.path.join(dept_year_dir, student_id)
             
@@ -416,58 +761,96 @@ class VideoQualityChecker:
                 print(f"  Skipping - missing files")
                 continue
             
-            # Load student data
-            try:
-                with open(json_path, 'r') as f:
-                    student_data = json.load(f)
+            students.append((student_id, video_path, json_path))
+        
+        # Check the videos concurrently - enable frame saving for failed quality checks
+        pending_writes = []
+        num_workers = max(1, min(QUALITY_CHECK_WORKERS, (os.cpu_count() or 2) // 2, len(students)))
+        if num_workers > 1:
+            # Every running check holds its sampled frames, so keep the largest videos'
+            # frames for all workers together within the frame budget
+            largest = max(sampled_frames_bytes(video_path) for _, video_path, _ in students)
+            if largest:
+                num_workers = max(1, min(num_workers, QUALITY_CHECK_FRAME_BUDGET // largest))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = []
+            for student_id, video_path, json_path in students:
+                try:
+                    with open(json_path, 'r') as f:
+                        student_data = json.load(f)
+                    video_key = self.video_check_key(video_path)
+                except Exception as e:
+                    futures.append((None, None, e))
+                    continue
                 
-                # Allow re-checking quality even if already done
-                if 'qualityCheck' in student_data:
-                    print(f"  Re-checking quality (was: {student_data['qualityCheck']})")
+                # Same video as last time: its stored result still holds
+                if not force and student_data.get('qualityCheckKey') == video_key and 'qualityCategory' in student_data:
+                    futures.append((student_data, video_key, None))
                 else:
-                    print(f"  First time quality check")
-                
-                # Allow quality check even on processed students
-                if student_data.get('facesExtracted', False):
-                    print(f"  Quality checking already processed student")
-                
-                print(f"  Processing quality check for {student_id}")
-                
-                # Check video quality - enable frame saving for failed quality checks
-                quality_result = self.check_single_video_quality(video_path, save_failed_frames=True)
-                
-                # Update student JSON with quality check result
-                student_data['qualityCheck'] = quality_result['overall_quality']
-                student_data['qualityCategory'] = quality_result['category']
-                student_data['qualityDetails'] = quality_result.get('details', {})
-                student_data['qualityIssues'] = quality_result.get('quality_issues', [])
-                student_data['criticalIssues'] = quality_result.get('critical_issues', [])
-                student_data['majorIssues'] = quality_result.get('major_issues', [])
-                student_data['minorIssues'] = quality_result.get('minor_issues', [])
-                
-                # Save updated JSON
-                with open(json_path, 'w') as f:
-                    json.dump(student_data, f, indent=2)
-                
-                print(f"  Quality category: {quality_result['category']}")
-                print(f"  Quality issues: {quality_result.get('quality_issues', [])}")
-                
-                # Categorize student based on quality category
-                if quality_result['category'] == 'pass':
-                    passed_students.append(student_id)
-                elif quality_result['category'] == 'borderline':
-                    borderline_students.append({
-                        'regNo': student_id,
-                        'issues': quality_result.get('quality_issues', [])
-                    })
-                else:  # fail
-                    failed_students.append(student_id)
-                
-                total_processed += 1
+                    futures.append((student_data, video_key,
+                                    executor.submit(self.check_single_video_quality, video_path, save_failed_frames=True)))
+            
+            # Update JSON files and categorize in this thread, in directory order
+            for (student_id, video_path, json_path), (student_data, video_key, future) in zip(students, futures):
+                try:
+                    if isinstance(future, Exception):
+                        raise future
+                    
+                    if future is None:
+                        print(f"  {student_id}: video unchanged, keeping quality result ({student_data['qualityCheck']})")
+                        quality_result = self.stored_quality_result(student_data)
+                    else:
+                        quality_result = future.result()
+                        
+                        # Allow re-checking quality even if already done
+                        if 'qualityCheck' in student_data:
+                            print(f"  {student_id}: re-checked quality (was: {student_data['qualityCheck']})")
+                        else:
+                            print(f"  {student_id}: first time quality check")
                     
+                    # Update student JSON with quality check result
+                    student_data['qualityCheckKey'] = video_key
+                    student_data['qualityCheck'] = quality_result['overall_quality']
+                    student_data['qualityCategory'] = quality_result['category']
+                    student_data['qualityDetails'] = quality_result.get('details', {})
+                    student_data['qualityIssues'] = quality_result.get('quality_issues', [])
+                    student_data['criticalIssues'] = quality_result.get('critical_issues', [])
+                    student_data['majorIssues'] = quality_result.get('major_issues', [])
+                    student_data['minorIssues'] = quality_result.get('minor_issues', [])
+                    
+                    # Written out together once all videos are checked; reused results are already on disk
+                    if future is not None:
+                        pending_writes.append((json_path, student_data))
+                    
+                    print(f"  Quality category: {quality_result['category']}")
+                    print(f"  Quality issues: {quality_result.get('quality_issues', [])}")
+                    
+                    # Categorize student based on quality category
+                    if quality_result['category'] == 'pass':
+                        passed_students.append(student_id)
+                    elif quality_result['category'] == 'borderline':
+                        borderline_students.append({
+                            'regNo': student_id,
+                            'issues': quality_result.get('quality_issues', [])
+                        })
+                    else:  # fail
+                        failed_students.append(student_id)
+                    
+                    total_processed += 1
+                        
+                except Exception as e:
+                    print(f"Error processing student {student_id}: {e}")
+                    continue
+        
+        # Save updated JSON files; write to a temporary file first so a crash can't
+        # leave a truncated student record behind
+        for json_path, student_data in pending_writes:
+            try:
+                with open(json_path + '.tmp', 'w') as f:
+                    json.dump(student_data, f, indent=2)
+                os.replace(json_path + '.tmp', json_path)
             except Exception as e:
-                print(f"Error processing student {student_id}: {e}")
-                continue
+                print(f"Error saving {json_path}: {e}")
         
         print(f"Quality check completed:")
         print(f"  Total processed: {total_processed}")
@@ -492,3 +875,14 @@ class VideoQualityChecker:
             print(f"Failed to save quality check report to database: {e}")
             
         return report
+
+# One quality checker per YOLO weights file, shared by everything in this process
+_quality_checkers = {}
+_quality_checkers_lock = threading.Lock()
+
+def get_quality_checker(yolo_model_path: str) -> VideoQualityChecker:
+    """Get the shared quality checker for yolo_model_path, loading the model on first use"""
+    with _quality_checkers_lock:
+        if yolo_model_path not in _quality_checkers:
+            _quality_checkers[yolo_model_path] = VideoQualityChecker(yolo_model_path)
+        return _quality_checkers[yolo_model_path]
@@ -1,19 +1,57 @@
 import os
 import sqlite3
 import hashlib
+import hmac
+import threading
 from typing import Dict, Any
 from config.settings import BASE_DIR
 
 # Database path for users
 DB_PATH = os.path.join(BASE_DIR, 'data', 'app.db')
 
+# One connection per thread, kept open so each auth call skips the connect and
+# reuses sqlite3's prepared statement cache
+_thread_local = threading.local()
+
 def get_db_conn():
-    """Get database connection for user management"""
-    return sqlite3.connect(DB_PATH)
+    """Get this thread's database connection for user management"""
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None:
+        # app.db is shared with the rest of the app and backed up by copying the file,
+        # so its journal mode is left alone here
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute('PRAGMA temp_store=MEMORY')
+        _thread_local.conn = conn
+    return conn
+
+# PBKDF2 work factor; stored with each hash, so raising it only affects new hashes
+PASSWORD_HASH_ITERATIONS = 100_000
+PASSWORD_HASH_PREFIX = 'pbkdf2_sha256'
 
-def hash_password(password: str) -> str:
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+def hash_password(password: str, salt: bytes = None, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    """
+    Hash password with salted PBKDF2-HMAC-SHA256, stored as
+    'pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>'
+    """
+    if salt is None:
+        salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{PASSWORD_HASH_PREFIX}${iterations}${salt.hex()}${digest.hex()}"
+
+def verify_password(password: str, stored_hash: str) -> bool:
+    """
+    Check password against a stored hash (PBKDF2, or a legacy unsalted SHA256 hex digest).
+    A malformed PBKDF2 hash never matches.
+    """
+    if stored_hash.startswith(PASSWORD_HASH_PREFIX + '$'):
+        try:
+            _, iterations, salt, _ = stored_hash.split('$')
+            candidate = hash_password(password, bytes.fromhex(salt), int(iterations))
+        except ValueError:
+            return False
+    else:
+        candidate = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(candidate, stored_hash)
 
 def create_users_table():
     """Create users table if it doesn't exist"""
@@ -26,7 +64,6 @@ def create_users_table():
         role TEXT NOT NULL CHECK(role IN ('superadmin', 'admin'))
     )''')
     conn.commit()
-    conn.close()
 
 def authenticate_user(username: str, password: str) -> Dict[str, Any]:
     """Authenticate user login"""
@@ -37,9 +74,12 @@ def authenticate_user(username: str, password: str) -> Dict[str, Any]:
     c = conn.cursor()
     c.execute('SELECT password, role FROM users WHERE username = ?', (username,))
     row = c.fetchone()
-    conn.close()
     
-    if row and row[0] == hash_password(password):
+    if row and verify_password(password, row[0]):
+        # Upgrade legacy SHA256 hashes now that the plain password is known
+        if not row[0].startswith(PASSWORD_HASH_PREFIX + '$'):
+            c.execute('UPDATE users SET password = ? WHERE username = ?', (hash_password(password), username))
+            conn.commit()
         return {"success": True, "role": row[1]}
     return {"success": False, "message": "Invalid credentials"}
 
@@ -56,9 +96,10 @@ def add_admin_user(username: str, password: str, role: str = 'admin') -> Dict[st
         c.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
                   (username, hash_password(password), role))
         conn.commit()
-        conn.close()
         return {"success": True, "message": f"Admin '{username}' added."}
     except sqlite3.IntegrityError:
+        # The connection outlives this call, so don't leave the failed insert's transaction open
+        conn.rollback()
         return {"success": False, "message": "Username already exists."}
 
 def delete_admin_user(username: str) -> Dict[str, Any]:
@@ -68,7 +109,6 @@ def delete_admin_user(username: str) -> Dict[str, Any]:
     c.execute("DELETE FROM users WHERE username = ?", (username,))
     conn.commit()
     deleted = c.rowcount
-    conn.close()
     
     if deleted:
         return {"success": True, "message": f"Admin '{username}' deleted."}
@@ -81,7 +121,6 @@ def list_admin_users() -> Dict[str, Any]:
     c = conn.cursor()
     c.execute("SELECT username, role FROM users WHERE role IN ('admin', 'superadmin') ORDER BY role DESC, username ASC")
     admins = [{"username": row[0], "role": row[1]} for row in c.fetchall()]
-    conn.close()
     return {"success": True, "admins": admins}
 
 # Initialize the users table when module is imported
@@ -104,8 +143,6 @@ def create_default_superadmin():
                   (default_username, hash_password(default_password), 'superadmin'))
         conn.commit()
         print(f"Created default superadmin user: {default_username} / {default_password}")
-    
-    conn.close()
 
 # Create default superadmin
 create_default_superadmin()
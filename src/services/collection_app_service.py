@@ -1,25 +1,48 @@
 import subprocess
 import os
-from typing import Dict, Any
+import json
+import time
+from typing import Dict, Any, List, Optional
 
 from config.settings import BASE_DIR, COLLECTION_APP_HOST, COLLECTION_APP_PORT
 
 # Global variable to track collection app process
 collection_app_process_name = "data-collection-app"  # Name of the process in PM2
 
+# Seconds a `pm2 jlist` result is reused, so closely spaced status checks share one subprocess
+PM2_STATE_TTL = 1.0
+_pm2_state_cache = {'time': float('-inf'), 'processes': []}
+
+def get_pm2_processes(refresh: bool = False) -> List[Dict[str, Any]]:
+    """List PM2's processes (parsed `pm2 jlist` output), cached for PM2_STATE_TTL seconds"""
+    now = time.monotonic()
+    if refresh or now - _pm2_state_cache['time'] >= PM2_STATE_TTL:
+        jlist_cmd = subprocess.run(
+            ["pm2", "jlist"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        _pm2_state_cache['processes'] = json.loads(jlist_cmd.stdout or '[]')
+        _pm2_state_cache['time'] = now
+    return _pm2_state_cache['processes']
+
+def get_collection_app_process(refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """PM2's entry for the collection app, or None if PM2 doesn't know it"""
+    for process in get_pm2_processes(refresh):
+        if process.get('name') == collection_app_process_name:
+            return process
+    return None
+
+def is_online(process: Optional[Dict[str, Any]]) -> bool:
+    """Whether a PM2 process entry is running"""
+    return process is not None and process.get('pm2_env', {}).get('status') == 'online'
+
 def start_collection_app() -> Dict[str, Any]:
     """Start the face collection application server using the launch script"""
     try:
-        # Check if already running in PM2
-        status_cmd = subprocess.run(
-            ["pm2", "list"], 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True
-        )
-        
-        # Check if our app is in the list and online
-        if collection_app_process_name in status_cmd.stdout and "online" in status_cmd.stdout:
+        # Check if already running in PM2; always ask PM2 before acting on it
+        if is_online(get_collection_app_process(refresh=True)):
             return {
                 "success": True,
                 "message": "Face Collection App is already running in PM2",
@@ -36,6 +59,8 @@ def start_collection_app() -> Dict[str, Any]:
             stderr=subprocess.PIPE,
             text=True
         )
+        # The cached state no longer reflects PM2
+        _pm2_state_cache['time'] = float('-inf')
         
         if start_cmd.returncode == 0:
             return {
@@ -58,16 +83,8 @@ def start_collection_app() -> Dict[str, Any]:
 def stop_collection_app() -> Dict[str, Any]:
     """Stop the face collection application server using PM2"""
     try:
-        # Check if running in PM2
-        status_cmd = subprocess.run(
-            ["pm2", "list"], 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True
-        )
-        
-        # If process is not in the list, it's not running
-        if collection_app_process_name not in status_cmd.stdout:
+        # If process is not in PM2's list, it's not running
+        if get_collection_app_process(refresh=True) is None:
             return {
                 "success": True,
                 "message": "Face Collection App was not running"
@@ -80,6 +97,8 @@ def stop_collection_app() -> Dict[str, Any]:
             stderr=subprocess.PIPE,
             text=True
         )
+        # The cached state no longer reflects PM2
+        _pm2_state_cache['time'] = float('-inf')
         
         if stop_cmd.returncode == 0:
             return {
@@ -101,30 +120,24 @@ def stop_collection_app() -> Dict[str, Any]:
 def get_collection_app_status() -> Dict[str, Any]:
     """Check if the face collection application is running using PM2"""
     try:
-        # Get status from PM2
-        status_cmd = subprocess.run(
-            ["pm2", "list"], 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True
-        )
-        
-        # Check if our process is in the list and running
-        is_running = collection_app_process_name in status_cmd.stdout and "online" in status_cmd.stdout
+        # Get status from PM2 (shared with other checks made within PM2_STATE_TTL)
+        process = get_collection_app_process()
         
-        if is_running:
-            # Get more details if needed
-            detail_cmd = subprocess.run(
-                ["pm2", "describe", collection_app_process_name],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
+        if is_online(process):
+            # The jlist entry already has the details `pm2 describe` would print
+            pm2_env = process.get('pm2_env', {})
+            monit = process.get('monit', {})
             return {
                 "running": True,
                 "process_name": collection_app_process_name,
-                "details": detail_cmd.stdout
+                "details": {
+                    "pid": process.get('pid'),
+                    "status": pm2_env.get('status'),
+                    "uptime_since": pm2_env.get('pm_uptime'),
+                    "restarts": pm2_env.get('restart_time'),
+                    "memory": monit.get('memory'),
+                    "cpu": monit.get('cpu')
+                }
             }
         else:
             return {
@@ -1,162 +1,352 @@
+import logging
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import cv2
 import numpy as np
-from typing import List
+import torch
+from typing import Iterable, Iterator, List, Optional, Tuple
 from ultralytics import YOLO
 
 from config.settings import DEFAULT_YOLO_PATH
+from utils.video_utils import open_video_capture
 
-def extract_frames(video_path: str, output_dir: str, max_frames: int = 200, interval: int = 1) -> List[str]:
+# Per-image and per-face messages go to debug logging, so they cost nothing unless enabled
+logger = logging.getLogger(__name__)
+
+# Images per YOLO forward pass when cropping faces
+YOLO_BATCH_SIZE = 16
+
+# Decoded images queued ahead of YOLO, and YOLO batches queued ahead of cropping
+PIPELINE_QUEUE_SIZE = 32
+PIPELINE_PENDING_BATCHES = 2
+
+def prefetch(iterable: Iterable, maxsize: int = PIPELINE_QUEUE_SIZE) -> Iterator:
     """
-    Extract frames from a video at specified intervals
+    Iterate over iterable on a background thread, keeping up to maxsize items ready
     
-    Args:
-        video_path: Path to the video file
-        output_dir: Directory to save extracted frames
-        max_frames: Maximum number of frames to extract
-        interval: Extract a frame every 'interval' frames
+    Lets decoding overlap with whatever the caller does with each item; exceptions
+    raised by iterable are re-raised in the caller.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+    errors = []
     
-    Returns:
-        List of paths to extracted frames
+    def put(item):
+        # Give up if the consumer went away instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        put(done)
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+def iter_video_frames(video_path: str, max_frames: int = 200, interval: int = 1,
+                      sample_fps: Optional[float] = None) -> Iterator[np.ndarray]:
     """
-    print(f"Extracting frames from: {video_path}")
-    print(f"Output directory: {output_dir}")
-    print(f"Max frames: {max_frames}, Interval: {interval}")
+    Decode frames from a video at specified intervals, yielding them as BGR arrays
     
-    os.makedirs(output_dir, exist_ok=True)
+    Args:
+        video_path: Path to the video file
+        max_frames: Maximum number of frames to yield
+        interval: Yield a frame every 'interval' frames
+        sample_fps: If given, yield about this many frames per second of video instead,
+            whatever the video's frame rate; overrides interval
     
-    cap = cv2.VideoCapture(video_path)
+    Yields:
+        Decoded frames, in video order
+    """
+    cap = open_video_capture(video_path)
     if not cap.isOpened():
         print(f"Error: Could not open video {video_path}")
-        return []
+        return
     
-    # Get video properties for debugging
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    duration = total_frames / fps if fps > 0 else 0
-    print(f"Video properties: {total_frames} frames, {fps} FPS, {duration:.2f} seconds")
+    try:
+        # Get video properties for debugging
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        duration = total_frames / fps if fps > 0 else 0
+        print(f"Video properties: {total_frames} frames, {fps} FPS, {duration:.2f} seconds")
+        
+        if sample_fps and fps > 0:
+            interval = max(1, round(fps / sample_fps))
+        
+        frame_count = 0
+        yielded_count = 0
+        # Safety limit to prevent infinite loops; containers that don't report a frame
+        # count (total_frames == 0) are read as far as the requested frames need
+        max_read_attempts = total_frames + 100 if total_frames > 0 else max_frames * interval
+        read_attempts = 0
+        
+        while yielded_count < max_frames and read_attempts < max_read_attempts:
+            # Grab every frame but only convert the ones that get used
+            ret = cap.grab()
+            read_attempts += 1
+            
+            if not ret:
+                print(f"End of video reached at frame {frame_count} (attempt {read_attempts})")
+                break
+                
+            if frame_count % interval == 0:
+                ret, frame = cap.retrieve()
+                if ret:
+                    yielded_count += 1
+                    yield frame
+                else:
+                    print(f"Failed to decode frame {frame_count}")
+                
+            frame_count += 1
+    finally:
+        cap.release()
+
+def load_yolo_model(yolo_path: str, batch_size: int = YOLO_BATCH_SIZE, imgsz: int = 640) -> YOLO:
+    """
+    Load the YOLO face detector, as an FP16 TensorRT engine when a GPU is available.
+    The engine has a dynamic batch dimension up to batch_size and is exported next to
+    the .pt file once, then reused until the weights change; an engine that fails to
+    load (e.g. built for another GPU or TensorRT version) is exported again, and any
+    export failure falls back to the PyTorch weights.
+    """
+    if not torch.cuda.is_available():
+        return YOLO(yolo_path)
     
-    frame_paths = []
-    frame_count = 0
-    saved_count = 0
-    max_read_attempts = total_frames + 100  # Safety limit to prevent infinite loops
-    read_attempts = 0
+    def export_engine() -> str:
+        print(f"Exporting {yolo_path} to TensorRT...")
+        return YOLO(yolo_path).export(
+            format='engine', half=True, imgsz=imgsz,
+            batch=batch_size, dynamic=True
+        )
+    
+    def load_engine(path: str) -> YOLO:
+        # Ultralytics only deserializes the engine on the first prediction, so run one
+        # here: a bad engine fails now instead of mid-request, and the real first batch
+        # doesn't pay the load time
+        model = YOLO(path, task='detect')
+        model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), verbose=False, device=0)
+        return model
+    
+    engine_path = os.path.splitext(yolo_path)[0] + '.engine'
+    try:
+        if (not os.path.exists(engine_path)
+                or os.path.getmtime(engine_path) < os.path.getmtime(yolo_path)):
+            return load_engine(export_engine())
+        try:
+            return load_engine(engine_path)
+        except Exception as e:
+            print(f"Cached TensorRT engine unusable, exporting again: {e}")
+            return load_engine(export_engine())
+    except Exception as e:
+        print(f"TensorRT export unavailable, using PyTorch weights: {e}")
+        return YOLO(yolo_path)
+
+def get_yolo_model(yolo_path: str = DEFAULT_YOLO_PATH) -> YOLO:
+    """
+    Load the YOLO face detector once per weights path and reuse it; face extraction,
+    recognition and the quality checker all share the one instance
+    """
+    # Serialized so concurrent first calls don't export the same engine twice
+    with _yolo_load_lock:
+        return _get_yolo_model_cached(os.path.abspath(yolo_path))
+
+def clear_yolo_model_cache():
+    """Forget detectors loaded by get_yolo_model so the next call loads the weights again"""
+    with _yolo_load_lock:
+        _get_yolo_model_cached.cache_clear()
+
+_yolo_load_lock = threading.Lock()
+
+@lru_cache(maxsize=2)
+def _get_yolo_model_cached(yolo_path: str) -> YOLO:
+    """get_yolo_model for an absolute weights path"""
+    return load_yolo_model(yolo_path)
+
+# Run YOLO in FP16 on the GPU; the boxes it returns are float32 either way
+YOLO_HALF = torch.cuda.is_available()
+
+# The YOLO predictor keeps per-call state, so concurrent requests take turns running
+# the cached models
+yolo_lock = threading.Lock()
+
+def crop_faces(img: np.ndarray, result, image_path: str, output_dir: str) -> List[str]:
+    """
+    Crop, preprocess and save every face YOLO found in an image
     
-    while saved_count < max_frames and read_attempts < max_read_attempts:
-        ret, frame = cap.read()
-        read_attempts += 1
+    Args:
+        img: The image YOLO ran on
+        result: YOLO's result for img
+        image_path: Path img was read from, used to name the face images
+        output_dir: Directory to save preprocessed face images
         
-        if not ret:
-            print(f"End of video reached at frame {frame_count} (attempt {read_attempts})")
-            break
+    Returns:
+        List of paths to preprocessed face images
+    """
+    face_paths = []
+    for j, box in enumerate(result.boxes):
+        # Get bounding box coordinates
+        x1, y1, x2, y2 = map(int, box.xyxy[0])
+        
+        # Add some padding around the face
+        h, w = img.shape[:2]
+        face_w = x2 - x1
+        face_h = y2 - y1
+        pad_x = int(face_w * 0.2)
+        pad_y = int(face_h * 0.2)
+        x1 = max(0, x1 - pad_x)
+        y1 = max(0, y1 - pad_y)
+        x2 = min(w, x2 + pad_x)
+        y2 = min(h, y2 + pad_y)
+        
+        # Skip if face coordinates are too small
+        if (x2 - x1) < 32 or (y2 - y1) < 32:
+            logger.debug("Skipping face %d in %s - too small (%dx%d)", j, image_path, x2 - x1, y2 - y1)
+            continue
             
-        if frame_count % interval == 0:
-            # Save frame as image
-            frame_path = os.path.join(output_dir, f"frame_{saved_count:03d}.jpg")
-            success = cv2.imwrite(frame_path, frame)
-            if success:
-                frame_paths.append(frame_path)
-                saved_count += 1
-                if saved_count % 10 == 0:  # Log every 10th frame
-                    print(f"Saved frame {saved_count}/{max_frames}")
-            else:
-                print(f"Failed to save frame {frame_count} to {frame_path}")
+        # Crop face
+        face = img[y1:y2, x1:x2]
+        
+        # Skip empty faces or irregular shapes
+        if face.size == 0 or face.shape[0] <= 0 or face.shape[1] <= 0:
+            logger.debug("Skipping face %d in %s - invalid dimensions", j, image_path)
+            continue
+        
+        # Save original cropped face for reference
+        img_name = os.path.basename(image_path)
+        original_face_path = os.path.join(output_dir, f"{os.path.splitext(img_name)[0]}_face_orig_{j}.jpg")
+        # cv2.imwrite(original_face_path, face)
+        
+        # Preprocess face properly for LightCNN:
+        
+        # 1. Convert to grayscale
+        if len(face.shape) == 3:  # Color image
+            gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+        else:  # Already grayscale
+            gray = face
             
-        frame_count += 1
+        # 2. Resize to 128x128 (LightCNN input size); INTER_AREA is the cheap
+        # choice for downsizing and loses nothing at this resolution
+        resized = cv2.resize(gray, (128, 128), interpolation=cv2.INTER_AREA)
+        
+        # 3. Apply histogram equalization for better contrast
+        equalized = cv2.equalizeHist(resized)
+        
+        # 4. Save preprocessed face
+        face_path = os.path.join(output_dir, f"{os.path.splitext(img_name)[0]}_face_{j}.jpg")
+        cv2.imwrite(face_path, equalized)
+        face_paths.append(face_path)
     
-    cap.release()
-    print(f"Frame extraction complete: {len(frame_paths)} frames saved")
-    return frame_paths
+    return face_paths
 
-def detect_and_crop_faces(image_path: str, output_dir: str, yolo_path: str = DEFAULT_YOLO_PATH) -> List[str]:
+def detect_and_crop_faces_in_images(images: Iterable[Tuple[str, np.ndarray]], output_dir: str,
+                                    yolo_path: str = DEFAULT_YOLO_PATH,
+                                    batch_size: int = YOLO_BATCH_SIZE) -> List[str]:
     """
-    Detect, crop, and preprocess faces from an image using YOLO
+    Detect, crop, and preprocess faces from in-memory images, running YOLO on
+    batch_size images per forward pass
     
     Args:
-        image_path: Path to the input image
+        images: (name, image) pairs; the name's base name is used to name the face images
         output_dir: Directory to save preprocessed face images
         yolo_path: Path to YOLO model weights
+        batch_size: Images per YOLO forward pass
         
     Returns:
-        List of paths to preprocessed face images
+        List of paths to preprocessed face images, in image order
     """
-    print(f"Processing image: {image_path}")
-    
     os.makedirs(output_dir, exist_ok=True)
     
-    # Load YOLO model
-    model = YOLO(yolo_path)
-    
-    # Read image
-    img = cv2.imread(image_path)
-    if img is None:
-        print(f"Error: Could not read image {image_path}")
-        return []
+    model = get_yolo_model(yolo_path)
     
-    # Detect faces
-    results = model(img)
-    
-    print(f"YOLO detected {sum(len(r.boxes) for r in results)} faces in {image_path}")
+    def crop_batch(batch, results):
+        batch_face_paths = []
+        for (image_path, img), result in zip(batch, results):
+            logger.debug("YOLO detected %d faces in %s", len(result.boxes), image_path)
+            batch_face_paths.extend(crop_faces(img, result, image_path, output_dir))
+        return batch_face_paths
     
+    # Three stages overlap: images are decoded on a background thread, YOLO runs here,
+    # and faces are cropped and written on a single worker, which keeps them in order
     face_paths = []
-    for i, result in enumerate(results):
-        for j, box in enumerate(result.boxes):
-            # Get bounding box coordinates
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            
-            # Add some padding around the face
-            h, w = img.shape[:2]
-            face_w = x2 - x1
-            face_h = y2 - y1
-            pad_x = int(face_w * 0.2)
-            pad_y = int(face_h * 0.2)
-            x1 = max(0, x1 - pad_x)
-            y1 = max(0, y1 - pad_y)
-            x2 = min(w, x2 + pad_x)
-            y2 = min(h, y2 + pad_y)
-            
-            print(f"Face {j} dimensions before padding: {x2-x1}x{y2-y1}")
-            print(f"Face {j} dimensions after padding: {max(0, x1-pad_x)}-{min(w, x2+pad_x)}x{max(0, y1-pad_y)}-{min(h, y2+pad_y)}")
-            
-            # Skip if face coordinates are too small
-            if (x2 - x1) < 32 or (y2 - y1) < 32:
-                print(f"Skipping face {j} in {image_path} - too small ({x2-x1}x{y2-y1})")
-                continue
-                
-            # Crop face
-            face = img[y1:y2, x1:x2]
-            
-            # Skip empty faces or irregular shapes
-            if face.size == 0 or face.shape[0] <= 0 or face.shape[1] <= 0:
-                print(f"Skipping face {j} in {image_path} - invalid dimensions")
-                continue
-            
-            # Save original cropped face for reference
-            img_name = os.path.basename(image_path)
-            original_face_path = os.path.join(output_dir, f"{os.path.splitext(img_name)[0]}_face_orig_{j}.jpg")
-            # cv2.imwrite(original_face_path, face)
-            
-            # Preprocess face properly for LightCNN:
-            
-            # 1. Convert to grayscale
-            if len(face.shape) == 3:  # Color image
-                gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
-            else:  # Already grayscale
-                gray = face
-                
-            # 2. Resize to 128x128 (LightCNN input size)
-            # Use INTER_LANCZOS4 for best quality when downsizing
-            resized = cv2.resize(gray, (128, 128), interpolation=cv2.INTER_LANCZOS4)
-            
-            # 3. Normalize pixel values to [0, 1] range
-            normalized = resized.astype(np.float32) / 255.0
-            
-            # 4. Apply histogram equalization for better contrast
-            equalized = cv2.equalizeHist(resized)
-            
-            # 5. Save preprocessed face
-            face_path = os.path.join(output_dir, f"{os.path.splitext(img_name)[0]}_face_{j}.jpg")
-            cv2.imwrite(face_path, equalized)
-            face_paths.append(face_path)
+    pending = []
+    def process_batch(batch):
+        # Detect faces
+        with yolo_lock:
+            results = model([img for _, img in batch], verbose=False, half=YOLO_HALF)
+        pending.append(cropper.submit(crop_batch, batch, results))
+        # Bound how many decoded batches wait for cropping
+        while len(pending) > PIPELINE_PENDING_BATCHES:
+            face_paths.extend(pending.pop(0).result())
+    
+    with ThreadPoolExecutor(max_workers=1) as cropper:
+        batch = []
+        for item in prefetch(images):
+            batch.append(item)
+            if len(batch) == batch_size:
+                process_batch(batch)
+                batch = []
+        if batch:
+            process_batch(batch)
+        for future in pending:
+            face_paths.extend(future.result())
     
     return face_paths
+
+def extract_faces_from_video(video_path: str, output_dir: str, max_frames: int = 200, interval: int = 1,
+                             yolo_path: str = DEFAULT_YOLO_PATH,
+                             sample_fps: Optional[float] = None) -> Tuple[int, List[str]]:
+    """
+    Detect, crop, and preprocess faces straight from a video's decoded frames,
+    without writing the frames to disk
+    
+    Args:
+        video_path: Path to the video file
+        output_dir: Directory to save preprocessed face images
+        max_frames: Maximum number of frames to use
+        interval: Use a frame every 'interval' frames
+        yolo_path: Path to YOLO model weights
+        sample_fps: If given, use about this many frames per second of video instead
+            of every 'interval'th frame
+    
+    Returns:
+        Number of frames used and the list of paths to preprocessed face images
+    """
+    print(f"Extracting faces from: {video_path}")
+    print(f"Max frames: {max_frames}, Interval: {interval}, Sample FPS: {sample_fps}")
+    
+    frame_count = 0
+    def named_frames():
+        nonlocal frame_count
+        for frame in iter_video_frames(video_path, max_frames, interval, sample_fps):
+            # Faces are named as if the frame had been saved by extract_frames
+            yield f"frame_{frame_count:03d}.jpg", frame
+            frame_count += 1
+    
+    face_paths = detect_and_crop_faces_in_images(named_frames(), output_dir, yolo_path)
+    print(f"Face extraction complete: {len(face_paths)} faces from {frame_count} frames")
+    return frame_count, face_paths
@@ -1,16 +1,51 @@
-import os
+import logging
 import cv2
 import numpy as np
 import torch
+from scipy.optimize import linear_sum_assignment
+from torchvision.ops import roi_align
 from typing import List, Dict, Any, Optional, Union, Tuple
-from PIL import Image
-import torchvision.transforms as transforms
-from scipy.spatial.distance import cosine
-from ultralytics import YOLO
 
 from models.pydantic_models import GalleryInfo
 from config.settings import DEFAULT_MODEL_PATH, DEFAULT_YOLO_PATH
-from ml.embeddings import load_model
+from ml.embeddings import load_model, forward_embeddings, clear_model_cache as clear_lightcnn_cache
+from services.face_processing import get_yolo_model, clear_yolo_model_cache, yolo_lock, YOLO_HALF
+from ml.gallery_operations import gallery_exists, load_gallery_identities, build_matcher
+
+logger = logging.getLogger(__name__)
+
+# YOLO input sizes for recognition: small frames are detected at a reduced size, and
+# frames where that finds nothing are retried at the full size
+YOLO_SMALL_IMGSZ = 320
+YOLO_MEDIUM_IMGSZ = 416
+YOLO_FULL_IMGSZ = 640
+
+def pick_yolo_imgsz(frame: np.ndarray) -> int:
+    """YOLO input size for a frame: 320 up to 720p, 416 above"""
+    return YOLO_SMALL_IMGSZ if min(frame.shape[:2]) <= 720 else YOLO_MEDIUM_IMGSZ
+
+def assign_identities(scores: np.ndarray, candidates: np.ndarray,
+                      threshold: float) -> List[Optional[Tuple[int, float]]]:
+    """
+    Give each face at most one identity and each identity to at most one face, maximizing
+    the total similarity over all faces
+    
+    scores and candidates are (M, k) arrays holding the similarities and gallery indices
+    of each of M faces' best k identities. Returns, per face, the (gallery index,
+    similarity) it is assigned, or None if it gets no identity at or above threshold.
+    """
+    columns, column_of = np.unique(candidates, return_inverse=True)
+    similarities = np.full((len(candidates), len(columns)), -2.0, dtype=np.float32)
+    np.put_along_axis(similarities, column_of.reshape(candidates.shape), scores, axis=1)
+    
+    # Pairs below threshold are never worth taking over another match
+    rows, cols = linear_sum_assignment(np.where(similarities >= threshold, similarities, -2.0),
+                                       maximize=True)
+    assignment = [None] * len(candidates)
+    for row, col in zip(rows, cols):
+        if similarities[row, col] >= threshold:
+            assignment[row] = (int(columns[col]), float(similarities[row, col]))
+    return assignment
 
 def get_gallery_info(gallery_path: str) -> Optional[GalleryInfo]:
     """
@@ -22,18 +57,12 @@ def get_gallery_info(gallery_path: str) -> Optional[GalleryInfo]:
     Returns:
         GalleryInfo or None if file doesn't exist
     """
-    if not os.path.exists(gallery_path):
+    if not gallery_exists(gallery_path):
         return None
     
-    # Load the gallery file
+    # Read the identity list only; the embedding matrix is not needed here
     try:
-        gallery_data = torch.load(gallery_path, weights_only=False)
-        # Handle both formats
-        if isinstance(gallery_data, dict) and "identities" in gallery_data:
-            identities = gallery_data["identities"]
-        else:
-            identities = list(gallery_data.keys())
-        
+        identities = load_gallery_identities(gallery_path)
         count = len(identities)
         
         return GalleryInfo(
@@ -45,6 +74,35 @@ def get_gallery_info(gallery_path: str) -> Optional[GalleryInfo]:
         print(f"Error loading gallery file: {e}")
         return None
 
+def clear_model_cache():
+    """Drop the cached LightCNN and YOLO models, e.g. after their weights change on disk"""
+    clear_lightcnn_cache()
+    clear_yolo_model_cache()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def face_batch(frame: np.ndarray, boxes: List[Tuple[int, int, int, int]], device) -> torch.Tensor:
+    """
+    Cut boxes out of a BGR frame as a (M, 1, 128, 128) grayscale LightCNN input batch on device
+    
+    On GPU the frame is uploaded once and every face is cropped and resized in a single
+    roi_align call; on CPU each face goes through cv2.
+    """
+    if device.type == 'cuda':
+        image = torch.from_numpy(frame).to(device, non_blocking=True).permute(2, 0, 1).float()
+        # BGR to grayscale with the BT.601 weights cv2 uses
+        gray = (image[0] * 0.114 + image[1] * 0.587 + image[2] * 0.299).div_(255.0)
+        rois = torch.tensor([(0, x1, y1, x2, y2) for x1, y1, x2, y2 in boxes],
+                            dtype=torch.float32, device=device)
+        # Adaptive sampling averages over each output pixel's footprint, like INTER_AREA
+        return roi_align(gray[None, None], rois, output_size=(128, 128), sampling_ratio=-1, aligned=True)
+    
+    face_crops = np.empty((len(boxes), 128, 128), dtype=np.uint8)
+    for i, (x1, y1, x2, y2) in enumerate(boxes):
+        face_crops[i] = cv2.resize(cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY), (128, 128),
+                                   interpolation=cv2.INTER_AREA)
+    return torch.from_numpy(face_crops).unsqueeze(1).to(device).float().div_(255.0)
+
 def recognize_faces(
     frame: np.ndarray, 
     gallery_paths: Union[str, List[str]], 
@@ -53,7 +111,9 @@ def recognize_faces(
     threshold: float = 0.45,
     model=None,
     device=None,
-    yolo_model=None
+    yolo_model=None,
+    inplace: bool = False,
+    imgsz: Optional[int] = None
 ) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
     """
     Recognize faces in a given frame using one or more galleries.
@@ -68,6 +128,9 @@ def recognize_faces(
         model: Pre-loaded model (optional)
         device: Pre-loaded device (optional)
         yolo_model: Pre-loaded YOLO model (optional)
+        inplace: Draw the annotations on frame itself instead of on a copy
+        imgsz: YOLO input size; picked from the frame size if not given, with a retry
+            at full size when the smaller one finds no faces
         
     Returns:
         Tuple containing:
@@ -77,36 +140,30 @@ def recognize_faces(
     if isinstance(gallery_paths, str):
         gallery_paths = [gallery_paths]
     
-    # Load model and YOLO if not provided
+    # Load model and YOLO if not provided; both are cached across calls
     if model is None or device is None:
         model, device = load_model(model_path)
     
     if yolo_model is None:
-        yolo_model = YOLO(yolo_path)
+        yolo_model = get_yolo_model(yolo_path)
     
     # Load and combine all galleries
-    combined_gallery = {}
-    for gallery_path in gallery_paths:
-        if os.path.exists(gallery_path):
-            try:
-                gallery_data = torch.load(gallery_path, weights_only=False)
-                # Handle different gallery formats
-                if isinstance(gallery_data, dict):
-                    if "identities" in gallery_data:
-                        combined_gallery.update(gallery_data["identities"])
-                    else:
-                        combined_gallery.update(gallery_data)
-            except Exception as e:
-                print(f"Error loading gallery {gallery_path}: {e}")
-    
-    if not combined_gallery:
+    match = build_matcher(gallery_paths, device)
+    
+    if match is None:
         print("No galleries found or empty galleries")
         return frame, []
     
     # Step 1: Detect faces using YOLO
-    face_detections = []
-    results = yolo_model(frame,conf=0.65)
-    
+    auto_imgsz = imgsz is None
+    if auto_imgsz:
+        imgsz = pick_yolo_imgsz(frame)
+    with yolo_lock:
+        results = yolo_model(frame, conf=0.65, imgsz=imgsz, half=YOLO_HALF, verbose=False)
+        if auto_imgsz and imgsz < YOLO_FULL_IMGSZ and not any(len(result.boxes) for result in results):
+            results = yolo_model(frame, conf=0.65, imgsz=YOLO_FULL_IMGSZ, half=YOLO_HALF, verbose=False)
+    
+    face_boxes = []
     for result in results:
         for box in result.boxes:
             x1, y1, x2, y2 = map(int, box.xyxy[0])
@@ -122,87 +179,36 @@ def recognize_faces(
             y2 = min(h, y2 + pad_y)
             
             if (x2 - x1) < 32 or (y2 - y1) < 32:
-                print(f"  WOULD SKIP FACE  - too small (testing with 5000px threshold)")
-                continue
-        
-            # Extract face image
-            face = frame[y1:y2, x1:x2]
-            
-            # Skip if face is too small
-            if face.size == 0 or face.shape[0] < 10 or face.shape[1] < 10:
+                logger.debug("Skipping face - too small (%dx%d)", x2 - x1, y2 - y1)
                 continue
-                
-            # Convert BGR to grayscale PIL image
-            face_pil = Image.fromarray(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY))
-            
-            # Transform for model input
-            transform = transforms.Compose([
-                transforms.Resize((128, 128)),
-                transforms.ToTensor(),
-            ])
             
-            # Prepare for the model
-            face_tensor = transform(face_pil).unsqueeze(0).to(device)
-            
-            # Extract embedding
-            with torch.no_grad():
-                _, embedding = model(face_tensor)
-                face_embedding = embedding.cpu().squeeze().numpy()
-            
-            # Find all potential matches above threshold
-            matches = []
-            for identity, gallery_embedding in combined_gallery.items():
-                similarity = 1 - cosine(face_embedding, gallery_embedding)
-                if similarity >= threshold:
-                    matches.append((identity, similarity))
-            
-            # Sort matches by similarity (highest first)
-            matches.sort(key=lambda x: x[1], reverse=True)
-            
-            face_detections.append({
-                "bbox": (x1, y1, x2, y2),
-                "matches": matches,
-                "embedding": face_embedding
-            })
-    
-    # Step 2: Assign identities without duplicates - using greedy approach
-    face_detections.sort(key=lambda x: x["matches"][0][1] if x["matches"] else 0, reverse=True)
+            face_boxes.append((x1, y1, x2, y2))
     
-    assigned_identities = set()
-    detected_faces = []
+    detected_faces = [{
+        "identity": "Unknown",
+        "similarity": 0.0,
+        "bounding_box": [int(x1), int(y1), int(x2), int(y2)]
+    } for x1, y1, x2, y2 in face_boxes]
     
-    for face in face_detections:
-        x1, y1, x2, y2 = face["bbox"]
-        matches = face["matches"]
-        
-        # Find the best non-assigned match
-        best_match = None
-        best_score = 0.0
+    if face_boxes:
+        # Extract embeddings for all faces in one forward pass
+        batch = face_batch(frame, face_boxes, device)
         
-        for identity, score in matches:
-            if identity not in assigned_identities:
-                best_match = identity
-                best_score = float(score)
-                break
+        # With M faces, some optimal assignment gives every face one of its M best
+        # identities, so only those are scored back from the device
+        with torch.inference_mode():
+            face_embeddings = forward_embeddings(model, batch)
+            scores, candidates = match.top_k(face_embeddings, len(face_boxes))
         
-        # Store recognition result
-        if best_match:
-            detected_faces.append({
-                "identity": best_match,
-                "similarity": best_score,
-                "bounding_box": [int(x1), int(y1), int(x2), int(y2)]
-            })
-            assigned_identities.add(best_match)
-        else:
-            # No match found - mark as unknown
-            detected_faces.append({
-                "identity": "Unknown",
-                "similarity": 0.0,
-                "bounding_box": [int(x1), int(y1), int(x2), int(y2)]
-            })
+        # Step 2: Assign identities without duplicates
+        for face_info, assigned in zip(detected_faces, assign_identities(scores, candidates, threshold)):
+            if assigned is not None:
+                identity_index, similarity = assigned
+                face_info["identity"] = match.identities[identity_index]
+                face_info["similarity"] = similarity
     
     # Step 3: Draw annotations as the final step
-    result_img = frame.copy()
+    result_img = frame if inplace else frame.copy()
     
     for face_info in detected_faces:
         identity = face_info["identity"]
@@ -1,98 +1,184 @@
 import os
 import json
 import shutil
-import gc
-from typing import List, Dict, Any
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 
 from models.pydantic_models import StudentInfo, StudentDataSummary
-from services.face_processing import extract_frames, detect_and_crop_faces
+from services.face_processing import extract_faces_from_video
 from config.settings import STUDENT_DATA_DIR, BASE_DATA_DIR
 
+# Student videos processed concurrently by process_students_videos
+STUDENT_PROCESSING_WORKERS = 3
+
+# Deleted student folders are renamed in here and removed on a background thread, so
+# deleting does not wait for every face image to be unlinked. It sits next to the student
+# data folder (same filesystem, so the rename is cheap) rather than inside it, so the
+# backup and the folder listings never see folders that are waiting to be deleted
+STUDENT_TRASH_DIR = os.path.join(os.path.dirname(STUDENT_DATA_DIR), ".student_data_trash")
+_trash_drain_lock = threading.Lock()
+
+def move_to_trash(path: str):
+    """Move a student folder out of the way for drain_trash to delete"""
+    os.makedirs(STUDENT_TRASH_DIR, exist_ok=True)
+    os.rename(path, os.path.join(STUDENT_TRASH_DIR, uuid.uuid4().hex))
+
+def drain_trash():
+    """Delete everything in the trash folder, including leftovers of an interrupted drain"""
+    # One drain at a time; anything trashed while one runs is left for the next drain
+    if not _trash_drain_lock.acquire(blocking=False):
+        return
+    try:
+        with os.scandir(STUDENT_TRASH_DIR) as it:
+            entries = [entry.path for entry in it]
+        for path in entries:
+            shutil.rmtree(path, ignore_errors=True)
+    except FileNotFoundError:
+        pass
+    finally:
+        _trash_drain_lock.release()
+
 def get_student_data_folders():
     """Get all department-year folders from student data directory"""
     folders = []
     if os.path.exists(STUDENT_DATA_DIR):
-        for folder in os.listdir(STUDENT_DATA_DIR):
-            folder_path = os.path.join(STUDENT_DATA_DIR, folder)
-            if os.path.isdir(folder_path) and "_" in folder:
-                dept, year = folder.split("_", 1)
-                folders.append({"folder": folder, "dept": dept, "year": year})
+        # scandir entries carry their file type, so no extra stat per folder
+        with os.scandir(STUDENT_DATA_DIR) as entries:
+            for entry in entries:
+                dept, sep, year = entry.name.partition("_")
+                if sep and entry.is_dir():
+                    folders.append({"folder": entry.name, "dept": dept, "year": year})
     return folders
 
+# Identifying fields that, when missing from a student JSON file, are filled in and
+# saved back to the file
+STUDENT_FIXED_FIELDS = {'name', 'regNo', 'sessionId', 'year', 'dept', 'dept_id', 'batch', 'qualityCheck'}
+
+# Every field get_students_in_folder fills in when missing
+STUDENT_FIELDS = frozenset(STUDENT_FIXED_FIELDS | {'startTime', 'videoUploaded', 'facesExtracted',
+                                                   'facesOrganized', 'videoPath', 'facesCount'})
+
+# Parsed student JSON files by path, with the (mtime, size, video present) state they
+# were parsed in; a file is only read again once that state changes
+_student_info_cache: Dict[str, Tuple[Tuple[int, int, bool], StudentInfo]] = {}
+
+# Every department-year folder also keeps the parsed records of all its students in
+# one file, each with the state it was parsed in, so a fresh process reads that instead
+# of every student's JSON file; records whose file has changed since are read again
+STUDENT_INDEX_FILE = ".students_index.json"
+
+def load_student_index(folder_path: str) -> Dict[str, Any]:
+    """Read a department-year folder's student index; empty if missing or unreadable"""
+    try:
+        with open(os.path.join(folder_path, STUDENT_INDEX_FILE), 'r') as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+def save_student_index(folder_path: str, entries: Dict[str, Any]):
+    """Replace a department-year folder's student index with entries"""
+    index_path = os.path.join(folder_path, STUDENT_INDEX_FILE)
+    try:
+        with open(index_path + ".tmp", 'w') as f:
+            f.write(json.dumps(entries, separators=(',', ':')))
+        os.replace(index_path + ".tmp", index_path)
+    except OSError as e:
+        print(f"Warning: Could not write student index {index_path}: {e}")
+
 def get_students_in_folder(dept: str, year: str) -> List[StudentInfo]:
     """Get all students in a specific department-year folder"""
     students = []
     folder_path = os.path.join(STUDENT_DATA_DIR, f"{dept}_{year}")
     
-    if os.path.exists(folder_path):
-        for student_folder in os.listdir(folder_path):
-            student_path = os.path.join(folder_path, student_folder)
-            if os.path.isdir(student_path):
-                # Look for student JSON file
-                json_file = os.path.join(student_path, f"{student_folder}.json")
-                if os.path.exists(json_file):
-                    try:
-                        with open(json_file, 'r') as f:
-                            data = json.load(f)
-                            
-                            # Handle missing required fields
-                            if 'regNo' not in data:
-                                data['regNo'] = student_folder
-                                
-                            if 'name' not in data:
-                                data['name'] = f"Student {student_folder}"
-                                
-                            if 'sessionId' not in data:
-                                data['sessionId'] = f"session_{student_folder}"
-                                
-                            if 'year' not in data:
-                                data['year'] = year
-                                
-                            if 'dept' not in data:
-                                # If dept is missing, we need to get the department name
-                                # For now, use the dept parameter (which is dept_id) as fallback
-                                data['dept'] = dept
-                                
-                            if 'dept_id' not in data:
-                                # The dept parameter passed to this function is actually the dept_id from the URL
-                                data['dept_id'] = dept
-                                
-                            if 'batch' not in data:
-                                data['batch'] = f"{dept}_{year}"
-                                
-                            if 'startTime' not in data:
-                                data['startTime'] = ""
-                                
-                            if 'videoUploaded' not in data:
-                                data['videoUploaded'] = os.path.exists(os.path.join(student_path, f"{student_folder}.mp4"))
-                                
-                            if 'facesExtracted' not in data:
-                                data['facesExtracted'] = False
-                                
-                            if 'facesOrganized' not in data:
-                                data['facesOrganized'] = False
-                                
-                            if 'videoPath' not in data:
-                                data['videoPath'] = os.path.join(student_path, f"{student_folder}.mp4")
-                                
-                            if 'facesCount' not in data:
-                                data['facesCount'] = 0
-                                
-                            if 'qualityCheck' not in data:
-                                data['qualityCheck'] = 'not_tested'
-                            
-                            # Try to create the StudentInfo object with the fixed data
-                            students.append(StudentInfo(**data))
-                            
-                            # If we had to fix the JSON, save it back to the file
-                            if any(k not in data for k in ['name', 'regNo', 'sessionId', 'year', 'dept', 'dept_id', 'batch', 'qualityCheck']):
-                                with open(json_file, 'w') as f:
-                                    json.dump(data, f, indent=2)
-                                    
-                    except Exception as e:
-                        print(f"Error reading student data {json_file}: {e}")
+    try:
+        with os.scandir(folder_path) as it:
+            student_dirs = [entry for entry in it if entry.is_dir()]
+    except (FileNotFoundError, NotADirectoryError):
+        return students
+    
+    index = None
+    index_entries = {}
+    index_stale = False
+    for student_dir in student_dirs:
+        student_folder = student_dir.name
+        student_path = student_dir.path
+        
+        # One directory read finds both the student JSON file and the video
+        with os.scandir(student_path) as it:
+            files = {entry.name: entry for entry in it}
+        json_entry = files.get(f"{student_folder}.json")
+        if json_entry is None:
+            continue
+        json_file = json_entry.path
+        
+        try:
+            stat = json_entry.stat()
+            state = (stat.st_mtime_ns, stat.st_size, f"{student_folder}.mp4" in files)
+            cached = _student_info_cache.get(json_file)
+            if cached is None or cached[0] != state:
+                # Fall back to the folder's index before reading the file itself
+                if index is None:
+                    index = load_student_index(folder_path)
+                entry = index.get(student_folder)
+                if entry is not None and entry.get("state") == list(state):
+                    cached = (state, StudentInfo(**entry["data"]))
+                    _student_info_cache[json_file] = cached
+            if cached is not None and cached[0] == state:
+                students.append(cached[1])
+                index_entries[student_folder] = cached
+                continue
+            
+            with open(json_file, 'r') as f:
+                data = json.load(f)
+            
+            # Fill in missing fields; if any of the identifying ones were missing, the
+            # fixed JSON is saved back to the file below. Complete files skip this
+            needs_fix = False
+            if not data.keys() >= STUDENT_FIELDS:
+                defaults = {
+                    'regNo': student_folder,
+                    'name': f"Student {student_folder}",
+                    'sessionId': f"session_{student_folder}",
+                    'year': year,
+                    # If dept is missing, use the dept parameter (which is dept_id from the URL) as fallback
+                    'dept': dept,
+                    'dept_id': dept,
+                    'batch': f"{dept}_{year}",
+                    'startTime': "",
+                    'videoUploaded': state[2],
+                    'facesExtracted': False,
+                    'facesOrganized': False,
+                    'videoPath': os.path.join(student_path, f"{student_folder}.mp4"),
+                    'facesCount': 0,
+                    'qualityCheck': 'not_tested',
+                }
+                missing = defaults.keys() - data.keys()
+                needs_fix = not missing.isdisjoint(STUDENT_FIXED_FIELDS)
+                data.update((key, value) for key, value in defaults.items() if key in missing)
+            
+            # Try to create the StudentInfo object with the fixed data
+            student = StudentInfo(**data)
+            students.append(student)
+            
+            if needs_fix:
+                with open(json_file, 'w') as f:
+                    f.write(json.dumps(data, indent=2))
+                stat = os.stat(json_file)
+                state = (stat.st_mtime_ns, stat.st_size, state[2])
+            _student_info_cache[json_file] = (state, student)
+            index_entries[student_folder] = (state, student)
+            index_stale = True
+                    
+        except Exception as e:
+            print(f"Error reading student data {json_file}: {e}")
+    
+    if index_stale:
+        save_student_index(folder_path, {student_folder: {"state": list(state), "data": student.dict()}
+                                         for student_folder, (state, student) in index_entries.items()})
     
     return students
 
@@ -101,9 +187,12 @@ def get_student_data_summary(dept: str, year: str) -> StudentDataSummary:
     students = get_students_in_folder(dept, year)
     
     total = len(students)
-    with_video = sum(1 for s in students if s.videoUploaded)
+    # Count both flags in a single pass over the students
+    with_video = processed = 0
+    for s in students:
+        with_video += s.videoUploaded
+        processed += s.facesExtracted
     without_video = total - with_video
-    processed = sum(1 for s in students if s.facesExtracted)
     pending = with_video - processed
     
     return StudentDataSummary(
@@ -140,43 +229,18 @@ def process_student_video(student: StudentInfo) -> Dict[str, Any]:
         # Create gallery data directory structure
         os.makedirs(student_gallery_folder, exist_ok=True)
         
-        # Create temporary frames directory for processing
-        temp_frames_dir = os.path.join(student_source_folder, "temp_frames")
-        os.makedirs(temp_frames_dir, exist_ok=True)
-        
-        # Extract frames from video
-        print(f"Extracting frames from {video_path} to {temp_frames_dir}")
-        frame_paths = extract_frames(video_path, temp_frames_dir)
-        print(f"Extracted {len(frame_paths)} frames")
+        # Decode frames and detect faces in batches, saving them in gallery structure;
+        # frames go straight from the decoder to YOLO without being written to disk
+        frame_count, all_face_paths = extract_faces_from_video(video_path, student_gallery_folder)
+        print(f"Used {frame_count} frames")
         
-        if not frame_paths:
+        if not frame_count:
             print(f"No frames extracted from video: {video_path}")
             return {"success": False, "error": f"No frames could be extracted from video: {video_path}"}
         
-        # Process each frame to extract faces and save them in gallery structure
-        all_face_paths = []
-        print(f"Processing {len(frame_paths)} frames for face detection")
-        for i, frame_path in enumerate(frame_paths):
-            print(f"Processing frame {i+1}/{len(frame_paths)}: {frame_path}")
-            face_paths = detect_and_crop_faces(frame_path, student_gallery_folder)
-            print(f"Found {len(face_paths)} faces in frame {i+1}")
-            all_face_paths.extend(face_paths)
-            # Memory cleanup after each frame
-            del face_paths
-            gc.collect()
-        faces_count = len(all_face_paths)  # <-- define before deleting
+        faces_count = len(all_face_paths)
         print(f"Total faces extracted for {student.regNo}: {faces_count}")
         
-        # Clean up temporary frames directory
-        try:
-            for frame_path in frame_paths:
-                if os.path.exists(frame_path):
-                    os.remove(frame_path)
-            if os.path.exists(temp_frames_dir):
-                os.rmdir(temp_frames_dir)
-        except Exception as e:
-            print(f"Warning: Could not clean up temporary frames: {e}")
-        
         # Update student JSON file (only one JSON file per student)
         json_file = os.path.join(student_source_folder, f"{student.regNo}.json")
         try:
@@ -202,18 +266,15 @@ def process_student_video(student: StudentInfo) -> Dict[str, Any]:
 
             # Save updated JSON file
             with open(json_file, 'w') as f:
-                json.dump(student_data, f, indent=2)
+                f.write(json.dumps(student_data, separators=(',', ':')))
         except Exception as e:
             print(f"Error updating student JSON file: {e}")
             return {"success": False, "error": f"Error updating student JSON file: {e}"}
         
-        # Memory cleanup after each student
-        del all_face_paths
-        gc.collect()
         return {
             "success": True, 
             "faces_extracted": faces_count,
-            "frames_processed": len(frame_paths),
+            "frames_processed": frame_count,
             "gallery_path": student_gallery_folder
         }
     except MemoryError as e:
@@ -223,6 +284,18 @@ def process_student_video(student: StudentInfo) -> Dict[str, Any]:
         print(f"Exception processing student {getattr(student, 'regNo', 'unknown')}: {e}")
         return {"success": False, "error": str(e)}
 
+def read_json_containing(f, value: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse the JSON file f (opened in binary mode), or return None without parsing it when
+    the string value appears nowhere in it, so no field of the file can be equal to value
+    """
+    raw = f.read()
+    # Only values needing no escapes (plain ASCII) are spelled the same way by every writer
+    needle = json.dumps(value)
+    if needle == f'"{value}"' and needle.encode() not in raw:
+        return None
+    return json.loads(raw)
+
 def delete_students_by_quality(dept: str, year: str, quality_category: str) -> Dict[str, Any]:
     """Delete students based on quality category"""
     try:
@@ -233,32 +306,38 @@ def delete_students_by_quality(dept: str, year: str, quality_category: str) -> D
         
         deleted_students = []
         
+        with os.scandir(dept_year_dir) as it:
+            student_dirs = [entry for entry in it if entry.is_dir()]
+        
         # Process each student directory
-        for student_id in os.listdir(dept_year_dir):
-            student_path = os.path.join(dept_year_dir, student_id)
-            
-            if not os.path.isdir(student_path):
-                continue
-            
+        for student_dir in student_dirs:
+            student_id = student_dir.name
+            student_path = student_dir.path
             json_path = os.path.join(student_path, f"{student_id}.json")
             
-            if not os.path.exists(json_path):
-                continue
-            
             try:
-                with open(json_path, 'r') as f:
-                    student_data = json.load(f)
+                try:
+                    with open(json_path, 'rb') as f:
+                        student_data = read_json_containing(f, quality_category)
+                except FileNotFoundError:
+                    continue
+                if student_data is None:
+                    continue
                 
                 # Check if student matches the quality category
                 if student_data.get('qualityCategory') == quality_category:
-                    # Delete the entire student directory
-                    shutil.rmtree(student_path)
+                    # Delete the entire student directory; the files themselves are
+                    # removed in the background
+                    move_to_trash(student_path)
                     deleted_students.append(student_id)
                     
             except Exception as e:
                 print(f"Error processing student {student_id}: {e}")
                 continue
         
+        if deleted_students:
+            threading.Thread(target=drain_trash, daemon=True).start()
+        
         return {
             "success": True,
             "message": f"Deleted {len(deleted_students)} students with {quality_category} quality",
@@ -278,21 +357,23 @@ def process_borderline_students(dept: str, year: str) -> Dict[str, Any]:
         
         processed_students = []
         
+        with os.scandir(dept_year_dir) as it:
+            student_dirs = [entry for entry in it if entry.is_dir()]
+        
         # Process each student directory
-        for student_id in os.listdir(dept_year_dir):
-            student_path = os.path.join(dept_year_dir, student_id)
-            
-            if not os.path.isdir(student_path):
-                continue
-            
+        for student_dir in student_dirs:
+            student_id = student_dir.name
+            student_path = student_dir.path
             json_path = os.path.join(student_path, f"{student_id}.json")
             
-            if not os.path.exists(json_path):
-                continue
-            
             try:
-                with open(json_path, 'r') as f:
-                    student_data = json.load(f)
+                try:
+                    with open(json_path, 'rb') as f:
+                        student_data = read_json_containing(f, 'borderline')
+                except FileNotFoundError:
+                    continue
+                if student_data is None:
+                    continue
                 
                 # Check if student is borderline and update to pass
                 if student_data.get('qualityCategory') == 'borderline':
@@ -301,7 +382,7 @@ def process_borderline_students(dept: str, year: str) -> Dict[str, Any]:
                     
                     # Save updated JSON
                     with open(json_path, 'w') as f:
-                        json.dump(student_data, f, indent=2)
+                        f.write(json.dumps(student_data, separators=(',', ':')))
                     
                     processed_students.append(student_id)
                     
@@ -340,10 +421,7 @@ def process_students_videos(dept: str, year: str) -> Dict[str, Any]:
                 "message": "No students available for processing. All students may have failed quality check or already been processed.",
                 "processed_count": 0
             }
-        results = []
-        processed_count = 0
-        processed_students = []  # Define a list to track successfully processed students
-        for student in quality_passed_students:
+        def process(student):
             print(f"Processing student: {student.regNo} - {student.name}")
             try:
                 result = process_student_video(student)
@@ -351,6 +429,19 @@ def process_students_videos(dept: str, year: str) -> Dict[str, Any]:
             except Exception as e:
                 print(f"Exception in process_student_video for {student.regNo}: {e}")
                 result = {"success": False, "error": str(e)}
+            return result
+        
+        # Students are independent, so a few are processed at once: one video decodes
+        # and writes faces while another runs YOLO (the detector itself is shared and
+        # used by one thread at a time)
+        num_workers = max(1, min(STUDENT_PROCESSING_WORKERS, len(quality_passed_students)))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            student_results = list(executor.map(process, quality_passed_students))
+        
+        results = []
+        processed_count = 0
+        processed_students = []  # Define a list to track successfully processed students
+        for student, result in zip(quality_passed_students, student_results):
             results.append({
                 "student": student.regNo,
                 "name": student.name,
@@ -367,7 +458,7 @@ def process_students_videos(dept: str, year: str) -> Dict[str, Any]:
             "processedCount": processed_count,  # Adding this property for frontend compatibility
             "totalPending": len(quality_passed_students),  # Adding this property for frontend compatibility
             "details": results,
-            "students": [student.dict() for student in processed_students]  # Add student info for display
+            "students": processed_students  # Add student info for display (serialized once by the response encoder)
         }
     except MemoryError as e:
         print(f"MemoryError in batch: {e}")
@@ -1,83 +1,95 @@
 import random
-import albumentations as A
+import torch
+import torch.nn.functional as F
 
-def create_face_augmentations():
-    """Create a set of specific augmentations for face images"""
-    augmentations = [
-        # Brightness and Contrast Adjustment
-        A.RandomBrightnessContrast(p=1.0, brightness_limit=(-0.2, 0.2), contrast_limit=(-0.2, 0.2)),
-        
-        # Gaussian Blur
-        A.GaussianBlur(p=1.0, blur_limit=(3, 7)),
-        
-    ]
-    return augmentations
+def downscale_upscale_tensor(images, size):
+    """Downscale (N, C, H, W) images to size x size and back"""
+    height, width = images.shape[-2:]
+    small = F.interpolate(images, size=(size, size), mode='bilinear', align_corners=False)
+    return F.interpolate(small, size=(height, width), mode='bilinear', align_corners=False)
 
-def augment_face_image(image, num_augmentations=3):
+def brightness_contrast_tensor(images, brightness_limit=0.2, contrast_limit=0.2):
+    """Random brightness/contrast on (N, C, H, W) images in [0, 1], one draw per image"""
+    n = images.shape[0]
+    alpha = 1.0 + torch.empty(n, 1, 1, 1, device=images.device).uniform_(-contrast_limit, contrast_limit)
+    beta = torch.empty(n, 1, 1, 1, device=images.device).uniform_(-brightness_limit, brightness_limit)
+    return (images * alpha + beta).clamp_(0.0, 1.0)
+
+def apply_per_image(images, choices):
+    """Apply choices[i] to images[i], running each distinct augmentation once on all images that chose it"""
+    out = torch.empty_like(images)
+    groups = {}
+    for i, choice in enumerate(choices):
+        groups.setdefault(choice, []).append(i)
+    for choice, indices in groups.items():
+        out[indices] = choice(images[indices])
+    return out
+
+def gaussian_blur_tensor(images, blur_limit=(3, 7)):
+    """Gaussian blur on (N, C, H, W) images with a random odd kernel size from blur_limit for each image"""
+    ksizes = range(blur_limit[0], blur_limit[1] + 1, 2)
+    blurs = {ksize: lambda t, ksize=ksize: gaussian_blur_kernel_tensor(t, ksize) for ksize in ksizes}
+    return apply_per_image(images, [blurs[random.choice(ksizes)] for _ in range(images.shape[0])])
+
+def gaussian_blur_kernel_tensor(images, ksize):
+    """Gaussian blur on (N, C, H, W) images with an odd kernel size ksize"""
+    # Same sigma OpenCV derives from the kernel size when sigma is 0
+    sigma = 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+    coords = torch.arange(ksize, dtype=images.dtype, device=images.device) - (ksize - 1) / 2
+    kernel_1d = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    kernel_1d = kernel_1d / kernel_1d.sum()
+    
+    channels = images.shape[1]
+    kernel = (kernel_1d[:, None] * kernel_1d[None, :]).expand(channels, 1, ksize, ksize)
+    padded = F.pad(images, [ksize // 2] * 4, mode='reflect')
+    return F.conv2d(padded, kernel, groups=channels)
+
+DOWNSCALE_TENSOR_AUGMENTATIONS = [
+    lambda t: downscale_upscale_tensor(t, 32),
+    lambda t: downscale_upscale_tensor(t, 24)
+]
+TENSOR_AUGMENTATIONS = [brightness_contrast_tensor, gaussian_blur_tensor]
+
+def _sequence(first, second):
+    """second applied to the output of first"""
+    return lambda t: second(first(t))
+
+# Every ordered pair of two different augmentations, applied one after the other
+MIX_TENSOR_AUGMENTATIONS = [
+    _sequence(first, second)
+    for i, first in enumerate(DOWNSCALE_TENSOR_AUGMENTATIONS + TENSOR_AUGMENTATIONS)
+    for j, second in enumerate(DOWNSCALE_TENSOR_AUGMENTATIONS + TENSOR_AUGMENTATIONS)
+    if i != j
+]
+
+def augment_face_tensor(images, num_augmentations=3):
     """
-    Generate augmented versions of a face image in-memory
+    Generate augmented versions of face images on the images' device
     
-    This function applies a specific augmentation strategy:
-    1. Always applies both downscale-upscale augmentations (32x32 and 24x24)
-    2. Applies one additional random augmentation from the remaining list
+    For each image: both downscale-upscale augmentations (32x32 and 24x24), one random
+    augmentation of the two defined ones (brightness/contrast, Gaussian blur), and one
+    random mix of two of those four applied in sequence.
+    
+    Each image gets its own random choices, but every augmentation runs once over all the
+    images that use it rather than once per image.
     
     Args:
-        image: Original face image (numpy array)
+        images: Preprocessed face image tensor of shape (N, C, H, W), values in [0, 1]
         num_augmentations: Number of augmented versions to generate (default 3)
     
     Returns:
-        List of augmented images (numpy arrays)
+        Tensor of shape (4N, C, H, W) with the four variants of each image in turn
     """
-    augmentations_list = create_face_augmentations()
-    augmented_images = []
-
-    # Mandatory augmentations
-    mandatory_augmentations = [
-        A.Compose([
-            A.Resize(height=32, width=32),
-            A.Resize(height=128, width=128)
-        ]),
-        A.Compose([
-            A.Resize(height=24, width=24),
-            A.Resize(height=128, width=128)
-        ])
-    ]
-
-    # Apply mandatory augmentations
-    for aug in mandatory_augmentations:
-        augmented = aug(image=image)
-        augmented_images.append(augmented['image'])
-
-    # Always apply one random augmentation from the defined two
-    rand_aug = random.choice(augmentations_list)
-    aug_pipeline = A.Compose([rand_aug])
-    augmented = aug_pipeline(image=image)
-    augmented_images.append(augmented['image'])
-
-    # Always apply one mix/double augmentation: randomly combine two augmentations from the four (mandatory + defined)
-    all_augs = mandatory_augmentations + augmentations_list
-    mix_choices = random.sample(all_augs, 2)
-    # Compose them sequentially
-    if isinstance(mix_choices[0], A.Compose) and isinstance(mix_choices[1], A.Compose):
-        # Flatten the transforms
-        transforms_seq = mix_choices[0].transforms + mix_choices[1].transforms
-        mix_aug = A.Compose(transforms_seq)
-    else:
-        # If not both Compose, wrap each in Compose
-        transforms_seq = []
-        for aug in mix_choices:
-            if isinstance(aug, A.Compose):
-                transforms_seq += aug.transforms
-            else:
-                transforms_seq.append(aug)
-        mix_aug = A.Compose(transforms_seq)
-    augmented = mix_aug(image=image)
-    augmented_images.append(augmented['image'])
-
-    # Ensure exactly 4 images (pad with original if needed)
-    while len(augmented_images) < 4:
-        augmented_images.append(image)
-    # If more than 4, trim
-    augmented_images = augmented_images[:4]
-
-    return augmented_images
+    n = images.shape[0]
+    
+    # Mandatory downscale-upscale augmentations
+    augmented_images = [aug(images) for aug in DOWNSCALE_TENSOR_AUGMENTATIONS]
+    
+    # One random augmentation from the defined two
+    augmented_images.append(apply_per_image(images, [random.choice(TENSOR_AUGMENTATIONS) for _ in range(n)]))
+    
+    # One mix of two augmentations applied sequentially
+    augmented_images.append(apply_per_image(images, [random.choice(MIX_TENSOR_AUGMENTATIONS) for _ in range(n)]))
+    
+    # (4, N, ...) -> (N, 4, ...) so each image's variants are next to each other
+    return torch.stack(augmented_images, dim=1).flatten(0, 1)
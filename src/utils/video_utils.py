@@ -0,0 +1,17 @@
+import cv2
+
+def open_video_capture(video_path: str) -> cv2.VideoCapture:
+    """
+    Open a video file for reading, letting OpenCV's FFmpeg backend use hardware
+    decoding (NVDEC, VA-API, ...) where available
+
+    Falls back to a plain software-decoded capture if the hardware-accelerated
+    one can't be opened or this OpenCV build doesn't support the option.
+    """
+    if hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG,
+                               [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    return cv2.VideoCapture(video_path)
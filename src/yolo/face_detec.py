@@ -42,13 +42,16 @@ def detect_and_save_faces(video_path, output_dir="/mnt/data/PROJECTS/face-rec-li
     faces_saved = 0
     
     while True:
-        # Read a frame
-        ret, frame = cap.read()
-        if not ret:
+        # Advance a frame; only frames that get processed are converted to BGR
+        if not cap.grab():
             break
         
         frame_count += 1
-        if frame_count % 2 != 0:  # Process every 15th frame to save compute
+        if frame_count % 2 != 0:  # Process every 2nd frame to save compute
+            continue
+        
+        ret, frame = cap.retrieve()
+        if not ret:
             continue
         
         # Detect faces on the original resolution 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for password hashing, verification and the legacy hash upgrade in auth_service.
+"""
+
+import os
+import sys
+import hashlib
+import tempfile
+
+# Add the src directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+# auth_service creates its users table on import, so point it at a scratch database first
+import config.settings
+_test_dir = tempfile.mkdtemp()
+os.makedirs(os.path.join(_test_dir, 'data'), exist_ok=True)
+config.settings.BASE_DIR = _test_dir
+
+from services import auth_service
+from services.auth_service import (
+    hash_password, verify_password, authenticate_user, add_admin_user,
+    get_db_conn, PASSWORD_HASH_PREFIX
+)
+
+def test_hash_and_verify():
+    """A PBKDF2 hash verifies its own password and nothing else."""
+    stored = hash_password('s3cret')
+    assert stored.startswith(PASSWORD_HASH_PREFIX + '$')
+    assert verify_password('s3cret', stored)
+    assert not verify_password('wrong', stored)
+
+def test_hashes_are_salted():
+    """The same password hashes differently each time."""
+    assert hash_password('s3cret') != hash_password('s3cret')
+
+def test_iterations_are_read_from_the_hash():
+    """Hashes made with another work factor still verify."""
+    stored = hash_password('s3cret', iterations=1000)
+    assert stored.split('$')[1] == '1000'
+    assert verify_password('s3cret', stored)
+
+def test_legacy_sha256_hash_verifies():
+    """Unsalted SHA256 hex digests from before PBKDF2 are still accepted."""
+    legacy = hashlib.sha256('s3cret'.encode()).hexdigest()
+    assert verify_password('s3cret', legacy)
+    assert not verify_password('wrong', legacy)
+
+def test_malformed_hash_is_rejected():
+    """A corrupt PBKDF2 value fails verification instead of raising."""
+    for stored in (PASSWORD_HASH_PREFIX + '$', PASSWORD_HASH_PREFIX + '$abc$zz$00',
+                   PASSWORD_HASH_PREFIX + '$1000$nothex$00', PASSWORD_HASH_PREFIX + '$1$2$3$4'):
+        assert not verify_password('s3cret', stored)
+
+def test_malformed_hash_login_is_invalid_credentials():
+    """Logging in against a corrupt stored hash reports invalid credentials."""
+    conn = get_db_conn()
+    conn.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
+                 ('broken_hash_user', PASSWORD_HASH_PREFIX + '$x$y$z', 'admin'))
+    conn.commit()
+    result = authenticate_user('broken_hash_user', 's3cret')
+    assert result == {"success": False, "message": "Invalid credentials"}
+
+def test_legacy_hash_is_upgraded_on_login():
+    """A successful login with a legacy hash rewrites it as PBKDF2, and the login keeps working."""
+    conn = get_db_conn()
+    conn.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
+                 ('legacy_user', hashlib.sha256('s3cret'.encode()).hexdigest(), 'admin'))
+    conn.commit()
+
+    assert authenticate_user('legacy_user', 's3cret') == {"success": True, "role": 'admin'}
+    stored = conn.execute('SELECT password FROM users WHERE username = ?', ('legacy_user',)).fetchone()[0]
+    assert stored.startswith(PASSWORD_HASH_PREFIX + '$')
+
+    assert authenticate_user('legacy_user', 's3cret') == {"success": True, "role": 'admin'}
+    assert authenticate_user('legacy_user', 'wrong')["success"] is False
+
+def test_failed_legacy_login_keeps_hash():
+    """A wrong password does not touch a legacy hash."""
+    legacy = hashlib.sha256('s3cret'.encode()).hexdigest()
+    conn = get_db_conn()
+    conn.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
+                 ('legacy_user_2', legacy, 'admin'))
+    conn.commit()
+
+    assert authenticate_user('legacy_user_2', 'wrong')["success"] is False
+    stored = conn.execute('SELECT password FROM users WHERE username = ?', ('legacy_user_2',)).fetchone()[0]
+    assert stored == legacy
+
+def test_new_admin_is_stored_with_pbkdf2():
+    """Admins added through add_admin_user get a PBKDF2 hash."""
+    assert add_admin_user('new_admin', 's3cret')["success"]
+    stored = get_db_conn().execute('SELECT password FROM users WHERE username = ?', ('new_admin',)).fetchone()[0]
+    assert stored.startswith(PASSWORD_HASH_PREFIX + '$')
+    assert authenticate_user('new_admin', 's3cret')["success"]
+
+if __name__ == "__main__":
+    print(f"Using scratch database {auth_service.DB_PATH}")
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✓ {name}")
+    print("\n🎉 All auth tests passed!")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the content-addressed embedding cache and its pruning of stale model entries.
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+
+# Add the src directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from ml.embedding_cache import EmbeddingCache
+
+_test_dir = tempfile.mkdtemp()
+DB_PATH = os.path.join(_test_dir, 'embedding_cache.db')
+
+def _write(path, data, mtime_ns=None):
+    with open(path, 'wb') as f:
+        f.write(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+def _embedding(seed):
+    return np.random.default_rng(seed).standard_normal(256).astype(np.float32)
+
+def _cached(model_path, image_path):
+    """Look an image up in a fresh cache, as a gallery build would"""
+    with EmbeddingCache(model_path, DB_PATH) as cache:
+        h = cache.hash_file(image_path)
+        return cache.get_many([h]).get(h)
+
+def _store(model_path, image_path, embedding):
+    with EmbeddingCache(model_path, DB_PATH) as cache:
+        cache.put_many([(cache.hash_file(image_path), embedding)])
+
+def _stored_models():
+    with EmbeddingCache(os.path.join(_test_dir, 'no_such_model.pth'), DB_PATH) as cache:
+        return {model for (model,) in cache.conn.execute("SELECT DISTINCT model FROM embeddings")}
+
+def test_hit():
+    """An unchanged image under unchanged weights is served from the cache."""
+    model = _write(os.path.join(_test_dir, 'hit.pth'), b'weights')
+    image = _write(os.path.join(_test_dir, 'hit.jpg'), b'face')
+    embedding = _embedding(0)
+    _store(model, image, embedding)
+    assert np.array_equal(_cached(model, image), embedding)
+
+def test_miss_after_image_changes():
+    """Editing an image's bytes makes it a different cache entry."""
+    model = _write(os.path.join(_test_dir, 'image_change.pth'), b'weights')
+    image = _write(os.path.join(_test_dir, 'image_change.jpg'), b'face')
+    _store(model, image, _embedding(1))
+    _write(image, b'another face')
+    assert _cached(model, image) is None
+
+def test_miss_after_model_changes():
+    """Retraining the weights in place invalidates everything cached under them."""
+    model = _write(os.path.join(_test_dir, 'model_change.pth'), b'weights', mtime_ns=10**18)
+    image = _write(os.path.join(_test_dir, 'model_change.jpg'), b'face')
+    _store(model, image, _embedding(2))
+    _write(model, b'retrained weights', mtime_ns=10**18 + 1)
+    assert _cached(model, image) is None
+
+def test_stale_model_entries_are_pruned():
+    """Entries of retrained or deleted weights are removed when a cache is opened."""
+    kept = _write(os.path.join(_test_dir, 'kept.pth'), b'weights')
+    retrained = _write(os.path.join(_test_dir, 'retrained.pth'), b'weights', mtime_ns=10**18)
+    deleted = _write(os.path.join(_test_dir, 'deleted.pth'), b'weights')
+    image = _write(os.path.join(_test_dir, 'prune.jpg'), b'face')
+    for model in (kept, retrained, deleted):
+        _store(model, image, _embedding(3))
+    old_keys = {EmbeddingCache.model_key(path) for path in (retrained, deleted)}
+
+    _write(retrained, b'retrained weights', mtime_ns=10**18 + 1)
+    os.remove(deleted)
+
+    stored = _stored_models()
+    assert EmbeddingCache.model_key(kept) in stored
+    assert not stored & old_keys
+    assert _cached(kept, image) is not None
+
+if __name__ == "__main__":
+    print(f"Using scratch cache {DB_PATH}")
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✓ {name}")
+    print("\n🎉 All embedding cache tests passed!")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for the one-to-one identity assignment used by recognize_faces.
+"""
+
+import os
+import sys
+import numpy as np
+
+# Add the src directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from services.gallery_service import assign_identities
+
+def _assign(scores, candidates, threshold=0.5):
+    return assign_identities(np.array(scores, dtype=np.float32),
+                             np.array(candidates, dtype=np.int64), threshold)
+
+def _assigned_indices(assignment):
+    return [assigned[0] for assigned in assignment if assigned is not None]
+
+def test_no_identity_is_assigned_twice():
+    """Two faces whose best match is the same identity do not both get it."""
+    assignment = _assign([[0.9, 0.7], [0.8, 0.6]], [[3, 5], [3, 5]])
+    indices = _assigned_indices(assignment)
+    assert len(indices) == len(set(indices))
+    assert sorted(indices) == [3, 5]
+
+def test_total_similarity_beats_greedy():
+    """The assignment maximizes the total, not the first face's score."""
+    # Greedy would give identity 1 to face 0 (0.9) and leave face 1 with nothing
+    assignment = _assign([[0.9, 0.85], [0.88, 0.1]], [[1, 2], [1, 2]])
+    assert assignment[0][0] == 2
+    assert assignment[1][0] == 1
+
+def test_below_threshold_is_unassigned():
+    """Faces with no match at or above threshold get no identity."""
+    assignment = _assign([[0.4, 0.3], [0.9, 0.2]], [[0, 1], [2, 0]])
+    assert assignment[0] is None
+    assert assignment[1][0] == 2
+    assert abs(assignment[1][1] - 0.9) < 1e-6
+
+def test_losing_face_falls_back_to_unassigned():
+    """A face whose only good match went to a better face gets no identity."""
+    assignment = _assign([[0.95, 0.1], [0.8, 0.2]], [[7, 8], [7, 9]])
+    assert assignment[0][0] == 7
+    assert assignment[1] is None
+
+def test_more_faces_than_identities():
+    """Every identity is used at most once even when faces outnumber them."""
+    assignment = _assign([[0.9], [0.8], [0.7]], [[4], [4], [4]])
+    assert _assigned_indices(assignment) == [4]
+    assert assignment[0][0] == 4
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✓ {name}")
+    print("\n🎉 All identity assignment tests passed!")